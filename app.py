@@ -1,10 +1,23 @@
 from flask import Flask, render_template, request, jsonify, send_from_directory, session, flash, redirect, url_for, send_file
 import pandas as pd
+from pandas.io.parsers import TextParser
+from pandas.errors import EmptyDataError
+import numpy as np
+import openpyxl
 import os
+import shutil
+from itertools import chain, compress, count, groupby, islice, repeat
+import heapq
+from collections import OrderedDict
+from operator import itemgetter
+from collections.abc import MutableMapping
+from bisect import bisect_left
+import sys
 from werkzeug.utils import secure_filename
 import json
 from datetime import datetime
 import re
+import unicodedata
 import mysql.connector
 from reportlab.lib.pagesizes import letter
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
@@ -13,20 +26,69 @@ from reportlab.lib.units import inch
 from reportlab.lib import colors
 import urllib.parse
 import io
+import time
+import threading
+import hashlib
+import pickle
+import zlib
+import uuid
+import mmap
+import multiprocessing
+import sqlite3
+from contextlib import contextmanager
+try:
+    import fcntl  # Solo para el modo compartido entre workers (Unix)
+except ImportError:
+    fcntl = None
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from scipy import sparse
+from scipy.optimize import milp, LinearConstraint, Bounds
 
 app = Flask(__name__)
 app.secret_key = "tios"  
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['PDFS_FOLDER'] = 'pdfs'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['STREAMING_THRESHOLD'] = 4 * 1024 * 1024  # Desde este tamaño los .xlsx se procesan en streaming
+app.config['STORE_BATCH_SIZE'] = 20000  # Productos parseados que se pasan juntos a la tabla al publicar una lista
+app.config['PROCESS_POOL_WORKERS'] = os.cpu_count() or 2  # Procesos para parsear hojas en paralelo
+app.config['PDF_POOL_WORKERS'] = 2  # Procesos para los PDFs de pedido (aparte: no esperan detrás de una carga)
+app.config['INGEST_JOB_WORKERS'] = 2  # Cargas en segundo plano que se procesan a la vez
+app.config['INGEST_JOBS_KEPT'] = 100  # Cargas terminadas que se siguen pudiendo consultar
+app.config['PARSE_CACHE_FOLDER'] = 'cache'
+app.config['PARSE_CACHE_MAX_BYTES'] = 256 * 1024 * 1024  # Tamaño máximo de la caché de listas parseadas
+app.config['CATALOG_FOLDER'] = 'catalog'  # Catálogo persistido: se vuelve a cargar al arrancar
+app.config['SEARCH_PAGE_SIZE'] = 50  # Resultados por página de /search si no se pide limit
+app.config['SEARCH_MAX_LIMIT'] = 500  # Máximo limit aceptado por /search
+app.config['SEARCH_BATCH_MAX_QUERIES'] = 500  # Renglones por lista de compras en /search/batch
+app.config['SEARCH_BATCH_PAGE_SIZE'] = 3  # Ofertas por renglón si no se pide otra cantidad
+app.config['SEARCH_CACHE_MAX_BYTES'] = 32 * 1024 * 1024  # Memoria máxima de la caché de respuestas de /search
+app.config['MATCH_THRESHOLD'] = 0.8  # Similitud coseno mínima para considerar dos productos el mismo
+app.config['MATCH_FEATURES'] = 2 ** 20  # Columnas de los vectores de trigramas (hashing)
+app.config['MATCH_MAX_BLOCK_PAIRS'] = 250000  # Palabras que generan más pares que esto no se usan para blocking
+# Varios workers (gunicorn -w N): el catálogo se comparte por los archivos mmap de CATALOG_FOLDER y los
+# carritos y datos del comercio van a SQLite; con un solo proceso todo queda en memoria como siempre
+app.config['SHARED_STATE'] = os.environ.get('SHARED_STATE', '').lower() in ('1', 'true', 'on')
+app.config['STATE_DB'] = 'state.db'  # Base SQLite (modo WAL) de carritos y datos del comercio en modo compartido
+app.config['PDF_STORE_MAX_BYTES'] = 64 * 1024 * 1024  # PDFs de pedido que se guardan en memoria para descargar
+app.config['PDF_PERSIST'] = True  # Guardar también los PDFs en PDFS_FOLDER (en segundo plano)
+app.config['BASKET_TIME_LIMIT'] = 1.0  # Segundos máximos del optimizador de carrito (devuelve la mejor solución hallada)
+
+# Versión de las reglas de parseo: SUBIRLA cada vez que cambie cómo se detectan columnas o se limpian
+# precios, así la caché de listas parseadas deja de devolver resultados viejos
+# v4: la columna de producto se lee como texto y cada celda de precio por su tipo (el número 12 es 12.0, el texto "12" no es precio)
+PARSER_VERSION = 4
 
 # Crear carpetas si no existen
-for folder in [app.config['UPLOAD_FOLDER'], app.config['PDFS_FOLDER']]:
+for folder in [app.config['UPLOAD_FOLDER'], app.config['PDFS_FOLDER'], app.config['PARSE_CACHE_FOLDER'], app.config['CATALOG_FOLDER']]:
     if not os.path.exists(folder):
         os.makedirs(folder)
 
 # Almacenamiento global para las listas de precios y carritos
 price_lists = {}
+catalog_lock = threading.Lock()  # Serializa las publicaciones de listas en price_lists
+catalog_generation = 0  # Sube con cada cambio del catálogo (invalida la caché de búsquedas)
 user_carts = {}  # Carritos por usuario
 business_info = {}  # Información del comercio por usuario
 
@@ -50,46 +112,9 @@ class PriceListProcessor:
     def __init__(self):
         self.possible_product_columns = ['producto', 'descripcion', 'item', 'nombre', 'description', 'product', 'nombre del articulo', 'nombre del producto', 'articulo']
         self.possible_price_columns = ['precio', 'price', 'costo', 'valor', 'cost', 'amount', 'Importe c/IVA', 'importe', 'efectivo', 'unitario', 'pcio', 'prcio', 'prcio', 'precio unitario', 'precio unit', 'p.unit', 'pu', 'precio u', 'lista', 'precio lista', 'tarifa', 'neto']
-    
-    def find_column_index(self, df, possible_names):
-        """Encuentra el índice de la columna basándose en nombres posibles"""
-        columns_lower = [str(col).lower().strip() for col in df.columns]
-        
-        for name in possible_names:
-            for i, col in enumerate(columns_lower):
-                if name in col:
-                    return i
-        return None
-    
-    def find_column_in_first_rows(self, df, possible_names, max_rows=8):
-        """
-        Busca columnas de producto/precio en las primeras filas del DataFrame
-        Útil cuando los headers reales están en filas posteriores
-        """
-        print(f"🔍 Buscando columnas en las primeras {max_rows} filas...")
-        
-        # Limitar a las primeras max_rows filas disponibles
-        search_rows = min(max_rows, len(df))
-        
-        for row_idx in range(search_rows):
-            print(f"📋 Analizando fila {row_idx}: {list(df.iloc[row_idx].values)}")
-            
-            # Convertir los valores de la fila a strings y limpiarlos
-            row_values = [str(val).lower().strip() if pd.notna(val) else '' for val in df.iloc[row_idx].values]
-            
-            # Buscar coincidencias con nombres posibles
-            found_columns = {}
-            for col_idx, cell_value in enumerate(row_values):
-                if cell_value:  # Solo si la celda no está vacía
-                    for name in possible_names:
-                        if name in cell_value:
-                            found_columns[col_idx] = (cell_value, name)
-                            print(f"✅ Encontrado '{name}' en columna {col_idx}, fila {row_idx}: '{cell_value}'")
-            
-            if found_columns:
-                return row_idx, found_columns
-        
-        return None, {}
+        self.header_search_rows = 8  # Filas en las que se buscan headers que no están en la primera fila
+        self.stream_batch_size = 5000  # Productos por lote en el motor de streaming
+        self.header_matcher, self.header_keywords = self._build_header_matcher()
     
     def clean_price(self, price_str):
         """Limpia y convierte string de precio a float - SOLO acepta valores que realmente parezcan precios"""
@@ -148,195 +173,2296 @@ class PriceListProcessor:
         except:
             return None
     
+    def clean_price_series(self, prices):
+        """
+        Versión vectorizada de clean_price: aplica las mismas reglas de rechazo a una Serie completa.
+        Devuelve una Serie float64 alineada con la original, con NaN donde el valor no es un precio
+        """
+        result = pd.Series(np.nan, index=prices.index, dtype='float64')
+        
+        values = prices[prices.notna()].astype(str).str.strip()
+        
+        # RECHAZO INMEDIATO: letras (incluye la "X" de cantidad), números de 1-2 dígitos sin formato,
+        # o strings sin ningún dígito
+        values = values[
+            ~values.str.contains(r'[a-zA-Z]', regex=True)
+            & ~values.str.fullmatch(r'\d{1,2}')
+            & values.str.contains(r'\d', regex=True)
+        ]
+        
+        # Remover símbolos de moneda al inicio y todo lo que no sea dígito, punto o coma
+        values = values.str.replace(r'^[\$€£¥₹₩₽¢]+\s*', '', regex=True)
+        values = values.str.replace(r'[^\d.,]', '', regex=True)
+        values = values[~values.isin(['.', ',', '.,', ',.']) & (values.str.len() > 1)]
+        
+        # Formato argentino: con punto y coma el punto es separador de miles; la coma siempre es decimal
+        has_both = values.str.contains(',', regex=False) & values.str.contains('.', regex=False)
+        values = values.where(~has_both, values.str.replace('.', '', regex=False))
+        values = values.str.replace(',', '.', regex=False)
+        
+        # Solo convertir lo que float() aceptaría (un único punto decimal)
+        values = values[values.str.fullmatch(r'\d*\.?\d*')]
+        numbers = values.astype('float64')
+        numbers = numbers[(numbers > 0.10) & (numbers <= 999999)]
+        result[numbers.index] = numbers
+        return result
+    
+    def _row_dtype(self, df):
+        """Dtype común de las filas, igual al que usaría iterrows() para construir cada fila"""
+        dtypes = set(df.dtypes)
+        if len(dtypes) == 1:
+            return dtypes.pop()
+        if all(isinstance(dt, np.dtype) and dt.kind in 'iuf' for dt in dtypes):
+            return np.result_type(*dtypes)
+        return object
+    
+    def extract_products(self, df, product_col, price_col, supplier_name, sheet_name, first_number=0, show_debug=True):
+        """
+        Extrae en bloque los productos válidos de una hoja ya encabezada.
+        first_number permite seguir la numeración de IDs cuando la hoja llega en varios lotes.
+        Devuelve (productos, cantidad de precios inválidos omitidos)
+        """
+        # Una columna inexistente o duplicada haría fallar cada fila: no hay productos
+        for col in (product_col, price_col):
+            if col not in df.columns or isinstance(df[col], pd.DataFrame):
+                print(f"❌ Columna '{col}' no disponible o duplicada en {sheet_name}")
+                return [], 0
+        
+        row_dtype = self._row_dtype(df)
+        products = df[product_col]
+        prices_raw = df[price_col]
+        if row_dtype != object:
+            products = products.astype(row_dtype)
+            prices_raw = prices_raw.astype(row_dtype)
+        
+        names = products.astype(str).str.strip()
+        has_product = products.notna() & (names != '')
+        prices = self.clean_price_series(prices_raw[has_product])
+        accepted = prices.notna()
+        skipped_invalid_prices = int((~accepted & prices_raw[has_product].notna()).sum())
+        
+        accepted_index = accepted.index[accepted.to_numpy()]
+        accepted_names = names[accepted_index].tolist()
+        accepted_prices = prices[accepted_index].tolist()
+        
+        # DEBUG: Mostrar exactamente qué está leyendo en las primeras filas
+        for idx in (prices.index[:3] if show_debug else []):
+            print(f"🔍 DEBUG Fila {idx}: Producto='{products[idx]}', Precio RAW='{prices_raw[idx]}' -> {prices.get(idx)}")
+        
+        location = DEFAULT_LOCATIONS.get(supplier_name, 'Buenos Aires, Argentina')
+        sheet_products = [
+            {
+                'product': name,
+                'price': price,
+                'supplier': supplier_name,
+                'sheet': sheet_name,
+                'location': location,
+                'id': f"{supplier_name}_{sheet_name}_{idx}_{n}",  # Posición en la hoja; el catálogo usa un id por contenido (product_id_hash)
+                'search_key': normalize_search_text(name)  # Clave normalizada para /search
+            }
+            for n, (idx, name, price) in enumerate(zip(accepted_index, accepted_names, accepted_prices), first_number)
+        ]
+        return sheet_products, skipped_invalid_prices
+    
+    def read_sheet_rows(self, excel_file, sheet_name):
+        """
+        Lee una hoja UNA sola vez como filas crudas (sin inferir tipos ni headers).
+        A partir de estas filas se arman en memoria todos los DataFrames que hagan falta
+        """
+        raw = pd.read_excel(excel_file, sheet_name=sheet_name, header=None, dtype=object, na_filter=False)
+        return raw.values.tolist()
+    
+    def frame_from_rows(self, rows, header=None, text_columns=(), number_columns=()):
+        """
+        Arma un DataFrame desde filas crudas, igual que pd.read_excel con ese header pero sin volver a leer el XML.
+        Las columnas text_columns (posiciones) se leen como texto: un código numérico queda "123" y no "123.0".
+        En number_columns cada celda se lee por lo que es: las numéricas como float y las de texto como texto
+        (sin convertir "12" en número). Así el valor de una celda no depende de qué otras filas vengan en el
+        mismo DataFrame (la hoja entera o un lote del motor en streaming)
+        """
+        if not rows:
+            return pd.DataFrame()
+        if number_columns:
+            start = 0 if header is None else header + 1
+            rows = rows[:start] + [self._ints_as_float(row, number_columns) for row in rows[start:]]
+        try:
+            dtype = {column: str for column in text_columns}
+            dtype.update((column, object) for column in number_columns)
+            return TextParser(rows, header=header, skip_blank_lines=False, dtype=dtype).read()
+        except EmptyDataError:
+            return pd.DataFrame()
+    
+    @staticmethod
+    def _ints_as_float(row, columns):
+        """La fila con las celdas enteras de esas columnas como float (la misma fila si no tiene ninguna)"""
+        if not any(column < len(row) and type(row[column]) is int for column in columns):
+            return row
+        row = list(row)
+        for column in columns:
+            if column < len(row) and type(row[column]) is int:
+                row[column] = float(row[column])
+        return row
+    
+    def _build_header_matcher(self):
+        """
+        Compila todas las palabras clave de producto y precio en una sola expresión regular.
+        Devuelve (regex, {palabra clave: {'product', 'price'}})
+        """
+        keyword_kinds = {}
+        for kind, names in (('product', self.possible_product_columns), ('price', self.possible_price_columns)):
+            for name in names:
+                keyword_kinds.setdefault(self._normalize_header(name), set()).add(kind)
+        
+        # Las más largas primero: "precio unitario" gana sobre "precio" en la misma posición
+        pattern = '|'.join(re.escape(keyword) for keyword in sorted(keyword_kinds, key=len, reverse=True))
+        return re.compile(pattern), keyword_kinds
+    
+    def _normalize_header(self, value):
+        """Texto de una celda en minúsculas, sin acentos ni espacios extremos ('' si está vacía)"""
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            return ''
+        text = unicodedata.normalize('NFKD', str(value).lower().strip())
+        return ''.join(char for char in text if not unicodedata.combining(char))
+    
+    def _keyword_score(self, cell, match):
+        """
+        Puntaje de una coincidencia según cómo aparece la palabra clave en la celda:
+        palabra completa > comienzo de palabra ("precios") > dentro de otra palabra ("pu" en "computo").
+        Las palabras clave más largas (más específicas) suman un poco más
+        """
+        start, end = match.span()
+        starts_word = start == 0 or not cell[start - 1].isalnum()
+        ends_word = end == len(cell) or not cell[end].isalnum()
+        
+        if starts_word and ends_word:
+            quality = 2.0
+        elif starts_word:
+            quality = 1.0
+        else:
+            quality = 0.25
+        return quality + len(match.group()) / 100
+    
+    def _price_ratio(self, head_rows, header_row, col_idx):
+        """Proporción de celdas debajo del header (dentro de las filas leídas) que son precios válidos"""
+        values = [row[col_idx] for row in head_rows[header_row + 1:] if col_idx < len(row) and self._normalize_header(row[col_idx])]
+        if not values:
+            return 0.0
+        return sum(self.clean_price(value) is not None for value in values) / len(values)
+    
+    def detect_columns(self, head_rows, sheet_name, debug_info):
+        """
+        Detecta la fila de header y las columnas de producto y precio mirando solo las primeras filas.
+        Recorre las celdas una sola vez buscando todas las palabras clave a la vez, puntúa cada
+        combinación (fila, columna de producto, columna de precio) y se queda con la mejor.
+        Devuelve (header_row, product_col_idx, price_col_idx) o None si la hoja no se puede procesar
+        """
+        head_rows = head_rows[:self.header_search_rows]
+        product_hits = []  # (puntaje, fila, columna)
+        price_hits = []
+        
+        for row_idx, row in enumerate(head_rows):
+            for col_idx, value in enumerate(row):
+                cell = self._normalize_header(value)
+                if not cell:
+                    continue
+                
+                scores = {}
+                for match in self.header_matcher.finditer(cell):
+                    score = self._keyword_score(cell, match)
+                    for kind in self.header_keywords[match.group()]:
+                        scores[kind] = max(scores.get(kind, 0.0), score)
+                
+                if 'product' in scores:
+                    product_hits.append((scores['product'], row_idx, col_idx))
+                if 'price' in scores:
+                    price_hits.append((scores['price'], row_idx, col_idx))
+        
+        # Mejor combinación con producto y precio en la misma fila. A igual puntaje gana la fila
+        # más arriba y, dentro de la fila, las columnas más a la izquierda
+        best = None
+        for product_score, row_idx, product_col_idx in product_hits:
+            for price_score, price_row, price_col_idx in price_hits:
+                if price_row != row_idx or price_col_idx == product_col_idx:
+                    continue
+                score = product_score + price_score + 0.5 * self._price_ratio(head_rows, row_idx, price_col_idx)
+                candidate = (-score, row_idx, product_col_idx, price_col_idx)
+                if best is None or candidate < best:
+                    best = candidate
+        
+        if best is not None:
+            score, header_row, product_col_idx, price_col_idx = -best[0], best[1], best[2], best[3]
+        else:
+            # Sin una fila que tenga ambas: producto y precio pueden estar en filas distintas
+            header_row = 0
+            product_col_idx = price_col_idx = None
+            score = 0.0
+            if product_hits:
+                product_score, product_row, product_col_idx = min(product_hits, key=lambda hit: (-hit[0], hit[1], hit[2]))
+                header_row = product_row
+                score += product_score
+            other_price_hits = [hit for hit in price_hits if hit[2] != product_col_idx]
+            if other_price_hits:
+                price_score, price_row, price_col_idx = min(other_price_hits, key=lambda hit: (-hit[0], hit[1], hit[2]))
+                header_row = max(header_row, price_row)
+                score += price_score
+        
+        header_values = list(head_rows[header_row]) if header_row < len(head_rows) else []
+        
+        if product_col_idx is None:
+            print(f"❌ No se encontró columna de producto en {sheet_name}")
+            debug_info.append(f"Hoja {sheet_name}: No se encontró columna de producto")
+            return None
+        
+        if price_col_idx is None:
+            if price_hits:
+                # La única columna con pinta de precio es la misma que la de producto
+                print(f"❌ ERROR CRÍTICO: La misma columna ({product_col_idx}) se detectó para producto Y precio")
+                debug_info.append(f"Hoja {sheet_name}: ERROR - misma columna para producto y precio (col {product_col_idx})")
+                return None
+            print(f"❌ No se encontró columna de precio en {sheet_name}")
+            print(f"📋 Valores de la fila header ({header_row}): {header_values}")
+            debug_info.append(f"Hoja {sheet_name}: No se encontró columna de precio. Columnas disponibles: {header_values}")
+            return None
+        
+        print(f"🎯 Header en fila {header_row}: producto en columna {product_col_idx}, precio en columna {price_col_idx} (puntaje {score:.2f})")
+        return header_row, product_col_idx, price_col_idx
+    
+    def process_sheet(self, rows, sheet_name, supplier_name, debug_info, stats=None):
+        """
+        Detecta las columnas de una hoja ya leída y extrae sus productos.
+        Si se pasa stats (dict), se completa con filas leídas, productos aceptados y precios rechazados
+        """
+        if stats is not None:
+            stats.update(rows=len(rows), accepted=0, rejected=0)
+        
+        if not rows or not rows[0]:
+            print(f"⚠️ Hoja {sheet_name} está vacía")
+            debug_info.append(f"Hoja {sheet_name}: vacía")
+            return []
+        
+        print(f"📏 Dimensiones de {sheet_name}: {(len(rows), len(rows[0]))}")
+        debug_info.append(f"Hoja {sheet_name}: {len(rows)} filas, {len(rows[0])} columnas")
+        
+        # Para detectar headers alcanza con las primeras filas: no hace falta armar la hoja completa
+        detected = self.detect_columns(rows[:self.header_search_rows], sheet_name, debug_info)
+        if detected is None:
+            return []
+        header_row, product_col_idx, price_col_idx = detected
+        
+        # Crear DataFrame con el header correcto, re-encabezando las filas ya leídas
+        df_processed = self.frame_from_rows(rows, header=header_row, text_columns=[product_col_idx] if product_col_idx < len(rows[0]) else [],
+                                            number_columns={price_col_idx})
+        if header_row > 0:
+            # Ajustar los índices de columna ya que el DataFrame cambió
+            if len(df_processed.columns) > product_col_idx:
+                product_col = df_processed.columns[product_col_idx]
+            else:
+                product_col = product_col_idx
+            
+            if len(df_processed.columns) > price_col_idx:
+                price_col = df_processed.columns[price_col_idx]
+            else:
+                price_col = price_col_idx
+        else:
+            product_col = df_processed.columns[product_col_idx]
+            price_col = df_processed.columns[price_col_idx]
+        
+        print(f"✅ Columnas detectadas - Producto: '{product_col}' (col {product_col_idx}), Precio: '{price_col}' (col {price_col_idx})")
+        print(f"📍 Header detectado en fila: {header_row}")
+        debug_info.append(f"Hoja {sheet_name}: Producto='{product_col}', Precio='{price_col}', Header en fila {header_row}")
+        
+        # Extraer todas las filas de la hoja en bloque (vectorizado)
+        sheet_products, skipped_invalid_prices = self.extract_products(
+            df_processed, product_col, price_col, supplier_name, sheet_name
+        )
+        products_in_sheet = len(sheet_products)
+        if stats is not None:
+            stats.update(accepted=products_in_sheet, rejected=skipped_invalid_prices)
+        
+        print(f"✅ Productos válidos en {sheet_name}: {products_in_sheet}")
+        if skipped_invalid_prices > 0:
+            print(f"⚠️ Precios inválidos omitidos: {skipped_invalid_prices}")
+        debug_info.append(f"Hoja {sheet_name}: {products_in_sheet} productos válidos, {skipped_invalid_prices} precios inválidos omitidos")
+        return sheet_products
+    
+    def _convert_row(self, row):
+        """Normaliza una fila de openpyxl igual que el lector de pandas (celdas vacías como '' y enteros sin .0)"""
+        return [
+            '' if value is None else int(value) if isinstance(value, float) and value.is_integer() else value
+            for value in row
+        ]
+    
+    def iter_sheet_products(self, worksheet, supplier_name, debug_info, batch_size, progress=None):
+        """
+        Recorre una hoja fila por fila y entrega sus productos en lotes de a lo sumo batch_size.
+        progress(rows, accepted, rejected) se llama después de cada lote
+        """
+        sheet_name = worksheet.title
+        
+        # Algunos archivos declaran mal sus dimensiones: recorrer solo las celdas que existen
+        worksheet.reset_dimensions()
+        rows = (self._convert_row(row) for row in worksheet.iter_rows(values_only=True))
+        
+        # Solo las primeras filas quedan en memoria, para detectar el header
+        head_rows = list(islice(rows, self.header_search_rows))
+        width = max((len(row) for row in head_rows), default=0)
+        if width == 0:
+            print(f"⚠️ Hoja {sheet_name} está vacía")
+            debug_info.append(f"Hoja {sheet_name}: vacía")
+            return
+        head_rows = [row + [''] * (width - len(row)) for row in head_rows]
+        
+        detected = self.detect_columns(head_rows, sheet_name, debug_info)
+        if detected is None:
+            return
+        header_row, product_col_idx, price_col_idx = detected
+        
+        header_labels = self.frame_from_rows(head_rows[header_row:header_row + 1], header=0).columns
+        product_col = header_labels[product_col_idx]
+        price_col = header_labels[price_col_idx]
+        print(f"✅ Columnas detectadas - Producto: '{product_col}' (col {product_col_idx}), Precio: '{price_col}' (col {price_col_idx})")
+        debug_info.append(f"Hoja {sheet_name}: Producto='{product_col}', Precio='{price_col}', Header en fila {header_row}")
+        
+        data_rows = chain(head_rows[header_row + 1:], rows)
+        products_in_sheet = 0
+        skipped_invalid_prices = 0
+        rows_read = 0
+        
+        while True:
+            batch = list(islice(data_rows, batch_size))
+            if not batch:
+                break
+            
+            # Solo las dos columnas que interesan, tipadas igual que lo haría read_excel
+            pairs = [
+                [row[product_col_idx] if product_col_idx < len(row) else '',
+                 row[price_col_idx] if price_col_idx < len(row) else '']
+                for row in batch
+            ]
+            frame = self.frame_from_rows(pairs, text_columns=[0], number_columns={1})
+            frame.index = range(rows_read, rows_read + len(frame))
+            
+            batch_products, batch_skipped = self.extract_products(
+                frame, 0, 1, supplier_name, sheet_name,
+                first_number=products_in_sheet, show_debug=rows_read == 0
+            )
+            products_in_sheet += len(batch_products)
+            skipped_invalid_prices += batch_skipped
+            rows_read += len(batch)
+            if progress is not None:
+                progress(rows=len(batch), accepted=len(batch_products), rejected=batch_skipped)
+            
+            if batch_products:
+                yield batch_products
+        
+        print(f"✅ Productos válidos en {sheet_name}: {products_in_sheet} ({rows_read} filas leídas)")
+        debug_info.append(f"Hoja {sheet_name}: {header_row + 1 + rows_read} filas, {width} columnas")
+        debug_info.append(f"Hoja {sheet_name}: {products_in_sheet} productos válidos, {skipped_invalid_prices} precios inválidos omitidos")
+    
+    def iter_excel_file(self, file_path, supplier_name, debug_info, batch_size=None, progress=None):
+        """
+        Motor de ingesta en streaming para listas enormes (solo .xlsx).
+        Lee cada hoja con openpyxl en modo read_only y entrega los productos en lotes de tamaño fijo,
+        así la memoria usada durante el parseo no depende del tamaño del archivo.
+        progress(rows=..., accepted=..., rejected=..., sheet_done=...) informa el avance si se pasa
+        """
+        batch_size = batch_size or self.stream_batch_size
+        
+        try:
+            workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        except Exception as e:
+            print(f"💥 Error abriendo archivo {file_path}: {str(e)}")
+            debug_info.append(f"Error general: {str(e)}")
+            return
+        
+        try:
+            print(f"📊 Hojas encontradas en {supplier_name} (streaming): {workbook.sheetnames}")
+            debug_info.append(f"Hojas: {', '.join(workbook.sheetnames)}")
+            
+            for worksheet in workbook.worksheets:
+                print(f"📋 Procesando hoja: {worksheet.title}")
+                try:
+                    yield from self.iter_sheet_products(worksheet, supplier_name, debug_info, batch_size, progress)
+                except Exception as sheet_error:
+                    print(f"❌ Error procesando hoja {worksheet.title}: {str(sheet_error)}")
+                    debug_info.append(f"Hoja {worksheet.title}: Error - {str(sheet_error)}")
+                if progress is not None:
+                    progress(sheet_done=True)
+        finally:
+            workbook.close()
+    
+    def process_excel_file(self, file_path, supplier_name):
+        """Procesa un archivo Excel y extrae productos y precios (cada hoja se lee una sola vez)"""
+        excel_file = None
+        debug_info = []
+        
+        try:
+            print(f"🔍 Procesando archivo: {file_path}")
+            
+            # Leer todas las hojas del Excel
+            excel_file = pd.ExcelFile(file_path)
+            all_products = []
+            
+            print(f"📊 Hojas encontradas en {supplier_name}: {excel_file.sheet_names}")
+            debug_info.append(f"Hojas: {', '.join(excel_file.sheet_names)}")
+            
+            for sheet_name in excel_file.sheet_names:
+                print(f"📋 Procesando hoja: {sheet_name}")
+                
+                try:
+                    rows = self.read_sheet_rows(excel_file, sheet_name)
+                    all_products.extend(self.process_sheet(rows, sheet_name, supplier_name, debug_info))
+                    
+                except Exception as sheet_error:
+                    print(f"❌ Error procesando hoja {sheet_name}: {str(sheet_error)}")
+                    debug_info.append(f"Hoja {sheet_name}: Error - {str(sheet_error)}")
+                    continue
+            
+            print(f"🎉 Total productos procesados para {supplier_name}: {len(all_products)}")
+            
+            # Si no se encontraron productos, guardar info de debug
+            if len(all_products) == 0:
+                print(f"⚠️ DIAGNÓSTICO COMPLETO PARA {supplier_name}:")
+                for info in debug_info:
+                    print(f"   {info}")
+            
+            return all_products, debug_info
+            
+        except Exception as e:
+            error_msg = f"Error procesando archivo {file_path}: {str(e)}"
+            print(f"💥 {error_msg}")
+            debug_info.append(f"Error general: {str(e)}")
+            return [], debug_info
+        finally:
+            # Cerrar el archivo Excel explícitamente
+            if excel_file is not None:
+                try:
+                    excel_file.close()
+                except:
+                    pass
+
+class ParsedListCache:
+    """
+    Caché en disco de listas ya parseadas, indexada por el hash del contenido del archivo y el proveedor.
+    Cada resultado se guarda comprimido en su propio archivo; cuando la carpeta supera max_bytes
+    se borran los menos usados recientemente (la fecha de modificación marca el último uso)
+    """
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.prefix = f"v{PARSER_VERSION}_"
+        self.remove_stale_versions()
+    
+    def remove_stale_versions(self):
+        """Borra los resultados guardados con otra versión del parser"""
+        for filename in os.listdir(self.folder):
+            if not filename.startswith(self.prefix):
+                try:
+                    os.remove(os.path.join(self.folder, filename))
+                except:
+                    pass
+    
+    def make_key(self, file_path, supplier_name):
+        """Hash del contenido del archivo más el proveedor (los IDs de producto dependen del proveedor)"""
+        digest = hashlib.sha256(f"{supplier_name}\0".encode('utf-8'))
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    def _path(self, key):
+        return os.path.join(self.folder, f"{self.prefix}{key}.bin")
+    
+    def get(self, key):
+        """Devuelve (productos, debug_info) si el archivo ya fue parseado, o None"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                products, debug_info = pickle.loads(zlib.decompress(f.read()))
+            os.utime(path)  # Marcar como usado recientemente
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            print(f"⚠️ Entrada de caché inválida {path}: {str(e)}")
+            self.misses += 1
+            try:
+                os.remove(path)
+            except:
+                pass
+            return None
+        
+        self.hits += 1
+        return products, debug_info
+    
+    def put(self, key, products, debug_info):
+        """Guarda el resultado de un parseo y hace lugar si la caché se pasó de tamaño"""
+        data = zlib.compress(pickle.dumps((products, debug_info), protocol=pickle.HIGHEST_PROTOCOL))
+        if len(data) > self.max_bytes:
+            return
+        
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)  # Reemplazo atómico: nunca se lee un archivo a medio escribir
+        except Exception as e:
+            print(f"⚠️ No se pudo guardar en caché: {str(e)}")
+            return
+        self.evict()
+    
+    def evict(self):
+        """Borra las entradas menos usadas hasta que la caché entre en max_bytes"""
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith('.bin'):
+                try:
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                except FileNotFoundError:
+                    pass
+        
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+
+class SearchCache:
+    """
+    Caché LRU en memoria de respuestas de /search, ya serializadas a JSON, limitada por bytes.
+    Cada respuesta queda atada a la generación del catálogo con la que se calculó: cuando el
+    catálogo cambia, la primera consulta con la generación nueva vacía la caché
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+    
+    def _sync_generation(self, generation):
+        if generation != self.generation:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.size = 0
+            self.generation = generation
+    
+    def get(self, key, generation):
+        with self.lock:
+            self._sync_generation(generation)
+            body = self.entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return body
+    
+    def put(self, key, generation, body):
+        """Guarda una respuesta, salvo que el catálogo haya cambiado mientras se calculaba"""
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            if generation < self.generation:
+                return
+            self._sync_generation(generation)
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+    
+    def stats(self):
+        with self.lock:
+            requests_count = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'generation': self.generation,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / requests_count, 3) if requests_count else 0.0,
+                'invalidations': self.invalidations
+            }
+
+# Crear instancia del procesador
+processor = PriceListProcessor()
+parsed_cache = ParsedListCache(app.config['PARSE_CACHE_FOLDER'], app.config['PARSE_CACHE_MAX_BYTES'])
+search_cache = SearchCache(app.config['SEARCH_CACHE_MAX_BYTES'])
+
+# Pools de procesos compartidos, uno por uso (se crean recién cuando hacen falta): 'parse' para las hojas
+# de Excel y 'pdf' para los PDFs de pedido, así un pedido no queda en cola detrás de una carga masiva
+process_pools = {}
+process_pool_lock = threading.Lock()
+PROCESS_POOL_WORKERS = {'parse': 'PROCESS_POOL_WORKERS', 'pdf': 'PDF_POOL_WORKERS'}
+
+def get_process_pool(kind='parse'):
+    """Devuelve el pool de procesos de ese uso, creándolo la primera vez"""
+    with process_pool_lock:
+        pool = process_pools.get(kind)
+        if pool is None:
+            # spawn: los procesos hijos no heredan los threads ni el estado del servidor Flask
+            pool = process_pools[kind] = ProcessPoolExecutor(
+                max_workers=app.config[PROCESS_POOL_WORKERS[kind]],
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return pool
+
+def reset_process_pool(pool, kind='parse'):
+    """
+    Descarta un pool roto: si se muere uno de sus procesos, todas sus tareas pendientes y todo lo que se le
+    mande después falla con BrokenProcessPool. El próximo get_process_pool crea uno nuevo (si otro thread
+    ya lo reemplazó, queda el de ese thread)
+    """
+    with process_pool_lock:
+        if process_pools.get(kind) is pool:
+            del process_pools[kind]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def submit_to_pool(kind, fn, *args):
+    """pool.submit en el pool de ese uso; si está roto lo reemplaza y manda la tarea al nuevo"""
+    pool = get_process_pool(kind)
+    try:
+        return pool.submit(fn, *args)
+    except BrokenProcessPool:
+        reset_process_pool(pool, kind)
+        return get_process_pool(kind).submit(fn, *args)
+
+def parse_sheets_task(file_path, supplier_name, sheet_names):
+    """
+    Tarea del pool de procesos: abre el libro una sola vez y procesa esas hojas (abrirlo lee los textos
+    compartidos de todo el archivo, así que no conviene repetirlo por hoja).
+    Devuelve una lista con (productos, debug_info, segundos, stats) por hoja, con stats = filas, aceptados y rechazados
+    """
+    try:
+        excel_file = pd.ExcelFile(file_path)
+    except Exception as e:
+        print(f"💥 Error abriendo archivo {file_path}: {str(e)}")
+        return [([], [f"Hoja {sheet_name}: Error - {str(e)}"], 0.0, {'rows': 0, 'accepted': 0, 'rejected': 0}) for sheet_name in sheet_names]
+    
+    results = []
+    with excel_file:
+        for sheet_name in sheet_names:
+            start = time.perf_counter()
+            debug_info = []
+            stats = {'rows': 0, 'accepted': 0, 'rejected': 0}
+            try:
+                rows = processor.read_sheet_rows(excel_file, sheet_name)
+                products = processor.process_sheet(rows, sheet_name, supplier_name, debug_info, stats)
+            except Exception as sheet_error:
+                print(f"❌ Error procesando hoja {sheet_name}: {str(sheet_error)}")
+                debug_info.append(f"Hoja {sheet_name}: Error - {str(sheet_error)}")
+                products = []
+            results.append((products, debug_info, time.perf_counter() - start, stats))
+    return results
+
+def submit_sheet_tasks(file_path, supplier_name, sheet_names, on_task_done=None, max_tasks=None):
+    """
+    Reparte las hojas en hasta max_tasks tareas del pool de procesos (por defecto una por proceso), en
+    tramos seguidos, así cada proceso abre el libro una sola vez. on_task_done(future) se llama al
+    terminar cada tarea. Devuelve [(hojas de la tarea, future, submit)] en el orden del libro; submit(hojas)
+    vuelve a mandar la tarea (ver collect_sheet_results)
+    """
+    def submit(group):
+        future = submit_to_pool('parse', parse_sheets_task, file_path, supplier_name, group)
+        if on_task_done is not None:
+            future.add_done_callback(on_task_done)
+        return future
+    
+    task_count = max(1, min(len(sheet_names), max_tasks or app.config['PROCESS_POOL_WORKERS']))
+    tasks = []
+    for position in range(task_count):
+        group = sheet_names[position * len(sheet_names) // task_count:(position + 1) * len(sheet_names) // task_count]
+        tasks.append((group, submit(group), submit))
+    return tasks
+
+def collect_sheet_results(sheet_names, tasks):
+    """Junta los resultados de las hojas en el orden del libro. Devuelve (productos, debug_info, resumen por hoja)"""
+    products = []
+    debug_info = [f"Hojas: {', '.join(sheet_names)}"]
+    sheets = []
+    for group, future, submit in tasks:
+        try:
+            try:
+                group_results = future.result()
+            except BrokenProcessPool:
+                # Se murió un proceso del pool (quizás con otra tarea): se reintenta una vez en un pool nuevo,
+                # para no publicar la lista sin estas hojas
+                group_results = submit(group).result()
+        except Exception as e:
+            group_results = [([], [f"Hoja {sheet_name}: Error - {str(e)}"], 0.0, {}) for sheet_name in group]
+        for sheet_name, (sheet_products, sheet_debug, seconds, stats) in zip(group, group_results):
+            products.extend(sheet_products)
+            debug_info.extend(sheet_debug)
+            sheets.append({
+                'sheet': sheet_name,
+                'products': len(sheet_products),
+                'rejected': stats.get('rejected', 0),
+                'seconds': round(seconds, 3)
+            })
+    return products, debug_info, sheets
+
+def map_file(path):
+    """Contenido de un archivo abierto con mmap de solo lectura (mmap no acepta archivos vacíos: para esos b'')"""
+    if not os.path.getsize(path):
+        return b''
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class MappedStrings:
+    """
+    Lista de textos de solo lectura sobre un archivo UTF-8 separado por NUL abierto con mmap: los workers
+    que leen la misma lista comparten las páginas en lugar de tener cada uno sus propios str
+    """
+    def __init__(self, path):
+        self.data = map_file(path)
+        self.ends = np.append(np.flatnonzero(np.frombuffer(self.data, dtype=np.uint8) == 0), len(self.data))
+    
+    def __len__(self):
+        return len(self.ends)
+    
+    def __getitem__(self, row):
+        start = self.ends[row - 1] + 1 if row else 0
+        return self.data[start:self.ends[row]].decode('utf-8')
+    
+    def __iter__(self):
+        return (self[row] for row in range(len(self.ends)))
+
+class MappedText:
+    """
+    Texto ASCII de solo lectura sobre un archivo abierto con mmap (el de un TrigramIndex guardado): alcanza
+    con find y cortes, como un str, y los workers comparten las páginas. En ASCII un byte es una letra, así que
+    las posiciones del archivo son las del texto
+    """
+    def __init__(self, path):
+        self.data = map_file(path)
+    
+    def __len__(self):
+        return len(self.data)
+    
+    def find(self, fragment, start=0):
+        return self.data.find(fragment.encode('utf-8'), start)
+    
+    def __getitem__(self, index):
+        return self.data[index].decode('ascii')
+
+def write_strings(path, strings):
+    """Guarda textos separados por NUL (el formato de MappedStrings); los que ya están mapeados se copian tal cual"""
+    with open(path, 'wb') as f:
+        f.write(strings.data if isinstance(strings, (MappedStrings, MappedText)) else '\0'.join(strings).encode('utf-8'))
+
+class ProductTable:
+    """
+    Productos de un proveedor guardados por columnas en lugar de un dict por producto:
+    precios en un array float64, la hoja como código entero contra un diccionario de hojas,
+    proveedor y ubicación una sola vez por tabla y nombres internados. El id para el carrito
+    sale del contenido (proveedor + hash de la clave normalizada), así sobrevive a las recargas de la lista.
+    Las filas borradas quedan marcadas en alive hasta que se compacta la tabla.
+    Iterarla devuelve dicts nuevos con la forma de siempre (product, price, supplier, sheet, location, id)
+    """
+    _next_uid = count(1)
+    # Columnas numpy (las que se guardan en disco y se leen con mmap)
+    COLUMNS = ('prices', 'sheet_codes', 'id_hashes', 'alive')
+    JSON_ROWS_MAX = 100000  # Filas codificadas que se guardan por tabla (al llenarse se vacía)
+    DELTA_FRACTION = 0.1  # Filas agregadas (respecto de las indexadas) que se buscan aparte antes de rearmar los índices
+    
+    def __init__(self, supplier_name):
+        self.uid = next(ProductTable._next_uid)
+        self.supplier = supplier_name
+        self.location = DEFAULT_LOCATIONS.get(supplier_name, 'Buenos Aires, Argentina')
+        self.sheets = []  # código -> nombre de hoja
+        self.sheet_codes_by_name = {}
+        self.names = []
+        self.search_keys = []  # Nombre normalizado con normalize_search_text
+        self.prices = np.empty(0, dtype=np.float64)
+        self.sheet_codes = np.empty(0, dtype=np.uint16)
+        self.id_hashes = np.empty(0, dtype=np.uint64)  # product_id_hash de cada fila (el id es "{proveedor}_{hash}")
+        self.alive = np.empty(0, dtype=bool)
+        self.live_count = 0
+        self.id_order = None  # (filas ordenadas por id_hashes, hashes ordenados) para find_id; se rearma al agregar filas
+        self.json_rows = {}  # fila -> producto ya codificado en JSON (ver row_json)
+        self.token_index = None  # TokenIndex para /search de las filas hasta indexed_rows
+        self.trigram_index = None  # TrigramIndex para buscar fragmentos y con errores de tipeo
+        self.indexed_rows = 0
+        self.delta_indexes = None  # (hasta qué fila llegan, TokenIndex, TrigramIndex) de las filas agregadas desde indexed_rows
+        self.texts_shared = False  # names y search_keys son los de la tabla de la que se copió (ver copy)
+        self.changed_from = None  # (uid de la tabla de la que se copió, claves normalizadas que cambiaron) para refresh_suggestions
+    
+    def _sheet_code(self, sheet_name):
+        code = self.sheet_codes_by_name.get(sheet_name)
+        if code is None:
+            code = len(self.sheets)
+            self.sheets.append(sheet_name)
+            self.sheet_codes_by_name[sheet_name] = code
+        return code
+    
+    def append_records(self, records, keys=None):
+        """
+        Agrega productos parseados (dicts de process_excel_file). keys son sus claves de numbered_keys
+        (si no se pasan se calculan sobre estos mismos productos). Devuelve las filas nuevas
+        """
+        start = len(self.names)
+        if self.texts_shared or not isinstance(self.names, list):
+            # Textos de otra tabla o leídos del disco: se copian a memoria recién para agregarles filas
+            self.names, self.search_keys = list(self.names), list(self.search_keys)
+            self.texts_shared = False
+        sheet_codes = np.fromiter((self._sheet_code(record['sheet']) for record in records), dtype=np.uint16, count=len(records))
+        if keys is None:
+            keys = numbered_keys(records)
+        id_hashes = np.fromiter((product_id_hash(key) for key in keys), dtype=np.uint64, count=len(records))
+        
+        # Primero los nombres y al final alive: quien lea a la vez solo ve filas completas
+        self.names.extend(sys.intern(record['product']) for record in records)
+        self.search_keys.extend(
+            record['search_key'] if record.get('search_key') is not None else normalize_search_text(record['product'])
+            for record in records
+        )
+        self.prices = np.concatenate([self.prices, np.fromiter((record['price'] for record in records), dtype=np.float64, count=len(records))])
+        self.sheet_codes = np.concatenate([self.sheet_codes, sheet_codes])
+        self.id_hashes = np.concatenate([self.id_hashes, id_hashes])
+        self.id_order = None
+        self.alive = np.concatenate([self.alive, np.ones(len(records), dtype=bool)])
+        self.live_count += len(records)
+        return range(start, start + len(records))
+    
+    def append_rows(self, source, rows):
+        """Agrega filas de otra tabla del mismo proveedor, con sus ids. Devuelve las filas nuevas"""
+        start = len(self.names)
+        if self.texts_shared or not isinstance(self.names, list):
+            self.names, self.search_keys = list(self.names), list(self.search_keys)
+            self.texts_shared = False
+        sheet_codes = np.array([self._sheet_code(sheet_name) for sheet_name in source.sheets], dtype=np.uint16)
+        
+        self.names.extend(source.names[row] for row in rows.tolist())
+        self.search_keys.extend(source.search_keys[row] for row in rows.tolist())
+        self.prices = np.concatenate([self.prices, source.prices[rows]])
+        self.sheet_codes = np.concatenate([self.sheet_codes, sheet_codes[source.sheet_codes[rows]]])
+        self.id_hashes = np.concatenate([self.id_hashes, source.id_hashes[rows]])
+        self.id_order = None
+        self.alive = np.concatenate([self.alive, np.ones(len(rows), dtype=bool)])
+        self.live_count += len(rows)
+        return range(start, start + len(rows))
+    
+    def remove_rows(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        self.live_count -= int(self.alive[rows].sum())
+        self.alive[rows] = False
+    
+    def live_rows(self):
+        """Índices de las filas vigentes"""
+        return np.flatnonzero(self.alive)
+    
+    def rows_with_key(self, key):
+        """Filas vigentes cuyo nombre normalizado es exactamente key (los candidatos salen de los índices de palabras)"""
+        indexes = [self.token_index] + ([self.delta_indexes[1]] if self.delta_indexes is not None else [])
+        rows = np.concatenate([index.lookup(key.split(), prefix_last=False) for index in indexes])
+        return [row for row in rows[self.alive[rows]].tolist() if self.search_keys[row] == key]
+    
+    def product_id(self, row):
+        return f"{self.supplier}_{int(self.id_hashes[row]):016x}"
+    
+    def row(self, row):
+        """Vista de una fila como dict nuevo (modificarlo no toca el catálogo)"""
+        return {
+            'product': self.names[row],
+            'price': float(self.prices[row]),
+            'supplier': self.supplier,
+            'sheet': self.sheets[self.sheet_codes[row]],
+            'location': self.location,
+            'id': self.product_id(row)
+        }
+    
+    def row_json(self, row):
+        """
+        La fila como objeto JSON (con price_formatted) listo para pegar en una respuesta. Se codifica la
+        primera vez que sale en una búsqueda y se reusa; cambiar el precio de una fila descarta el suyo
+        """
+        fragment = self.json_rows.get(row)
+        if fragment is None:
+            if len(self.json_rows) >= self.JSON_ROWS_MAX:
+                self.json_rows.clear()
+            product = self.row(row)
+            product['price_formatted'] = f"${product['price']:,.2f}"
+            fragment = json.dumps(product, sort_keys=True, separators=(',', ':'))
+            self.json_rows[row] = fragment
+        return fragment
+    
+    def find_id(self, product_id):
+        """Fila vigente con ese id, o None (búsqueda binaria sobre los hashes ordenados)"""
+        supplier, _, digest = product_id.rpartition('_')
+        if supplier != self.supplier or len(digest) != 16:
+            return None
+        try:
+            id_hash = np.uint64(int(digest, 16))
+        except ValueError:
+            return None
+        
+        if self.id_order is None:
+            order = np.argsort(self.id_hashes, kind='stable')
+            self.id_order = (order, self.id_hashes[order])
+        order, sorted_hashes = self.id_order
+        start, end = np.searchsorted(sorted_hashes, id_hash, side='left'), np.searchsorted(sorted_hashes, id_hash, side='right')
+        # Un producto borrado y vuelto a agregar tiene el mismo id: vale la fila vigente
+        for row in order[start:end]:
+            if self.alive[row]:
+                return int(row)
+        return None
+    
+    def head(self, n):
+        return [self.row(row) for row in self.live_rows()[:n]]
+    
+    def __iter__(self):
+        for row in self.live_rows():
+            yield self.row(row)
+    
+    def __len__(self):
+        return self.live_count
+    
+    def copy(self):
+        """
+        Copia para modificar sin tocar la tabla publicada (copy-on-write). Se duplica lo que se modifica
+        en el lugar (precios, alive y dicts); los nombres se copian recién si la copia gana filas, las demás
+        columnas solo se reemplazan y los índices de búsqueda se comparten (ver update_search_indexes)
+        """
+        table = ProductTable(self.supplier)
+        table.location = self.location
+        table.sheets = list(self.sheets)
+        table.sheet_codes_by_name = dict(self.sheet_codes_by_name)
+        table.names = self.names
+        table.search_keys = self.search_keys
+        table.texts_shared = True
+        table.prices = self.prices.copy()
+        table.sheet_codes = self.sheet_codes
+        table.id_hashes = self.id_hashes
+        table.alive = self.alive.copy()
+        table.live_count = self.live_count
+        table.id_order = self.id_order
+        table.json_rows = dict(self.json_rows)
+        table.token_index = self.token_index
+        table.trigram_index = self.trigram_index
+        table.indexed_rows = self.indexed_rows
+        table.delta_indexes = self.delta_indexes
+        return table
+    
+    def update_search_indexes(self):
+        """
+        Pone al día los índices de búsqueda después de agregar filas. Las borradas se filtran al buscar; las
+        agregadas desde el último armado completo van a índices chicos aparte (delta_indexes) que se rearman
+        con cada carga, y recién cuando pasan DELTA_FRACTION de las indexadas se rearma todo junto
+        """
+        total = len(self.alive)
+        if self.token_index is None or total - self.indexed_rows > self.DELTA_FRACTION * self.indexed_rows:
+            rows = self.live_rows()
+            self.token_index = TokenIndex.build(self, rows)
+            self.trigram_index = TrigramIndex.build(self, rows)
+            self.indexed_rows = total
+            self.delta_indexes = None
+        elif total > (self.delta_indexes[0] if self.delta_indexes is not None else self.indexed_rows):
+            rows = self.indexed_rows + np.flatnonzero(self.alive[self.indexed_rows:])
+            self.delta_indexes = (total, TokenIndex.build(self, rows), TrigramIndex.build(self, rows))
+    
+    def compacted(self):
+        """Copia sin las filas borradas (las filas cambian de número)"""
+        table = ProductTable(self.supplier)
+        rows = self.live_rows()
+        table.sheets = list(self.sheets)
+        table.sheet_codes_by_name = dict(self.sheet_codes_by_name)
+        table.names = [self.names[row] for row in rows]
+        table.search_keys = [self.search_keys[row] for row in rows]
+        table.prices = self.prices[rows]
+        table.sheet_codes = self.sheet_codes[rows]
+        table.id_hashes = self.id_hashes[rows]
+        table.alive = np.ones(len(rows), dtype=bool)
+        table.live_count = len(rows)
+        return table, rows
+
+def normalize_product_key(name):
+    """Clave para reconocer el mismo producto entre versiones de una lista: sin mayúsculas, acentos ni espacios de más"""
+    text = name.lower()
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(text.split())
+
+# Números (con coma o punto decimal) o tramos de letras: la puntuación queda afuera y "x1kg" se separa en x, 1, kg
+SEARCH_TOKEN_PATTERN = re.compile(r'\d+(?:[.,]\d+)*|[^\W\d_]+')
+
+# Formas de escribir una unidad después de un número
+UNIT_ALIASES = {
+    'g': 'gr', 'grs': 'gr', 'gramo': 'gr', 'gramos': 'gr',
+    'kgs': 'kg', 'kilo': 'kg', 'kilos': 'kg',
+    'l': 'lt', 'lts': 'lt', 'ltr': 'lt', 'litro': 'lt', 'litros': 'lt',
+    'cc': 'ml', 'mls': 'ml',
+    'u': 'un', 'uni': 'un', 'unid': 'un', 'unidad': 'un', 'unidades': 'un',
+    'mts': 'mt', 'metro': 'mt', 'metros': 'mt'
+}
+
+def normalize_search_text(text):
+    """
+    Clave de búsqueda de un nombre o de una consulta: sin acentos ni mayúsculas, sin puntuación,
+    números separados de las letras, coma decimal como punto y unidades escritas de una sola forma
+    ("Azúcar x1Kgs." -> "azucar x 1 kg", "Aceite 1,5 Litros" -> "aceite 1.5 lt")
+    """
+    text = text.casefold()
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(char for char in text if not unicodedata.combining(char))
+    
+    tokens = []
+    after_number = False
+    for token in SEARCH_TOKEN_PATTERN.findall(text):
+        if token[0].isdigit():
+            tokens.append(token.replace(',', '.'))
+            after_number = True
+        else:
+            tokens.append(UNIT_ALIASES.get(token, token) if after_number else token)
+            after_number = False
+    return ' '.join(tokens)
+
+# Palabras que no describen al producto: unidades, "x 12", "de", "display"... (los números se comparan aparte)
+PACKAGING_WORDS = set(UNIT_ALIASES.values()) | {'x', 'de', 'con', 'por', 'pack', 'display', 'caja', 'bolsa', 'corr'}
+
+def descriptive_words(search_key):
+    """Palabras de una clave de búsqueda sin números ni unidades/empaque: lo que distingue un producto de otro"""
+    return [token for token in search_key.split() if not token[0].isdigit() and token not in PACKAGING_WORDS]
+
+def tokenize_product_name(name):
+    """Palabras de búsqueda de un nombre (o de una consulta), sin repetir y en orden de aparición"""
+    return list(dict.fromkeys(normalize_search_text(name).split()))
+
+class TokenIndex:
+    """
+    Índice invertido de una ProductTable: palabra normalizada -> filas que la contienen.
+    Guardado como CSR: vocabulario ordenado, offsets y un único array de filas (ordenadas dentro de
+    cada palabra). Al estar ordenado, las palabras con un mismo prefijo quedan contiguas y sus filas
+    salen de un solo slice. Las filas borradas se filtran al consultar con la máscara alive de la tabla
+    """
+    def __init__(self, vocabulary, offsets, postings):
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.postings = postings
+    
+    @classmethod
+    def build(cls, table, rows):
+        """Índice de esas filas de la tabla (ordenadas)"""
+        tokens_by_row = [list(dict.fromkeys(table.search_keys[row].split())) for row in rows]
+        token_rows = np.repeat(rows.astype(np.int32), [len(tokens) for tokens in tokens_by_row])
+        codes, uniques = pd.factorize(pd.Series(list(chain.from_iterable(tokens_by_row)), dtype=object))
+        
+        # Numerar las palabras en orden alfabético y agrupar las filas por palabra (estable: quedan ordenadas)
+        alphabetical = np.argsort(uniques.astype(str))
+        rank = np.empty(len(uniques), dtype=np.int64)
+        rank[alphabetical] = np.arange(len(uniques))
+        token_ranks = rank[codes]
+        order = np.argsort(token_ranks, kind='stable')
+        
+        offsets = np.zeros(len(uniques) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(token_ranks, minlength=len(uniques)), out=offsets[1:])
+        return cls(list(uniques[alphabetical]), offsets, token_rows[order])
+    
+    def _range(self, token, prefix=False):
+        """Rango [desde, hasta) del vocabulario: la palabra exacta o todas las que empiezan con ella"""
+        start = bisect_left(self.vocabulary, token)
+        if prefix:
+            return start, bisect_left(self.vocabulary, token + '\U0010ffff', start)
+        if start < len(self.vocabulary) and self.vocabulary[start] == token:
+            return start, start + 1
+        return start, start
+    
+    def _posting(self, position):
+        return self.postings[self.offsets[position]:self.offsets[position + 1]]
+    
+    @staticmethod
+    def _contains(rows, candidates):
+        """Máscara de los candidatos que están en rows (ordenada), por búsqueda binaria"""
+        if not len(rows):
+            return np.zeros(len(candidates), dtype=bool)
+        positions = np.minimum(np.searchsorted(rows, candidates), len(rows) - 1)
+        return rows[positions] == candidates
+    
+    def lookup(self, tokens, prefix_last=True):
+        """
+        Filas que contienen todas las palabras (intersección de posting lists, de la más corta a la más larga).
+        La última palabra puede estar incompleta y se busca como prefijo
+        """
+        ranges = []
+        for position, token in enumerate(tokens):
+            start, end = self._range(token, prefix=prefix_last and position == len(tokens) - 1)
+            if start == end:
+                return np.empty(0, dtype=np.int32)
+            ranges.append((start, end))
+        
+        # Empezar por la palabra (o prefijo) con menos filas y filtrar esos candidatos con las demás
+        ranges.sort(key=lambda bounds: self.offsets[bounds[1]] - self.offsets[bounds[0]])
+        start, end = ranges[0]
+        result = self._posting(start) if end - start == 1 else np.unique(self.postings[self.offsets[start]:self.offsets[end]])
+        
+        for start, end in ranges[1:]:
+            if not len(result):
+                break
+            if end - start == 1:
+                mask = self._contains(self._posting(start), result)
+            elif end - start <= 64:
+                # Pocas palabras con ese prefijo: buscar los candidatos en cada una sin armar la unión
+                mask = np.zeros(len(result), dtype=bool)
+                for position in range(start, end):
+                    mask |= self._contains(self._posting(position), result)
+            else:
+                mask = np.isin(result, self.postings[self.offsets[start]:self.offsets[end]])
+            result = result[mask]
+        return result
+
+def trigram_codes(text):
+    """Trigramas de un texto como enteros (tres code points de 21 bits en un int64)"""
+    chars = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+    return (chars[:-2] << 42) | (chars[1:-1] << 21) | chars[2:]
+
+def substring_edit_distance(pattern, text):
+    """
+    Menor distancia de edición entre pattern y cualquier fragmento de text. Algoritmo bit-paralelo de
+    Myers: cada columna de la matriz de Sellers se actualiza con unas pocas operaciones sobre enteros
+    """
+    if not pattern:
+        return 0
+    char_masks = {}
+    for i, char in enumerate(pattern):
+        char_masks[char] = char_masks.get(char, 0) | (1 << i)
+    mask = (1 << len(pattern)) - 1
+    last = 1 << (len(pattern) - 1)
+    positive, negative = mask, 0  # Diferencias verticales +1 / -1 de la columna actual
+    score = best = len(pattern)
+    for char in text:
+        equal = char_masks.get(char, 0)
+        vertical = equal | negative
+        horizontal = (((equal & positive) + positive) ^ positive) | equal
+        horizontal_positive = negative | (~(horizontal | positive) & mask)
+        horizontal_negative = positive & horizontal
+        if horizontal_positive & last:
+            score += 1
+        elif horizontal_negative & last:
+            score -= 1
+        # Sin acarreo desde la fila 0: el fragmento puede empezar en cualquier posición del texto
+        horizontal_positive = (horizontal_positive << 1) & mask
+        horizontal_negative = (horizontal_negative << 1) & mask
+        positive = horizontal_negative | (~(vertical | horizontal_positive) & mask)
+        negative = horizontal_positive & vertical
+        best = min(best, score)
+    return best
+
+def substring_edit_distances(pattern, chars):
+    """
+    substring_edit_distance de pattern (hasta 64 letras) contra muchos nombres a la vez. chars tiene los code points
+    de un nombre por columna, completados con 0 (ver TrigramIndex._names_matrix): cada fila de chars es una columna
+    de la matriz de Sellers de todos los nombres, así que el algoritmo de Myers corre con operaciones de numpy
+    """
+    count = chars.shape[1]
+    best = np.full(count, len(pattern), dtype=np.int32)
+    if not pattern:
+        return best
+    # Máscara de cada letra del patrón, buscada por code point (las letras que no están quedan en 0)
+    table = np.zeros(max(int(chars.max(initial=0)), max(map(ord, pattern))) + 1, dtype=np.uint64)
+    for i, char in enumerate(pattern):
+        table[ord(char)] |= np.uint64(1 << i)
+    mask = np.uint64((1 << len(pattern)) - 1)
+    last = np.uint64(1 << (len(pattern) - 1))
+    one = np.uint64(1)
+    positive = np.full(count, mask, dtype=np.uint64)
+    negative = np.zeros(count, dtype=np.uint64)
+    score = best.copy()
+    for column in chars:
+        equal = table[column]
+        vertical = equal | negative
+        horizontal = (((equal & positive) + positive) ^ positive) | equal
+        horizontal_positive = negative | (~(horizontal | positive) & mask)
+        horizontal_negative = positive & horizontal
+        up = (horizontal_positive & last) != 0
+        score += up
+        score -= ~up & ((horizontal_negative & last) != 0)
+        horizontal_positive = (horizontal_positive << one) & mask
+        horizontal_negative = (horizontal_negative << one) & mask
+        positive = horizontal_negative | (~(vertical | horizontal_positive) & mask)
+        negative = horizontal_positive & vertical
+        np.minimum(best, score, out=best)
+    return best
+
+class TrigramIndex:
+    """
+    Índice de trigramas de caracteres de una ProductTable, para buscar fragmentos de palabras
+    ("alfaj", "dulc de lech") y tolerar errores de tipeo. Guarda el nombre normalizado de cada
+    fila en un único texto (separado por NUL) para verificar los candidatos, y los trigramas
+    en CSR como TokenIndex: códigos ordenados, offsets y filas
+    """
+    # Con más candidatos que esta fracción de la tabla conviene recorrer el texto entero con str.find
+    SCAN_FRACTION = 0.25
+    # Candidatos que se verifican juntos con errores de tipeo (los arrays de un tramo entran en la caché del procesador)
+    VERIFY_CHUNK = 16384
+    
+    def __init__(self, codes, offsets, postings, rows, starts, text):
+        self.codes = codes
+        self.offsets = offsets
+        self.postings = postings
+        self.rows = rows  # Filas indexadas (vigentes al armar el índice), en orden
+        self.starts = starts  # Inicio del nombre de cada fila en text; el último es el largo del texto + 1
+        self.text = text
+    
+    @classmethod
+    def build(cls, table, rows):
+        """Índice de esas filas de la tabla (ordenadas)"""
+        normalized = [table.search_keys[row] for row in rows]
+        text = '\0'.join(normalized)
+        lengths = np.fromiter(map(len, normalized), dtype=np.int64, count=len(normalized))
+        starts = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths + 1, out=starts[1:])
+        
+        # Trigrama en cada posición del texto, sin los que cruzan el separador entre nombres
+        codes = trigram_codes(text)
+        chars = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+        valid = (chars[:-2] != 0) & (chars[1:-1] != 0) & (chars[2:] != 0)
+        code_rows = np.repeat(rows.astype(np.int32), lengths + 1)[:len(codes)][valid]
+        codes = codes[valid]
+        
+        # Ordenar por (trigrama, fila) y sacar repetidos dentro de un mismo nombre
+        order = np.lexsort((code_rows, codes))
+        codes, code_rows = codes[order], code_rows[order]
+        keep = np.ones(len(codes), dtype=bool)
+        keep[1:] = (codes[1:] != codes[:-1]) | (code_rows[1:] != code_rows[:-1])
+        codes, code_rows = codes[keep], code_rows[keep]
+        
+        vocabulary, counts = np.unique(codes, return_counts=True)
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(vocabulary, offsets, code_rows, rows, starts, text)
+    
+    def _posting(self, code):
+        position = np.searchsorted(self.codes, code)
+        if position == len(self.codes) or self.codes[position] != code:
+            return self.postings[:0]
+        return self.postings[self.offsets[position]:self.offsets[position + 1]]
+    
+    def name_of(self, row):
+        position = np.searchsorted(self.rows, row)
+        return self.text[self.starts[position]:self.starts[position + 1] - 1]
+    
+    def _names_matrix(self, rows):
+        """
+        Nombres de las filas (en orden) como code points, un nombre por columna y completados con 0. Se codifica
+        solo el tramo del texto que va del primer nombre al último
+        """
+        positions = np.searchsorted(self.rows, rows)
+        starts = self.starts[positions]
+        lengths = self.starts[positions + 1] - 1 - starts
+        base = int(starts[0])
+        span = self.text[base:int(starts[-1] + lengths[-1])]
+        try:
+            chars = np.frombuffer(span.encode('latin-1'), dtype=np.uint8)
+        except UnicodeEncodeError:
+            chars = np.frombuffer(span.encode('utf-32-le'), dtype=np.uint32)
+        width = np.arange(lengths.max(initial=0))
+        index = np.minimum(width[:, None] + (starts - base), max(len(chars) - 1, 0))
+        matrix = chars[index] if len(chars) else np.zeros(index.shape, dtype=chars.dtype)
+        matrix[width[:, None] >= lengths] = 0
+        return matrix
+    
+    def _verify_typos(self, candidates, fragments, typos):
+        """
+        Candidatos cuyo nombre contiene cada fragmento con hasta typos errores (los de menos de 3 letras, sin
+        errores). Se verifican de a tramos con substring_edit_distances; cada fragmento solo mira lo que dejó el anterior
+        """
+        found = []
+        for start in range(0, len(candidates), self.VERIFY_CHUNK):
+            chunk = candidates[start:start + self.VERIFY_CHUNK]
+            chars = self._names_matrix(chunk)
+            left = np.arange(len(chunk))
+            for fragment in fragments:
+                allowed = typos if len(fragment) >= 3 else 0
+                if len(fragment) <= 64:
+                    distances = substring_edit_distances(fragment, chars[:, left])
+                else:
+                    distances = np.array([substring_edit_distance(fragment, self.name_of(row)) for row in chunk[left]], dtype=np.int32)
+                left = left[distances <= allowed]
+                if not len(left):
+                    break
+            found.append(chunk[left])
+        return np.concatenate(found).astype(np.int32) if found else np.empty(0, dtype=np.int32)
+    
+    def _scan(self, fragment):
+        """Filas cuyo nombre contiene el fragmento, recorriendo todo el texto"""
+        positions = []
+        position = self.text.find(fragment)
+        while position != -1:
+            positions.append(position)
+            position = self.text.find(fragment, position + 1)
+        found = np.searchsorted(self.starts, np.array(positions, dtype=np.int64), side='right') - 1
+        return self.rows[np.unique(found)]
+    
+    def lookup(self, fragments, typos=0):
+        """
+        Filas cuyo nombre normalizado contiene todos los fragmentos. Con typos > 0 los fragmentos de
+        3 o más letras pueden tener hasta esa cantidad de errores. Devuelve None si ningún fragmento
+        tiene 3 letras (no hay trigramas para buscar)
+        """
+        indexed = [fragment for fragment in fragments if len(fragment) >= 3]
+        if not indexed:
+            return None
+        postings_by_fragment = [[self._posting(code) for code in np.unique(trigram_codes(fragment))] for fragment in indexed]
+        
+        if not typos:
+            # Sin errores el nombre tiene que tener todos los trigramas: intersectar empezando por el menos común
+            postings = sorted(chain.from_iterable(postings_by_fragment), key=len)
+            candidates = postings[0]
+            for rows in postings[1:]:
+                if not len(candidates):
+                    return candidates
+                candidates = candidates[TokenIndex._contains(rows, candidates)]
+        else:
+            # Lema de q-gramas: un fragmento de n letras que aparece con hasta k errores comparte con el nombre al
+            # menos (n - 3 + 1) - 3k de sus trigramas (cada error rompe hasta 3). Contando trigramas distintos son
+            # len(postings) - 3k. Los fragmentos para los que eso no es positivo no filtran: se verifican al final
+            filtering = [(postings, len(postings) - 3 * typos) for postings in postings_by_fragment if len(postings) > 3 * typos]
+            filtering.sort(key=lambda item: sum(len(rows) for rows in item[0]))
+            candidates = None
+            for postings, needed in filtering:
+                if candidates is None:
+                    candidates, shared = np.unique(np.concatenate(postings), return_counts=True)
+                else:
+                    shared = sum(TokenIndex._contains(rows, candidates).astype(np.int32) for rows in postings)
+                candidates = candidates[shared >= needed]
+                if not len(candidates):
+                    return candidates
+            if candidates is None:
+                # Ningún fragmento alcanza para filtrar por trigramas: se verifican las filas con el nombre lo bastante largo
+                shortest = max(len(fragment) - (typos if len(fragment) >= 3 else 0) for fragment in fragments)
+                candidates = self.rows[np.diff(self.starts) - 1 >= shortest]
+        
+        if not typos and len(candidates) > self.SCAN_FRACTION * len(self.rows):
+            # Fragmentos muy comunes: más barato buscar en el texto que verificar candidato por candidato
+            for fragment in fragments:
+                candidates = candidates[TokenIndex._contains(self._scan(fragment), candidates)]
+            return candidates
+        
+        if typos:
+            return self._verify_typos(np.asarray(candidates), fragments, typos)
+        return np.array([row for row in candidates if all(fragment in self.name_of(row) for fragment in fragments)], dtype=np.int32)
+
+def product_id_hash(key):
+    """Hash de 64 bits de una clave de numbered_keys: con el proveedor forma el id estable del producto"""
+    name, occurrence = key
+    return int.from_bytes(hashlib.blake2b(f"{name}\0{occurrence}".encode('utf-8'), digest_size=8).digest(), 'little')
+
+def numbered_keys(products, occurrences=None):
+    """
+    Claves de los productos: (nombre normalizado, número de aparición), así los nombres repetidos se distinguen.
+    occurrences lleva la cuenta de apariciones entre lotes de una misma lista
+    """
+    occurrences = {} if occurrences is None else occurrences
+    keys = []
+    for product in products:
+        key = normalize_product_key(product['product'])
+        occurrence = occurrences.get(key, 0)
+        occurrences[key] = occurrence + 1
+        keys.append((key, occurrence))
+    return keys
+
+def stage_price_list(supplier_name, products):
+    """
+    Arma la tabla de una lista recién parseada pasándole los productos de a STORE_BATCH_SIZE. products puede
+    ser el iterable del motor en streaming: nunca están todos los dicts en memoria a la vez
+    """
+    table = ProductTable(supplier_name)
+    occurrences = {}
+    products = iter(products)
+    while True:
+        batch = list(islice(products, app.config['STORE_BATCH_SIZE']))
+        if not batch:
+            return table
+        table.append_records(batch, keys=numbered_keys(batch, occurrences))
+
+def diff_price_lists(table, staged):
+    """
+    Compara la tabla publicada con la lista nueva ya armada (ver stage_price_list). Un producto es el mismo
+    si tiene el mismo hash de clave (id_hashes). Devuelve (filas de staged que se agregan, filas de table
+    que se borran, filas de table con otro precio, sus precios nuevos, cantidad sin cambios)
+    """
+    live = table.live_rows()
+    order = np.argsort(table.id_hashes[live])
+    live = live[order]
+    hashes = table.id_hashes[live]
+    positions = np.minimum(np.searchsorted(hashes, staged.id_hashes), max(len(hashes) - 1, 0))
+    found = hashes[positions] == staged.id_hashes if len(hashes) else np.zeros(len(staged.id_hashes), dtype=bool)
+    
+    kept = np.zeros(len(live), dtype=bool)
+    kept[positions[found]] = True
+    rows = live[positions[found]]
+    old_prices, new_prices = table.prices[rows], staged.prices[found]
+    # Tolerancia relativa: reescribir el Excel puede mover el último decimal de un float
+    changed = np.abs(old_prices - new_prices) > 1e-9 * np.maximum(np.abs(old_prices), np.abs(new_prices))
+    return np.flatnonzero(~found), live[~kept], rows[changed], new_prices[changed], int(np.count_nonzero(~changed))
+
+def apply_price_list_diff(table, staged, added, removed, changed, new_prices):
+    """
+    Aplica un diff sobre una copia de la tabla y la devuelve; las filas sin cambios no se tocan. La tabla
+    publicada no cambia: la copia reemplaza la entrada de price_lists al publicarse
+    """
+    source, table = table, table.copy()
+    # Nombres cuyo resumen del autocompletado cambia (ver refresh_suggestions)
+    keys = {source.search_keys[row] for row in chain(removed.tolist(), changed.tolist())}
+    keys.update(staged.search_keys[row] for row in added.tolist())
+    table.changed_from = (source.uid, keys)
+    if len(removed):
+        table.remove_rows(removed)
+    table.prices[changed] = new_prices
+    for row in changed.tolist():
+        table.json_rows.pop(row, None)
+    if len(added):
+        # El id sale de la clave: un producto que vuelve a aparecer recupera el id que tenía
+        table.append_rows(staged, added)
+    return table
+
+class SuggestIndex:
+    """
+    Autocompletado de nombres de producto sobre todo el catálogo: nombres normalizados distintos en un
+    array ordenado (el rango de un prefijo sale con bisect) y un ranking precalculado, primero los que
+    más veces aparecen (entre proveedores y hojas) y después los más baratos. Los prefijos que abarcan
+    más de DENSE_RANGE nombres ya quedan resueltos al armar el índice; el resto se resuelve sobre un
+    rango chico, así ninguna consulta recorre una parte grande del catálogo
+    """
+    DENSE_RANGE = 256
+    TOP = 10  # Completaciones precalculadas por prefijo (máximo que devuelve lookup)
+    
+    def __init__(self, keys, labels, ranks, dense_top):
+        self.keys = keys
+        self.labels = labels
+        self.ranks = ranks
+        self.dense_top = dense_top
+    
+    @classmethod
+    def summarize(cls, table, rows=None):
+        """Resumen de una tabla (o de esas filas, ordenadas) por nombre normalizado (apariciones, precio mínimo, nombre a mostrar)"""
+        if rows is None:
+            rows = table.live_rows()
+        frame = pd.DataFrame({
+            'key': [table.search_keys[row] for row in rows],
+            'label': [table.names[row].lower() for row in rows],
+            'price': table.prices[rows]
+        })
+        frame = frame[frame['key'] != '']
+        return frame.groupby('key', sort=True).agg(count=('price', 'size'), price=('price', 'min'), label=('label', 'first'))
+    
+    @classmethod
+    def update_summary(cls, summary, table, keys):
+        """Resumen de una tabla a partir del de la tabla de la que se copió: solo se recalculan los nombres de keys"""
+        keys = sorted(key for key in keys if key)
+        rows = np.array(sorted(chain.from_iterable(table.rows_with_key(key) for key in keys)), dtype=np.int64)
+        return pd.concat([summary.drop(keys, errors='ignore'), cls.summarize(table, rows)]).sort_index()
+    
+    @classmethod
+    def build(cls, tables):
+        return cls.from_summaries([cls.summarize(table) for table in tables])
+    
+    @classmethod
+    def from_summaries(cls, summaries):
+        """Índice sobre los resúmenes de varias tablas (ver summarize), sumando las apariciones de cada nombre"""
+        summaries = [summary for summary in summaries if len(summary)]
+        if not summaries:
+            return cls([], [], np.empty(0, dtype=np.int64), {})
+        if len(summaries) == 1:
+            grouped = summaries[0]
+        else:
+            grouped = pd.concat(summaries).groupby(level=0, sort=True).agg(count=('count', 'sum'), price=('price', 'min'), label=('label', 'first'))
+        
+        # Posición de cada nombre en el ranking: más apariciones, más barato, orden alfabético
+        order = np.lexsort((np.arange(len(grouped)), grouped['price'].to_numpy(), -grouped['count'].to_numpy()))
+        ranks = np.empty(len(grouped), dtype=np.int64)
+        ranks[order] = np.arange(len(grouped))
+        keys = grouped.index.tolist()
+        labels = grouped['label'].tolist()
+        
+        index = cls(keys, labels, ranks, {})
+        
+        # Prefijos densos: se baja por el array ordenado desde la raíz, solo por los rangos que siguen siendo grandes
+        pending = [('', 0, len(keys))]
+        while pending:
+            prefix, start, end = pending.pop()
+            position = start
+            while position < end:
+                if len(keys[position]) == len(prefix):
+                    position += 1  # El nombre que es exactamente el prefijo no abre ninguna rama
+                    continue
+                child = keys[position][:len(prefix) + 1]
+                child_end = bisect_left(keys, child + '\U0010ffff', position, end)
+                if child_end - position > cls.DENSE_RANGE:
+                    index.dense_top[child] = index._best(position, child_end, cls.TOP)
+                    pending.append((child, position, child_end))
+                position = child_end
+        return index
+    
+    def _best(self, start, end, limit):
+        """Las `limit` mejores completaciones entre las posiciones start y end del array ordenado"""
+        ranks = self.ranks[start:end]
+        if len(ranks) > limit:
+            best = np.argpartition(ranks, limit - 1)[:limit]
+        else:
+            best = np.arange(len(ranks))
+        best = best[np.argsort(ranks[best])]
+        return [self.labels[start + position] for position in best]
+    
+    def lookup(self, prefix, limit=5):
+        """Hasta `limit` completaciones del prefijo, de la mejor a la peor"""
+        prefix = normalize_search_text(prefix)
+        limit = min(limit, self.TOP)
+        if not prefix or limit <= 0:
+            return []
+        if prefix in self.dense_top:
+            return self.dense_top[prefix][:limit]
+        
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix + '\U0010ffff', start)
+        return self._best(start, end, limit)
+
+suggest_index = SuggestIndex.build([])
+
+suggest_lock = threading.Lock()  # Un rearmado del autocompletado a la vez (se toma antes que catalog_lock, nunca adentro)
+suggest_summaries = {}  # uid de la ProductTable -> SuggestIndex.summarize de esa tabla
+
+def refresh_suggestions():
+    """
+    Rearma el autocompletado con las listas publicadas. Llamar SIN catalog_lock tomado y después de publicar.
+    Cada cambio de una lista publica una tabla nueva (con otro uid), así que solo se resumen de nuevo las
+    tablas que cambiaron, y de una recarga solo los nombres que cambiaron; la unión de los resúmenes se arma fuera de catalog_lock
+    """
+    global suggest_index
+    with suggest_lock:
+        # La foto se toma con suggest_lock tomado: el último rearmado siempre ve las listas más nuevas
+        with catalog_lock:
+            tables = [data['products'] for data in price_lists.values()]
+        summaries = {}
+        for table in tables:
+            summary = suggest_summaries.get(table.uid)
+            if summary is None and table.changed_from is not None and table.changed_from[0] in suggest_summaries:
+                uid, keys = table.changed_from
+                summary = SuggestIndex.update_summary(suggest_summaries[uid], table, keys)
+            summaries[table.uid] = summary if summary is not None else SuggestIndex.summarize(table)
+        suggest_summaries.clear()
+        suggest_summaries.update(summaries)
+        suggest_index = SuggestIndex.from_summaries(list(summaries.values()))
+
+class ProductMatcher:
+    """
+    Vincula el mismo producto entre proveedores para comparar precios de verdad.
+    Cada producto se representa con TF-IDF de trigramas de caracteres de sus palabras descriptivas
+    (hasheados a MATCH_FEATURES columnas de una matriz dispersa). Solo se comparan pares que comparten
+    alguna palabra poco común (blocking) y que tienen los mismos números (1 lt no es 2.25 lt); de los pares
+    con coseno >= MATCH_THRESHOLD se queda el mejor mutuo entre cada par de proveedores y los grupos de
+    productos equivalentes se arman uniendo esas aristas sin repetir proveedor dentro de un grupo.
+    Al cargar una lista solo se recalculan las aristas de ese proveedor contra los demás
+    """
+    def __init__(self, features, threshold, max_block_pairs):
+        self.features = features
+        self.threshold = threshold
+        self.max_block_pairs = max_block_pairs
+        self.document_frequency = np.zeros(features, dtype=np.int64)  # En cuántos productos aparece cada trigrama
+        self.supplier_frequency = {}  # Aporte de cada proveedor a document_frequency
+        self.edges = {}  # (proveedor, proveedor) -> (filas del primero, filas del segundo, similitud)
+        self.tables = {}
+        self.profiles = {}  # Vectores y palabras de cada tabla (cambian solo cuando se recarga esa lista)
+        self.version = 0
+        self.components = None
+        self.group_of = {}  # (proveedor, fila) -> grupo de self.components
+        self.lock = threading.Lock()
+    
+    def _counts(self, table, rows):
+        """Matriz dispersa de cantidad de cada trigrama de las palabras descriptivas (con espacios en los bordes) de esas filas"""
+        keys = [f" {' '.join(descriptive_words(table.search_keys[row]))} " for row in rows]
+        text = '\0'.join(keys)
+        lengths = np.fromiter(map(len, keys), dtype=np.int64, count=len(keys))
+        codes = trigram_codes(text)
+        chars = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+        valid = (chars[:-2] != 0) & (chars[1:-1] != 0) & (chars[2:] != 0)
+        positions = np.repeat(np.arange(len(rows)), lengths + 1)[:len(codes)][valid]
+        columns = codes[valid] % self.features
+        counts = sparse.csr_matrix((np.ones(len(columns), dtype=np.float64), (positions, columns)), shape=(len(rows), self.features))
+        counts.sum_duplicates()
+        return counts
+    
+    def _weighted(self, counts):
+        """TF-IDF con la frecuencia de documentos actual, normalizado por fila (producto punto = coseno)"""
+        idf = np.log((1 + sum(len(table) for table in self.tables.values())) / (1 + self.document_frequency)) + 1
+        weighted = counts.multiply(idf).tocsr()
+        norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return sparse.diags(1 / norms) @ weighted
+    
+    def _profile(self, table, previous=None):
+        """
+        Todo lo que hace falta para comparar una tabla: filas, vectores, palabras de blocking y firma de números.
+        previous es el perfil de la tabla de la que se copió ésta (mismas filas más las agregadas al final):
+        de esas filas se queda con las vigentes y solo calcula las nuevas
+        """
+        start = previous['end'] if previous is not None else 0
+        rows = start + np.flatnonzero(table.alive[start:])
+        counts = self._counts(table, rows)
+        words = []
+        numbers = []
+        for row in rows:
+            tokens = table.search_keys[row].split()
+            words.append([token for token in dict.fromkeys(descriptive_words(table.search_keys[row])) if len(token) >= 3])
+            numbers.append(hash(tuple(sorted({token for token in tokens if token[0].isdigit()}))))
+        numbers = np.array(numbers, dtype=np.int64)
+        if previous is not None:
+            keep = table.alive[previous['rows']]
+            rows = np.concatenate([previous['rows'][keep], rows])
+            counts = sparse.vstack([previous['counts'][keep], counts], format='csr')
+            words = list(compress(previous['words'], keep)) + words
+            numbers = np.concatenate([previous['numbers'][keep], numbers])
+        return {'rows': rows, 'counts': counts, 'words': words, 'numbers': numbers, 'end': len(table.alive)}
+    
+    def _candidate_pairs(self, left, right):
+        """Pares (posición izquierda, posición derecha) que comparten una palabra de blocking manejable"""
+        left_words = pd.Series(left['words'], dtype=object).explode().dropna()
+        right_words = pd.Series(right['words'], dtype=object).explode().dropna()
+        codes, vocabulary = pd.factorize(pd.concat([left_words, right_words], ignore_index=True))
+        left_codes, right_codes = codes[:len(left_words)], codes[len(left_words):]
+        
+        # Una palabra que aparece en muchos productos de ambos lados (p. ej. "chocolate") no sirve para separar
+        left_size = np.bincount(left_codes, minlength=len(vocabulary))
+        right_size = np.bincount(right_codes, minlength=len(vocabulary))
+        usable = left_size * right_size <= self.max_block_pairs
+        
+        keep_left, keep_right = usable[left_codes], usable[right_codes]
+        left_matrix = sparse.csr_matrix(
+            (np.ones(keep_left.sum()), (left_words.index.to_numpy()[keep_left], left_codes[keep_left])),
+            shape=(len(left['rows']), len(vocabulary))
+        )
+        right_matrix = sparse.csr_matrix(
+            (np.ones(keep_right.sum()), (right_words.index.to_numpy()[keep_right], right_codes[keep_right])),
+            shape=(len(right['rows']), len(vocabulary))
+        )
+        pairs = (left_matrix @ right_matrix.T).tocoo()
+        return pairs.row, pairs.col
+    
+    def _match(self, left, right):
+        """Aristas entre dos tablas: (filas izquierda, filas derecha, similitud)"""
+        if not len(left['rows']) or not len(right['rows']):
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0)
+        left_positions, right_positions = self._candidate_pairs(left, right)
+        same_numbers = left['numbers'][left_positions] == right['numbers'][right_positions]
+        left_positions, right_positions = left_positions[same_numbers], right_positions[same_numbers]
+        
+        left_vectors, right_vectors = self._weighted(left['counts']), self._weighted(right['counts'])
+        similarity = np.empty(len(left_positions))
+        for start in range(0, len(left_positions), 200000):
+            chunk = slice(start, start + 200000)
+            similarity[chunk] = np.asarray(
+                left_vectors[left_positions[chunk]].multiply(right_vectors[right_positions[chunk]]).sum(axis=1)
+            ).ravel()
+        
+        matched = similarity >= self.threshold
+        left_positions, right_positions, similarity = left_positions[matched], right_positions[matched], similarity[matched]
+        
+        # Solo el mejor candidato mutuo: un producto queda unido a lo sumo a uno de cada otro proveedor,
+        # así los grupos no encadenan "alfajor x 24" de todas las marcas en un solo grupo
+        order = np.lexsort((right_positions, left_positions, -similarity))
+        best_left = np.zeros(len(order), dtype=bool)
+        best_right = np.zeros(len(order), dtype=bool)
+        best_left[order[np.unique(left_positions[order], return_index=True)[1]]] = True
+        best_right[order[np.unique(right_positions[order], return_index=True)[1]]] = True
+        mutual = best_left & best_right
+        return left['rows'][left_positions[mutual]], right['rows'][right_positions[mutual]], similarity[mutual]
+    
+    def _forget(self, supplier_name):
+        if supplier_name in self.supplier_frequency:
+            self.document_frequency -= self.supplier_frequency.pop(supplier_name)
+        self.tables.pop(supplier_name, None)
+        self.profiles.pop(supplier_name, None)
+        for pair in [pair for pair in self.edges if supplier_name in pair]:
+            del self.edges[pair]
+    
+    def update_supplier(self, supplier_name, table):
+        """
+        Recalcula las aristas de un proveedor contra todos los demás (tras cargar o recargar su lista). Si la
+        tabla es una copia de la anterior con cambios (ver apply_price_list_diff) el perfil se actualiza en lugar
+        de rearmarse; las aristas sí se recalculan enteras, porque el mejor par mutuo depende de toda la lista
+        """
+        start = time.perf_counter()
+        with self.lock:
+            previous = self.profiles.get(supplier_name)
+            if previous is None or table.changed_from is None or table.changed_from[0] != self.tables[supplier_name].uid:
+                previous = None
+            self._forget(supplier_name)
+            profile = self._profile(table, previous)
+            frequency = np.bincount(profile['counts'].indices, minlength=self.features)
+            self.supplier_frequency[supplier_name] = frequency
+            self.document_frequency += frequency
+            self.tables[supplier_name] = table
+            self.profiles[supplier_name] = profile
+            
+            matched = 0
+            for other_name, other_profile in self.profiles.items():
+                if other_name == supplier_name:
+                    continue
+                self.edges[(supplier_name, other_name)] = self._match(profile, other_profile)
+                matched += len(self.edges[(supplier_name, other_name)][0])
+            self.version += 1
+            self.components = None
+        print(f"🔗 {supplier_name}: {matched} coincidencias con otros proveedores en {time.perf_counter() - start:.2f}s")
+    
+    def remove_supplier(self, supplier_name):
+        with self.lock:
+            self._forget(supplier_name)
+            self.version += 1
+            self.components = None
+    
+    def rebuild(self, tables):
+        """Recalcula todo (al arrancar con un catálogo guardado)"""
+        with self.lock:
+            self.document_frequency[:] = 0
+            self.supplier_frequency.clear()
+            self.edges.clear()
+            self.tables.clear()
+            self.profiles.clear()
+        for supplier_name, table in tables.items():
+            self.update_supplier(supplier_name, table)
+    
+    def clusters(self):
+        """
+        Grupos de productos equivalentes de más de un proveedor: lista de [(proveedor, fila), ...].
+        Se recalculan solo cuando cambiaron las aristas
+        """
+        with self.lock:
+            if self.components is not None:
+                return self.components
+            
+            # Se unen primero las aristas más parecidas y nunca dos grupos que ya tengan un producto del mismo
+            # proveedor: así "platino x 24" y "triple x 24" de un proveedor no terminan en el mismo grupo
+            edges = []
+            for (left_name, right_name), (left_rows, right_rows, similarity) in self.edges.items():
+                alive = self.tables[left_name].alive[left_rows] & self.tables[right_name].alive[right_rows]
+                edges.extend(zip(similarity[alive].tolist(), repeat(left_name), left_rows[alive].tolist(), repeat(right_name), right_rows[alive].tolist()))
+            edges.sort(key=lambda edge: -edge[0])
+            
+            parent = {}
+            members = {}
+            def find(node):
+                while parent[node] != node:
+                    parent[node] = parent[parent[node]]
+                    node = parent[node]
+                return node
+            
+            for _, left_name, left_row, right_name, right_row in edges:
+                for node in ((left_name, left_row), (right_name, right_row)):
+                    if node not in parent:
+                        parent[node] = node
+                        members[node] = {node[0]: node[1]}
+                left_root, right_root = find((left_name, left_row)), find((right_name, right_row))
+                if left_root == right_root or members[left_root].keys() & members[right_root].keys():
+                    continue
+                if len(members[left_root]) < len(members[right_root]):
+                    left_root, right_root = right_root, left_root
+                parent[right_root] = left_root
+                members[left_root].update(members.pop(right_root))
+            
+            groups = [list(group.items()) for group in members.values() if len(group) > 1]
+            self.components = groups
+            self.group_of = {product: group for group in groups for product in group}
+            return groups
+    
+    def equivalents(self, supplier_name, row):
+        """Productos equivalentes a uno dado (incluido él mismo) como [(proveedor, fila), ...]"""
+        self.clusters()
+        return self.group_of.get((supplier_name, row), [(supplier_name, row)])
+
+product_matcher = ProductMatcher(app.config['MATCH_FEATURES'], app.config['MATCH_THRESHOLD'], app.config['MATCH_MAX_BLOCK_PAIRS'])
+
+def published_lists():
+    """
+    Foto de price_lists para recorrerla sin catalog_lock: otro thread puede publicar o borrar una lista
+    a mitad del recorrido, y recorrer el dict mientras cambia de tamaño falla. Copiar el dict no se interrumpe
+    """
+    return dict(price_lists)
+
+def catalog_changed():
+    """
+    Marca que cambió el contenido del catálogo. Llamar con catalog_lock tomado y DESPUÉS de modificar
+    price_lists: si la generación subiera antes, una búsqueda concurrente podría guardar en la caché,
+    con la generación nueva, un resultado armado con las listas viejas. El autocompletado se rearma
+    aparte, ya soltado el lock (ver refresh_suggestions)
+    """
+    global catalog_generation
+    catalog_generation += 1
+
+def store_price_list(supplier_name, filename, products, debug_info):
+    """
+    Publica la lista de un proveedor en el catálogo. Si ya había una lista cargada para ese proveedor,
+    la compara con la nueva y aplica solo las diferencias, así los productos sin cambios conservan su
+    id (los carritos siguen siendo válidos). products puede ser un iterable que se parsea a medida que se
+    recorre (motor en streaming): se pasa de a lotes a una tabla nueva antes de tomar catalog_lock.
+    Devuelve la cantidad de productos por tipo de cambio
+    """
+    staged = stage_price_list(supplier_name, products)
+    
+    with catalog_lock, catalog_store.writing() as synced:
+        entry = price_lists.get(supplier_name)
+        
+        if entry is None:
+            table = staged
+            changes = {'added': len(staged), 'removed': 0, 'price_changed': 0, 'unchanged': 0}
+        else:
+            added, removed, changed, new_prices, unchanged = diff_price_lists(entry['products'], staged)
+            table = apply_price_list_diff(entry['products'], staged, added, removed, changed, new_prices)
+            changes = {'added': len(added), 'removed': len(removed), 'price_changed': len(changed), 'unchanged': unchanged}
+            
+            # Demasiadas filas borradas: compactar la tabla
+            if len(table.alive) > 2 * len(table):
+                table, _ = table.compacted()
+        
+        table.update_search_indexes()
+        
+        # Reemplazar la entrada entera (con la tabla nueva): quien esté leyendo la anterior no la ve cambiar a mitad
+        price_lists[supplier_name] = {
+            'filename': filename,
+            'upload_date': datetime.now().isoformat(),
+            'products': table,
+            'total_products': len(table),
+            'debug_info': debug_info
+        }
+        if entry is None or changes['added'] or changes['removed']:
+            product_matcher.update_supplier(supplier_name, table)
+        # Recién con la lista publicada (y sus coincidencias): una búsqueda que ve la generación nueva ya ve la lista nueva
+        if entry is None or changes['added'] or changes['removed'] or changes['price_changed']:
+            catalog_changed()
+        catalog_store.save(supplier_name, price_lists[supplier_name])
+    
+    if synced or entry is None or changes['added'] or changes['removed'] or changes['price_changed']:
+        refresh_suggestions()
+    print(f"🔄 {supplier_name}: {changes['added']} nuevos, {changes['removed']} eliminados, {changes['price_changed']} con otro precio, {changes['unchanged']} sin cambios")
+    return changes
+
+class CatalogStore:
+    """
+    Catálogo persistido en disco, una carpeta por proveedor. Cada columna de la ProductTable va en su
+    propio .npy (se abren con mmap al arrancar, sin copiarlas a memoria), los nombres en un único archivo
+    de texto separado por NUL (también mapeado, ver MappedStrings, igual que el vocabulario y el texto de los índices
+    de búsqueda) y el resto de la entrada de price_lists en meta.json.
+    Cada guardado escribe archivos con un número de generación nuevo y recién al final reemplaza
+    meta.json, así una caída a mitad de escritura deja la versión anterior intacta.
+    Con varios workers cada cambio reescribe además un archivo de versión: los demás lo ven distinto y
+    vuelven a mapear solo las listas cuya generación cambió (ver sync)
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        self.generations = {}  # proveedor -> generación que tiene cargada este proceso
+        self.version_path = os.path.join(folder, 'version')
+        self.seen_version = None  # Contenido del archivo de versión la última vez que se sincronizó
+    
+    def version(self):
+        try:
+            with open(self.version_path, encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+    
+    def _touch(self):
+        """Avisa a los otros workers que el catálogo cambió"""
+        version = uuid.uuid4().hex
+        with open(f"{self.version_path}.tmp", 'w', encoding='utf-8') as f:
+            f.write(version)
+        os.replace(f"{self.version_path}.tmp", self.version_path)
+        self.seen_version = version
     
+    @contextmanager
+    def writing(self):
+        """
+        Exclusión entre workers para modificar el catálogo (llamar con catalog_lock tomado). Antes de
+        modificar se sincroniza, así la lista nueva se compara contra la última guardada y no contra
+        una copia vieja de este proceso. Da si la sincronización trajo cambios. Con un solo proceso no hace nada
+        """
+        if not app.config['SHARED_STATE'] or fcntl is None:
+            yield False
+            return
+        with open(os.path.join(self.folder, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield sync_shared_catalog()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
     
-    def process_excel_file(self, file_path, supplier_name):
-        """Procesa un archivo Excel y extrae productos y precios"""
-        excel_file = None
-        debug_info = []
-        
+    def sync(self, lists):
+        """
+        Vuelve a mapear las listas que otro worker guardó o borró desde la última vez (llamar con
+        catalog_lock tomado). Devuelve (proveedores actualizados, proveedores borrados)
+        """
+        version = self.version()
+        updated, removed = [], []
+        on_disk = {}
+        for entry in os.scandir(self.folder):
+            if not entry.is_dir():
+                continue
+            try:
+                with open(os.path.join(entry.path, 'meta.json'), encoding='utf-8') as f:
+                    meta = json.load(f)
+            except (FileNotFoundError, ValueError):
+                continue
+            on_disk[meta['supplier']] = entry.path
+            if self.generations.get(meta['supplier']) == meta['generation']:
+                continue
+            try:
+                supplier_name, data = self.load(entry.path)
+            except Exception as e:
+                # Lo más probable es que otro worker lo esté reescribiendo: se reintenta en el próximo pedido
+                print(f"⚠️ No se pudo sincronizar {meta['supplier']}: {str(e)}")
+                version = None
+                continue
+            lists[supplier_name] = data
+            updated.append(supplier_name)
+        for supplier_name in [name for name in lists if name not in on_disk]:
+            del lists[supplier_name]
+            self.generations.pop(supplier_name, None)
+            removed.append(supplier_name)
+        self.seen_version = version
+        return updated, removed
+    
+    def _supplier_folder(self, supplier_name):
+        return os.path.join(self.folder, hashlib.sha1(supplier_name.encode('utf-8')).hexdigest()[:16])
+    
+    def save(self, supplier_name, entry):
+        """Guarda la lista de un proveedor (entrada de price_lists)"""
+        table = entry['products']
+        folder = self._supplier_folder(supplier_name)
         try:
-            print(f"🔍 Procesando archivo: {file_path}")
-            
-            # Leer todas las hojas del Excel
-            excel_file = pd.ExcelFile(file_path)
-            all_products = []
-            
-            print(f"📊 Hojas encontradas en {supplier_name}: {excel_file.sheet_names}")
-            debug_info.append(f"Hojas: {', '.join(excel_file.sheet_names)}")
-            
-            for sheet_name in excel_file.sheet_names:
-                print(f"📋 Procesando hoja: {sheet_name}")
-                
-                try:
-                    # Leer sin especificar header para tener acceso a todas las filas
-                    df = pd.read_excel(excel_file, sheet_name=sheet_name, header=None)
-                    
-                    if df.empty:
-                        print(f"⚠️ Hoja {sheet_name} está vacía")
-                        debug_info.append(f"Hoja {sheet_name}: vacía")
-                        continue
-                    
-                    print(f"📏 Dimensiones de {sheet_name}: {df.shape}")
-                    debug_info.append(f"Hoja {sheet_name}: {df.shape[0]} filas, {df.shape[1]} columnas")
-                    
-                    # Buscar primero en headers tradicionales
-                    df_with_header = pd.read_excel(excel_file, sheet_name=sheet_name)
-                    product_col_idx = self.find_column_index(df_with_header, self.possible_product_columns)
-                    price_col_idx = self.find_column_index(df_with_header, self.possible_price_columns)
-                    
-                    header_row = 0  # Por defecto, asumir que la primera fila es el header
-                    
-                    # Si no se encontraron columnas en headers, buscar en las primeras 8 filas
-                    if product_col_idx is None or price_col_idx is None:
-                        print("🔍 No se encontraron columnas en headers, buscando en primeras 8 filas...")
-                        
-                        # Buscar columnas de producto
-                        if product_col_idx is None:
-                            header_row_product, found_product_cols = self.find_column_in_first_rows(
-                                df, self.possible_product_columns
-                            )
-                            if found_product_cols:
-                                product_col_idx = list(found_product_cols.keys())[0]
-                                header_row = max(header_row, header_row_product)
-                                print(f"✅ Columna de producto encontrada en fila {header_row_product}, columna {product_col_idx}")
-                        
-                        # Buscar columnas de precio
-                        if price_col_idx is None:
-                            header_row_price, found_price_cols = self.find_column_in_first_rows(
-                                df, self.possible_price_columns
-                            )
-                            if found_price_cols:
-                                price_col_idx = list(found_price_cols.keys())[0]
-                                header_row = max(header_row, header_row_price)
-                                print(f"✅ Columna de precio encontrada en fila {header_row_price}, columna {price_col_idx}")
-                    
-                    if product_col_idx is None:
-                        print(f"❌ No se encontró columna de producto en {sheet_name}")
-                        debug_info.append(f"Hoja {sheet_name}: No se encontró columna de producto")
-                        continue
-                        
-                    if price_col_idx is None:
-                        print(f"❌ No se encontró columna de precio en {sheet_name}")
-                        print(f"🔍 Columnas disponibles: {list(df_with_header.columns)}")
-                        print(f"📋 Valores de la fila header ({header_row}): {list(df.iloc[header_row].values) if header_row < len(df) else 'Fila no disponible'}")
-                        debug_info.append(f"Hoja {sheet_name}: No se encontró columna de precio. Columnas disponibles: {list(df_with_header.columns)}")
-                        
-                        # PREVENIR ERROR: No permitir que use la misma columna para producto y precio
-                        print(f"⚠️ EVITANDO ERROR: No se puede usar la misma columna para producto y precio")
-                        continue
-                    
-                    # VALIDACIÓN CRÍTICA: Verificar que producto y precio son columnas diferentes
-                    if product_col_idx == price_col_idx:
-                        print(f"❌ ERROR CRÍTICO: La misma columna ({product_col_idx}) se detectó para producto Y precio")
-                        print(f"🔍 Esto indica que no se encontró una columna de precio válida")
-                        print(f"📋 Columnas disponibles: {list(df_with_header.columns)}")
-                        debug_info.append(f"Hoja {sheet_name}: ERROR - misma columna para producto y precio (col {product_col_idx})")
-                        continue
-                    
-                    # Crear DataFrame con el header correcto
-                    if header_row > 0:
-                        # Si encontramos headers en filas posteriores, usar esa fila como header
-                        df_processed = pd.read_excel(excel_file, sheet_name=sheet_name, header=header_row)
-                        # Ajustar los índices de columna ya que el DataFrame cambió
-                        if len(df_processed.columns) > product_col_idx:
-                            product_col = df_processed.columns[product_col_idx]
-                        else:
-                            product_col = product_col_idx
-                        
-                        if len(df_processed.columns) > price_col_idx:
-                            price_col = df_processed.columns[price_col_idx]
-                        else:
-                            price_col = price_col_idx
-                    else:
-                        df_processed = df_with_header
-                        product_col = df_processed.columns[product_col_idx]
-                        price_col = df_processed.columns[price_col_idx]
-                    
-                    print(f"✅ Columnas detectadas - Producto: '{product_col}' (col {product_col_idx}), Precio: '{price_col}' (col {price_col_idx})")
-                    print(f"📍 Header detectado en fila: {header_row}")
-                    debug_info.append(f"Hoja {sheet_name}: Producto='{product_col}', Precio='{price_col}', Header en fila {header_row}")
-                    
-                    # Procesar cada fila
-                    products_in_sheet = 0
-                    skipped_invalid_prices = 0
-                    
-                    for idx, row in df_processed.iterrows():
-                        try:
-                            product = row[product_col]
-                            price_raw = row[price_col]
-                            
-                            # DEBUG: Mostrar exactamente qué está leyendo
-                            if products_in_sheet < 3:  # Solo para los primeros 3 productos
-                                print(f"🔍 DEBUG Fila {idx}:")
-                                print(f"   Producto (columna '{product_col}'): '{product}'")
-                                print(f"   Precio RAW (columna '{price_col}'): '{price_raw}' (tipo: {type(price_raw)})")
-                            
-                            # Solo procesar si hay un producto válido
-                            if pd.notna(product) and str(product).strip():
-                                price = self.clean_price(price_raw)
-                                
-                                # Debug detallado para los primeros casos
-                                if products_in_sheet < 3:
-                                    print(f"   Precio PROCESADO: {price}")
-                                    if price is None:
-                                        print(f"   ❌ PRECIO RECHAZADO: '{price_raw}' no es un precio válido")
-                                    else:
-                                        print(f"   ✅ PRECIO ACEPTADO: {price}")
-                                
-                                if price is not None and price > 0:
-                                    product_info = {
-                                        'product': str(product).strip(),
-                                        'price': price,
-                                        'supplier': supplier_name,
-                                        'sheet': sheet_name,
-                                        'location': DEFAULT_LOCATIONS.get(supplier_name, 'Buenos Aires, Argentina'),
-                                        'id': f"{supplier_name}_{sheet_name}_{idx}_{products_in_sheet}"  # ID único para el carrito
-                                    }
-                                    all_products.append(product_info)
-                                    products_in_sheet += 1
-                                elif pd.notna(price_raw):
-                                    skipped_invalid_prices += 1
-                                    
-                        except Exception as row_error:
-                            print(f"❌ Error procesando fila {idx}: {row_error}")
-                            continue  # Saltar filas con errores
-                    
-                    print(f"✅ Productos válidos en {sheet_name}: {products_in_sheet}")
-                    if skipped_invalid_prices > 0:
-                        print(f"⚠️ Precios inválidos omitidos: {skipped_invalid_prices}")
-                    debug_info.append(f"Hoja {sheet_name}: {products_in_sheet} productos válidos, {skipped_invalid_prices} precios inválidos omitidos")
-                    
-                except Exception as sheet_error:
-                    print(f"❌ Error procesando hoja {sheet_name}: {str(sheet_error)}")
-                    debug_info.append(f"Hoja {sheet_name}: Error - {str(sheet_error)}")
-                    continue
-            
-            print(f"🎉 Total productos procesados para {supplier_name}: {len(all_products)}")
-            
-            # Si no se encontraron productos, guardar info de debug
-            if len(all_products) == 0:
-                print(f"⚠️ DIAGNÓSTICO COMPLETO PARA {supplier_name}:")
-                for info in debug_info:
-                    print(f"   {info}")
+            os.makedirs(folder, exist_ok=True)
+            generation = uuid.uuid4().hex[:12]
             
-            return all_products, debug_info
+            for column in ProductTable.COLUMNS:
+                np.save(os.path.join(folder, f"{generation}_{column}.npy"), getattr(table, column))
+            write_strings(os.path.join(folder, f"{generation}_names.txt"), table.names)
+            write_strings(os.path.join(folder, f"{generation}_search_keys.txt"), table.search_keys)
+            if table.token_index is not None:
+                np.save(os.path.join(folder, f"{generation}_token_offsets.npy"), table.token_index.offsets)
+                np.save(os.path.join(folder, f"{generation}_token_postings.npy"), table.token_index.postings)
+                write_strings(os.path.join(folder, f"{generation}_vocabulary.txt"), table.token_index.vocabulary)
+            if table.trigram_index is not None:
+                for name in ('codes', 'offsets', 'postings', 'rows', 'starts'):
+                    np.save(os.path.join(folder, f"{generation}_trigram_{name}.npy"), getattr(table.trigram_index, name))
+                text = table.trigram_index.text
+                write_strings(os.path.join(folder, f"{generation}_trigram_text.txt"), [text] if isinstance(text, str) else text)
             
+            meta = {
+                'generation': generation,
+                'supplier': supplier_name,
+                'filename': entry['filename'],
+                'upload_date': entry['upload_date'],
+                'debug_info': entry['debug_info'],
+                'sheets': table.sheets,
+                'rows': len(table.names),
+                'indexed_rows': table.indexed_rows,
+                'parser_version': PARSER_VERSION
+            }
+            meta_path = os.path.join(folder, 'meta.json')
+            with open(f"{meta_path}.tmp", 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(f"{meta_path}.tmp", meta_path)
+            self.generations[supplier_name] = generation
+            self._touch()
         except Exception as e:
-            error_msg = f"Error procesando archivo {file_path}: {str(e)}"
-            print(f"💥 {error_msg}")
-            debug_info.append(f"Error general: {str(e)}")
-            return [], debug_info
-        finally:
-            # Cerrar el archivo Excel explícitamente
-            if excel_file is not None:
+            print(f"⚠️ No se pudo guardar el catálogo de {supplier_name}: {str(e)}")
+            return
+        
+        # Borrar generaciones anteriores
+        for filename in os.listdir(folder):
+            if filename != 'meta.json' and not filename.startswith(f"{generation}_"):
                 try:
-                    excel_file.close()
+                    os.remove(os.path.join(folder, filename))
                 except:
                     pass
+    
+    def load(self, folder):
+        """Lee la lista guardada en una carpeta. Devuelve (proveedor, entrada de price_lists)"""
+        with open(os.path.join(folder, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        generation = meta['generation']
+        
+        table = ProductTable(meta['supplier'])
+        for column in ProductTable.COLUMNS:
+            path = os.path.join(folder, f"{generation}_{column}.npy")
+            if column == 'id_hashes' and not os.path.exists(path):
+                continue  # Guardado antes de los ids por contenido: se calculan abajo
+            # Copy-on-write: la tabla puede modificar precios o borrar filas sin tocar el archivo
+            setattr(table, column, np.load(path, mmap_mode='c'))
+        table.names = MappedStrings(os.path.join(folder, f"{generation}_names.txt")) if meta['rows'] else []
+        if len(table.id_hashes) != meta['rows']:
+            # Claves numeradas sobre las filas vigentes; las borradas no se pueden pedir
+            table.id_hashes = np.zeros(meta['rows'], dtype=np.uint64)
+            live_rows = np.flatnonzero(table.alive)
+            table.id_hashes[live_rows] = [product_id_hash(key) for key in numbered_keys({'product': table.names[row]} for row in live_rows)]
+        if len(table.names) != meta['rows'] or len(table.prices) != meta['rows']:
+            raise ValueError('columnas de distinto largo')
+        
+        table.sheets = meta['sheets']
+        table.sheet_codes_by_name = {sheet: code for code, sheet in enumerate(table.sheets)}
+        table.live_count = int(np.count_nonzero(table.alive))
+        
+        # Claves e índices de búsqueda: si son de otra versión del parser (o faltan) se rearman desde los nombres
+        if not self._load_search_data(folder, meta, table):
+            table.search_keys = [normalize_search_text(name) for name in table.names]
+        # Filas agregadas después del último armado completo: se indexan aparte, como antes de guardar
+        table.update_search_indexes()
+        
+        self.generations[meta['supplier']] = generation
+        return meta['supplier'], {
+            'filename': meta['filename'],
+            'upload_date': meta['upload_date'],
+            'products': table,
+            'total_products': len(table),
+            'debug_info': meta['debug_info']
+        }
+    
+    def _load_search_data(self, folder, meta, table):
+        """Carga claves de búsqueda e índices guardados. Devuelve False si no sirven para esta versión"""
+        if meta.get('parser_version') != PARSER_VERSION:
+            return False
+        generation = meta['generation']
+        try:
+            search_keys = MappedStrings(os.path.join(folder, f"{generation}_search_keys.txt")) if meta['rows'] else []
+            token_arrays = [np.load(os.path.join(folder, f"{generation}_token_{name}.npy"), mmap_mode='r') for name in ('offsets', 'postings')]
+            trigram_arrays = [np.load(os.path.join(folder, f"{generation}_trigram_{name}.npy"), mmap_mode='r') for name in ('codes', 'offsets', 'postings', 'rows', 'starts')]
+            # offsets tiene una entrada más que el vocabulario
+            vocabulary = MappedStrings(os.path.join(folder, f"{generation}_vocabulary.txt")) if len(token_arrays[0]) > 1 else []
+            text_path = os.path.join(folder, f"{generation}_trigram_text.txt")
+            if os.path.getsize(text_path) == max(int(trigram_arrays[-1][-1]) - 1, 0):
+                text = MappedText(text_path)  # ASCII: tantos bytes como letras
+            else:
+                with open(text_path, encoding='utf-8', newline='') as f:
+                    text = f.read()
+        except FileNotFoundError:
+            return False
+        
+        table.search_keys = search_keys
+        table.token_index = TokenIndex(vocabulary, *token_arrays)
+        table.trigram_index = TrigramIndex(*trigram_arrays, text)
+        table.indexed_rows = meta.get('indexed_rows', meta['rows'])
+        return True
+    
+    def load_all(self):
+        """Lee todas las listas guardadas. Las que no se pueden leer se saltean"""
+        entries = {}
+        for entry in os.scandir(self.folder):
+            if not entry.is_dir():
+                continue
+            try:
+                supplier_name, data = self.load(entry.path)
+                entries[supplier_name] = data
+            except Exception as e:
+                print(f"⚠️ No se pudo leer el catálogo guardado en {entry.path}: {str(e)}")
+        return entries
+    
+    def delete(self, supplier_name):
+        shutil.rmtree(self._supplier_folder(supplier_name), ignore_errors=True)
+        self.generations.pop(supplier_name, None)
+        self._touch()
+    
+    def clear(self):
+        for entry in os.scandir(self.folder):
+            if entry.is_dir():
+                shutil.rmtree(entry.path, ignore_errors=True)
+        self.generations.clear()
+        self._touch()
 
-# Crear instancia del procesador
-processor = PriceListProcessor()
+catalog_store = CatalogStore(app.config['CATALOG_FOLDER'])
+
+def load_saved_catalog():
+    """Vuelve a publicar en price_lists el catálogo guardado en disco"""
+    start = time.perf_counter()
+    with catalog_lock:
+        catalog_store.seen_version = catalog_store.version()
+        price_lists.update(catalog_store.load_all())
+    lists = published_lists()
+    if lists:
+        total = sum(data['total_products'] for data in lists.values())
+        print(f"📂 Catálogo recuperado: {len(lists)} listas, {total} productos en {time.perf_counter() - start:.2f}s")
+        # El autocompletado y las coincidencias entre proveedores se arman aparte para no demorar el arranque
+        threading.Thread(target=rebuild_derived_on_start, daemon=True).start()
+
+def rebuild_derived_on_start():
+    refresh_suggestions()
+    with catalog_lock:
+        product_matcher.rebuild({supplier: data['products'] for supplier, data in price_lists.items()})
+        catalog_changed()  # Lo armado antes con las coincidencias vacías (p. ej. /compare) queda viejo
+
+def sync_shared_catalog():
+    """
+    Modo compartido: trae las listas que otro worker cargó o borró y rearma lo que depende de ellas.
+    Llamar con catalog_lock tomado. Devuelve si cambió algo (hay que rearmar el autocompletado, ya soltado el lock)
+    """
+    updated, removed = catalog_store.sync(price_lists)
+    for supplier_name in removed:
+        product_matcher.remove_supplier(supplier_name)
+    for supplier_name in updated:
+        product_matcher.update_supplier(supplier_name, price_lists[supplier_name]['products'])
+    if updated or removed:
+        catalog_changed()
+        print(f"🔁 Catálogo sincronizado: {len(updated)} listas actualizadas, {len(removed)} eliminadas")
+    return bool(updated or removed)
+
+@app.before_request
+def check_shared_catalog():
+    """Con varios workers, antes de cada pedido se mira si otro cambió el catálogo (una lectura chica)"""
+    if app.config['SHARED_STATE'] and catalog_store.version() != catalog_store.seen_version:
+        with catalog_lock:
+            changed = catalog_store.version() != catalog_store.seen_version and sync_shared_catalog()
+        if changed:
+            refresh_suggestions()
+
+# Solo el proceso principal: los procesos del pool de parseo también importan este módulo
+if multiprocessing.parent_process() is None:
+    load_saved_catalog()
+
+class IngestJob:
+    """
+    Estado y avance de una carga que se procesa en segundo plano. En modo compartido se copia además en
+    statuses (un StateDict): la consulta del estado puede caer en otro worker
+    """
+    STATUS_INTERVAL = 0.5  # Segundos mínimos entre copias del avance a statuses (los cambios de estado se copian siempre)
+    
+    def __init__(self, supplier_name, filename, statuses=None):
+        self.id = uuid.uuid4().hex
+        self.supplier = supplier_name
+        self.filename = filename
+        self.state = 'queued'  # queued -> running -> done | error
+        self.created_at = datetime.now().isoformat()
+        self.finished_at = None
+        self.total_sheets = None
+        self.sheets_done = 0
+        self.rows_parsed = 0
+        self.products_accepted = 0
+        self.products_rejected = 0
+        self.cached = False
+        self.changes = None
+        self.message = ''
+        self.debug_info = []
+        self.lock = threading.Lock()
+        self.statuses = statuses
+        self.publish_lock = threading.Lock()
+        self.published_at = 0.0
+        self.publish(force=True)
+    
+    def add_progress(self, rows=0, accepted=0, rejected=0, sheet_done=False):
+        """Suma avance; se llama desde el thread del trabajo o desde los callbacks del pool"""
+        with self.lock:
+            self.rows_parsed += rows
+            self.products_accepted += accepted
+            self.products_rejected += rejected
+            if sheet_done:
+                self.sheets_done += 1
+        self.publish()
+    
+    def update(self, **fields):
+        with self.lock:
+            for name, value in fields.items():
+                setattr(self, name, value)
+        self.publish(force=True)
+    
+    def publish(self, force=False):
+        """Modo compartido: copia el estado en statuses (el avance, como mucho cada STATUS_INTERVAL segundos)"""
+        if self.statuses is None:
+            return
+        # Foto y escritura juntas: una copia vieja no puede pisar a una más nueva
+        with self.publish_lock:
+            now = time.perf_counter()
+            if force or now - self.published_at >= self.STATUS_INTERVAL:
+                self.published_at = now
+                self.statuses[self.id] = self.to_dict()
+    
+    def to_dict(self):
+        with self.lock:
+            return {
+                'job_id': self.id,
+                'supplier': self.supplier,
+                'filename': self.filename,
+                'state': self.state,
+                'created_at': self.created_at,
+                'finished_at': self.finished_at,
+                'total_sheets': self.total_sheets,
+                'sheets_done': self.sheets_done,
+                'rows_parsed': self.rows_parsed,
+                'products_accepted': self.products_accepted,
+                'products_rejected': self.products_rejected,
+                'cached': self.cached,
+                'changes': self.changes,
+                'message': self.message,
+                'debug_info': self.debug_info[:5] if self.state == 'done' else self.debug_info
+            }
+
+# Cargas en segundo plano: un pool chico de threads coordina y el parseo pesado va al pool de procesos
+ingest_jobs = {}
+ingest_jobs_lock = threading.Lock()
+ingest_executor = ThreadPoolExecutor(max_workers=app.config['INGEST_JOB_WORKERS'], thread_name_prefix='ingest')
+
+def parse_uploaded_file(filepath, filename, supplier_name, job=None):
+    """
+    Parsea un archivo subido con el motor adecuado, reutilizando el resultado si ese mismo
+    archivo ya se procesó para ese proveedor. Con job (carga en segundo plano) las hojas se
+    reparten en el pool de procesos y se va informando el avance.
+    Devuelve (productos, debug_info, desde_cache). Con el motor en streaming productos es un iterable
+    que parsea los lotes a medida que se recorre (se puede recorrer una sola vez) y debug_info se
+    completa recién al terminar de recorrerlo
+    """
+    cache_key = parsed_cache.make_key(filepath, supplier_name)
+    cached = parsed_cache.get(cache_key)
+    if cached is not None:
+        print(f"⚡ {filename} ya estaba parseado para {supplier_name}: usando caché")
+        products, debug_info = cached
+        return products, debug_info, True
+    
+    # Los .xlsx grandes van en streaming, para no cargar hojas enteras en memoria
+    if filename.lower().endswith('.xlsx') and os.path.getsize(filepath) >= app.config['STREAMING_THRESHOLD']:
+        debug_info = ['Motor: streaming']
+        progress = None
+        if job is not None:
+            with pd.ExcelFile(filepath) as excel_file:
+                job.update(total_sheets=len(excel_file.sheet_names))
+            progress = job.add_progress
+        # Los lotes no se juntan en una lista: van directo a store_price_list (por eso este motor no usa la caché de parseo).
+        # Se parsea el primero para saber si el archivo tiene productos
+        batches = processor.iter_excel_file(filepath, supplier_name, debug_info, progress=progress)
+        first_batch = next(batches, None)
+        if first_batch is None:
+            return [], debug_info, False
+        return chain(first_batch, chain.from_iterable(batches)), debug_info, False
+    elif job is not None:
+        with pd.ExcelFile(filepath) as excel_file:
+            sheet_names = excel_file.sheet_names
+        job.update(total_sheets=len(sheet_names))
+        
+        def on_task_done(future):
+            results = future.result() if future.exception() is None else []
+            for _, _, _, stats in results:
+                job.add_progress(stats['rows'], stats['accepted'], stats['rejected'], sheet_done=True)
+        
+        tasks = submit_sheet_tasks(filepath, supplier_name, sheet_names, on_task_done)
+        products, debug_info, _ = collect_sheet_results(sheet_names, tasks)
+    else:
+        products, debug_info = processor.process_excel_file(filepath, supplier_name)
+    
+    if products:
+        parsed_cache.put(cache_key, products, debug_info)
+    return products, debug_info, False
 
 def get_connection():
     return mysql.connector.connect(
@@ -355,23 +2481,44 @@ def get_user(username, password):
     conn.close()
     return user
 
-def generate_pdf_for_supplier(supplier_name, items, business_data, filename):
-    """Genera un PDF para un proveedor específico"""
-    
-    # Crear el PDF
-    pdf_path = os.path.join(app.config['PDFS_FOLDER'], filename)
-    doc = SimpleDocTemplate(pdf_path, pagesize=letter)
+# Estilos de los PDFs de pedido: se arman una sola vez por proceso (ver pdf_styles)
+_pdf_styles = None
+
+def pdf_styles():
+    """Hoja de estilos, estilo del título y estilo de la tabla de productos, creados la primera vez"""
+    global _pdf_styles
+    if _pdf_styles is None:
+        styles = getSampleStyleSheet()
+        title_style = ParagraphStyle(
+            'CustomTitle',
+            parent=styles['Heading1'],
+            fontSize=16,
+            spaceAfter=20,
+            textColor=colors.black,
+            alignment=1  # Centro
+        )
+        table_style = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 12),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('BACKGROUND', (0, 1), (-1, -2), colors.beige),
+            ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
+            ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ])
+        _pdf_styles = (styles, title_style, table_style)
+    return _pdf_styles
+
+def render_order_pdf(supplier_name, items, business_data):
+    """Arma el PDF de pedido de un proveedor en memoria y devuelve sus bytes"""
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
     
     # Estilos
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=16,
-        spaceAfter=20,
-        textColor=colors.black,
-        alignment=1  # Centro
-    )
+    styles, title_style, table_style = pdf_styles()
     
     # Contenido del PDF
     story = []
@@ -417,18 +2564,7 @@ def generate_pdf_for_supplier(supplier_name, items, business_data, filename):
     
     # Crear tabla
     table = Table(table_data, colWidths=[3*inch, 1*inch, 1.2*inch, 1.3*inch])
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -2), colors.beige),
-        ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-    ]))
+    table.setStyle(table_style)
     
     story.append(table)
     story.append(Spacer(1, 30))
@@ -443,7 +2579,74 @@ def generate_pdf_for_supplier(supplier_name, items, business_data, filename):
     
     # Generar PDF
     doc.build(story)
-    return pdf_path
+    return buffer.getvalue()
+
+class PdfStore:
+    """
+    PDFs de pedido recién generados, en memoria para descargarlos sin pasar por el disco (los más viejos
+    salen cuando se supera max_bytes). Guardarlos además en PDFS_FOLDER es opcional y se hace en un
+    thread aparte, salvo en modo compartido: ahí la descarga puede caer en otro worker y lee del disco
+    """
+    def __init__(self, max_bytes, folder, persist):
+        self.max_bytes = max_bytes
+        self.folder = folder
+        self.persist = persist
+        self.entries = OrderedDict()  # nombre de archivo -> (usuario, bytes)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pdf-writer') if persist else None
+    
+    def put(self, filename, user, data):
+        """Guarda un PDF. Devuelve la ruta donde queda en disco, o None si no se persiste"""
+        with self.lock:
+            if filename in self.entries:
+                self.size -= len(self.entries.pop(filename)[1])
+            self.entries[filename] = (user, data)
+            self.size += len(data)
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, (_, old_data) = self.entries.popitem(last=False)
+                self.size -= len(old_data)
+        if not self.persist:
+            return None
+        path = os.path.join(self.folder, filename)
+        if app.config['SHARED_STATE']:
+            self._write(path, data)
+        else:
+            self.writer.submit(self._write, path, data)
+        return path
+    
+    def get(self, filename, user):
+        """Bytes del PDF si está en memoria y es de ese usuario, si no None"""
+        with self.lock:
+            entry = self.entries.get(filename)
+            if entry is None or entry[0] != user:
+                return None
+            self.entries.move_to_end(filename)
+            return entry[1]
+    
+    @staticmethod
+    def _write(path, data):
+        try:
+            with open(f"{path}.tmp", 'wb') as f:
+                f.write(data)
+            os.replace(f"{path}.tmp", path)
+        except Exception as e:
+            print(f"⚠️ No se pudo guardar {path}: {str(e)}")
+
+pdf_store = PdfStore(app.config['PDF_STORE_MAX_BYTES'], app.config['PDFS_FOLDER'], app.config['PDF_PERSIST'])
+
+def pdf_task(supplier_name, items, business_data):
+    """
+    Tarea del pool de procesos: arma el PDF de un proveedor. Un error queda en el resultado y no corta
+    los PDFs de los demás. Devuelve (bytes del PDF o None, error o None, segundos)
+    """
+    start = time.perf_counter()
+    try:
+        pdf_bytes = render_order_pdf(supplier_name, items, business_data)
+        return pdf_bytes, None, time.perf_counter() - start
+    except Exception as e:
+        print(f"❌ Error generando el PDF de {supplier_name}: {str(e)}")
+        return None, str(e), time.perf_counter() - start
 
 def create_whatsapp_message(supplier_name, items, business_data, total):
     """Crea el mensaje de WhatsApp para enviar al proveedor"""
@@ -477,6 +2680,49 @@ def create_whatsapp_message(supplier_name, items, business_data, total):
 def index():
     return render_template('index.html')
 
+def run_ingest_job(job, filepath):
+    """Procesa en segundo plano un archivo encolado por /upload y publica el resultado en el catálogo"""
+    job.update(state='running')
+    try:
+        products, debug_info, cached = parse_uploaded_file(filepath, job.filename, job.supplier, job)
+        
+        if products:
+            changes = store_price_list(job.supplier, job.filename, products, debug_info)
+            total = changes['added'] + changes['price_changed'] + changes['unchanged']
+            job.update(state='done', cached=cached, products_accepted=total, debug_info=debug_info, changes=changes,
+                       message=f'Archivo procesado exitosamente. {total} productos cargados.')
+        else:
+            job.update(state='error', debug_info=debug_info, message='No se pudieron extraer productos del archivo')
+    except Exception as e:
+        print(f"💥 Error en la carga {job.id}: {str(e)}")
+        job.update(state='error', message=f'Error procesando archivo: {str(e)}', debug_info=[f'Error general: {str(e)}'])
+    finally:
+        job.update(finished_at=datetime.now().isoformat())
+        try:
+            if os.path.exists(filepath):
+                os.remove(filepath)
+        except:
+            pass
+
+def queue_ingest_job(file, filename, supplier_name):
+    """Guarda el archivo, encola su procesamiento y devuelve el trabajo creado"""
+    job = IngestJob(supplier_name, filename, ingest_job_statuses)
+    # Prefijo con el id: varias cargas del mismo archivo pueden estar en cola a la vez
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{job.id}_{filename}")
+    file.save(filepath)
+    
+    with ingest_jobs_lock:
+        ingest_jobs[job.id] = job
+        # Olvidar las cargas terminadas más viejas
+        finished = [old_job for old_job in ingest_jobs.values() if old_job.state in ('done', 'error')]
+        for old_job in finished[:max(0, len(finished) - app.config['INGEST_JOBS_KEPT'])]:
+            del ingest_jobs[old_job.id]
+            if ingest_job_statuses is not None:
+                ingest_job_statuses.pop(old_job.id, None)
+    
+    ingest_executor.submit(run_ingest_job, job, filepath)
+    return job
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
@@ -490,29 +2736,41 @@ def upload_file():
     
     if file and file.filename.lower().endswith(('.xlsx', '.xls')):
         filename = secure_filename(file.filename)
+        
+        # Carga en segundo plano: responder enseguida con el id del trabajo
+        if request.form.get('background', '').lower() in ('1', 'true', 'on'):
+            try:
+                job = queue_ingest_job(file, filename, supplier_name)
+            except Exception as e:
+                return jsonify({'error': f'Error guardando archivo: {str(e)}'})
+            return jsonify({
+                'success': True,
+                'queued': True,
+                'job_id': job.id,
+                'status_url': url_for('upload_status', job_id=job.id),
+                'supplier': supplier_name
+            }), 202
+        
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         
         try:
             file.save(filepath)
             
             # Procesar el archivo
-            products, debug_info = processor.process_excel_file(filepath, supplier_name)
+            products, debug_info, cached = parse_uploaded_file(filepath, filename, supplier_name)
             
             if products:
                 # Guardar en memoria
-                price_lists[supplier_name] = {
-                    'filename': filename,
-                    'upload_date': datetime.now().isoformat(),
-                    'products': products,
-                    'total_products': len(products),
-                    'debug_info': debug_info
-                }
+                changes = store_price_list(supplier_name, filename, products, debug_info)
+                total = changes['added'] + changes['price_changed'] + changes['unchanged']
                 
                 return jsonify({
                     'success': True,
-                    'message': f'Archivo procesado exitosamente. {len(products)} productos cargados.',
+                    'message': f'Archivo procesado exitosamente. {total} productos cargados.',
                     'supplier': supplier_name,
-                    'total_products': len(products),
+                    'total_products': total,
+                    'cached': cached,
+                    'changes': changes,
                     'debug_info': debug_info[:5]  # Solo mostrar los primeros 5 items de debug
                 })
             else:
@@ -536,9 +2794,175 @@ def upload_file():
     else:
         return jsonify({'error': 'Tipo de archivo no soportado. Use .xlsx o .xls'})
 
+@app.route('/upload/status/<job_id>')
+def upload_status(job_id):
+    """Avance de una carga en segundo plano: hojas, filas, productos aceptados y rechazados"""
+    job = ingest_jobs.get(job_id)
+    if job is not None:
+        return jsonify(job.to_dict())
+    # Modo compartido: la carga pudo haberla recibido otro worker
+    status = ingest_job_statuses.get(job_id) if ingest_job_statuses is not None else None
+    if status is None:
+        return jsonify({'error': 'Carga no encontrada'}), 404
+    return jsonify(status)
+
+@app.route('/upload/bulk', methods=['POST'])
+def bulk_upload():
+    """
+    Carga varias listas a la vez. Recibe pares (supplier_names[i], files[i]) y reparte
+    el parseo de todas las hojas de todos los archivos en el pool de procesos
+    """
+    files = request.files.getlist('files')
+    supplier_names = request.form.getlist('supplier_names')
+    
+    if not files:
+        return jsonify({'error': 'No se seleccionaron archivos'})
+    if len(files) != len(supplier_names):
+        return jsonify({'error': 'Cada archivo debe tener su nombre de proveedor'})
+    
+    start = time.perf_counter()
+    uploads = []
+    results = []
+    seen_suppliers = set()
+    
+    try:
+        # Guardar los archivos y encolar una tarea por hoja
+        for file, supplier_name in zip(files, supplier_names):
+            supplier_name = supplier_name.strip() or 'Proveedor Sin Nombre'
+            upload = {'supplier': supplier_name, 'filename': file.filename}
+            uploads.append(upload)
+            
+            if not file.filename.lower().endswith(('.xlsx', '.xls')):
+                upload['error'] = 'Tipo de archivo no soportado. Use .xlsx o .xls'
+                continue
+            if supplier_name in seen_suppliers:
+                upload['error'] = 'Proveedor repetido en la misma carga'
+                continue
+            seen_suppliers.add(supplier_name)
+            
+            upload['filename'] = secure_filename(file.filename)
+            # Prefijo único: dos proveedores (o dos cargas a la vez) pueden mandar archivos con el mismo nombre
+            filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"bulk_{uuid.uuid4().hex}_{upload['filename']}")
+            upload['filepath'] = filepath
+            
+            try:
+                file.save(filepath)
+                upload['cache_key'] = parsed_cache.make_key(filepath, supplier_name)
+                upload['cached'] = parsed_cache.get(upload['cache_key'])
+                if upload['cached'] is not None:
+                    continue  # Mismo archivo ya parseado: no hace falta encolar nada
+                with pd.ExcelFile(filepath) as excel_file:
+                    upload['sheet_names'] = excel_file.sheet_names
+            except Exception as e:
+                upload['error'] = f'Error procesando archivo: {str(e)}'
+                continue
+            
+            upload['submitted_at'] = time.perf_counter()
+            upload['finished_at'] = upload['submitted_at']
+            # Con tantos archivos como procesos alcanza una tarea por archivo (el libro se abre una sola vez)
+            upload['tasks'] = submit_sheet_tasks(
+                filepath, supplier_name, upload['sheet_names'],
+                on_task_done=lambda _, upload=upload: upload.update(finished_at=time.perf_counter()),
+                max_tasks=max(1, app.config['PROCESS_POOL_WORKERS'] // len(files))
+            )
+        
+        # Juntar resultados por archivo, respetando el orden de las hojas
+        for upload in uploads:
+            if 'error' in upload:
+                results.append({'supplier': upload['supplier'], 'filename': upload['filename'], 'error': upload['error']})
+                continue
+            
+            if upload['cached'] is not None:
+                products, debug_info = upload['cached']
+                result = {'seconds': 0.0, 'sheets': [], 'cached': True}
+            else:
+                products, debug_info, sheets = collect_sheet_results(upload['sheet_names'], upload['tasks'])
+                result = {
+                    'seconds': round(upload['finished_at'] - upload['submitted_at'], 3),
+                    'sheets': sheets,
+                    'cached': False
+                }
+                if products:
+                    parsed_cache.put(upload['cache_key'], products, debug_info)
+            
+            result.update(supplier=upload['supplier'], filename=upload['filename'], debug_info=debug_info)
+            if products:
+                # Todas las hojas del proveedor se publican juntas
+                changes = store_price_list(upload['supplier'], upload['filename'], products, debug_info)
+                result.update(success=True, total_products=len(products), changes=changes)
+            else:
+                result['error'] = 'No se pudieron extraer productos del archivo'
+            results.append(result)
+    finally:
+        # Limpiar archivos temporales
+        for upload in uploads:
+            try:
+                if 'filepath' in upload and os.path.exists(upload['filepath']):
+                    os.remove(upload['filepath'])
+            except:
+                pass
+    
+    loaded = [result for result in results if result.get('success')]
+    return jsonify({
+        'success': bool(loaded),
+        'message': f'{len(loaded)} de {len(results)} listas cargadas',
+        'results': results,
+        'total_products': sum(result['total_products'] for result in loaded),
+        'seconds': round(time.perf_counter() - start, 3)
+    })
+
+def cheapest_matches(matches, count):
+    """
+    Las `count` coincidencias más baratas de todas las listas como (precio, lista, fila, tabla), sin ordenar
+    todo: en cada tabla np.partition separa las que pueden entrar y después se mezclan con un heap.
+    Los empates se resuelven por orden de lista y de fila, así las páginas no se pisan entre sí
+    """
+    if count <= 0:
+        return []
+    candidates = []
+    for position, (table, rows) in enumerate(matches):
+        prices = table.prices[rows]
+        if len(rows) > count:
+            threshold = np.partition(prices, count - 1)[count - 1]
+            keep = prices <= threshold
+            rows, prices = rows[keep], prices[keep]
+        order = np.lexsort((rows, prices))[:count]
+        candidates.append(zip(prices[order].tolist(), repeat(position), rows[order].tolist(), repeat(table)))
+    return list(islice(heapq.merge(*candidates), count))
+
+def json_with_list(payload, key, fragments):
+    """
+    Codifica payload en JSON agregándole la lista `key` armada con fragmentos ya codificados
+    (ProductTable.row_json), sin volver a codificar cada producto
+    """
+    body = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return f"{body[:-1]}{',' if payload else ''}\"{key}\":[{','.join(fragments)}]}}"
+
+def search_table(table, fragments, tokens, typos):
+    """
+    Filas vigentes de una tabla que coinciden con una consulta: fragmentos de 3 o más letras por trigramas,
+    si no por prefijo de palabra
+    """
+    if table.trigram_index is None or table.token_index is None:
+        return np.empty(0, dtype=np.int64)
+    indexes = [(table.token_index, table.trigram_index)]
+    if table.delta_indexes is not None:
+        indexes.append(table.delta_indexes[1:])
+    found = []
+    for token_index, trigram_index in indexes:
+        rows = trigram_index.lookup(fragments, typos)
+        if rows is None:
+            if not tokens:
+                return np.empty(0, dtype=np.int64)
+            rows = token_index.lookup(tokens)
+        found.append(rows)
+    # Las filas de delta_indexes son todas posteriores a las del índice principal: la unión queda ordenada
+    rows = np.concatenate(found) if len(found) > 1 else found[0]
+    return rows[table.alive[rows]]
+
 @app.route('/search')
 def search_products():
-    query = request.args.get('q', '').lower().strip()
+    query = normalize_search_text(request.args.get('q', ''))
     
     if not query:
         return jsonify({'results': [], 'total': 0})
@@ -546,28 +2970,537 @@ def search_products():
     if not price_lists:
         return jsonify({'results': [], 'total': 0, 'message': 'No hay listas de precios cargadas'})
     
-    # Buscar en todas las listas
-    all_results = []
+    # Errores de tipeo tolerados por fragmento (0 a 2)
+    typos = min(max(request.args.get('typos', 0, type=int), 0), 2)
+    
+    # Paginado: solo se arman los resultados de la página pedida
+    limit = min(max(request.args.get('limit', app.config['SEARCH_PAGE_SIZE'], type=int), 1), app.config['SEARCH_MAX_LIMIT'])
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    
+    # Las consultas repetidas salen de la caché mientras el catálogo no cambie
+    cache_key = (query, typos, limit, offset)
+    generation = catalog_generation
+    body = search_cache.get(cache_key, generation)
+    if body is not None:
+        return app.response_class(body, mimetype='application/json')
     
-    for supplier, data in price_lists.items():
-        for product in data['products']:
-            if query in product['product'].lower():
-                all_results.append(product)
+    # Buscar en todas las listas
+    matches = []
+    total = 0
+    fragments = query.split()
+    tokens = tokenize_product_name(query)
+    lists = published_lists()
+    
+    for supplier, data in lists.items():
+        table = data['products']
+        rows = search_table(table, fragments, tokens, typos)
+        if len(rows):
+            matches.append((table, rows))
+            total += len(rows)
+    
+    # Los más baratos primero (menor a mayor); cada producto sale de su JSON ya armado
+    page = cheapest_matches(matches, offset + limit)[offset:]
+    results = [table.row_json(row) for _, _, row, table in page]
+    
+    body = json_with_list({
+        'total': total,
+        'offset': offset,
+        'limit': limit,
+        'has_more': offset + len(results) < total,
+        'query': query,
+        'typos': typos,
+        'suppliers_count': len(lists)
+    }, 'results', results).encode()
+    search_cache.put(cache_key, generation, body)
+    return app.response_class(body, mimetype='application/json')
+
+@app.route('/search/batch', methods=['POST'])
+def search_batch():
+    """
+    Lista de compras: muchas consultas en un solo pedido, con las `limit` ofertas más baratas de cada una.
+    Cada lista se recorre una sola vez y sobre ella se resuelven todas las consultas (las repetidas una vez)
+    """
+    data = request.get_json(silent=True) or {}
+    queries = data.get('queries')
+    if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+        return jsonify({'error': 'queries debe ser una lista de textos'}), 400
+    if len(queries) > app.config['SEARCH_BATCH_MAX_QUERIES']:
+        return jsonify({'error': f"Máximo {app.config['SEARCH_BATCH_MAX_QUERIES']} consultas por pedido"}), 400
     
-    # Ordenar por precio (menor a mayor)
-    all_results.sort(key=lambda x: x['price'])
+    try:
+        typos = min(max(int(data.get('typos', 0)), 0), 2)
+        limit = min(max(int(data.get('limit', app.config['SEARCH_BATCH_PAGE_SIZE'])), 1), app.config['SEARCH_MAX_LIMIT'])
+    except (TypeError, ValueError):
+        return jsonify({'error': 'typos y limit deben ser números'}), 400
+    
+    normalized = [normalize_search_text(query) for query in queries]
+    unique = [query for query in dict.fromkeys(normalized) if query]
+    terms = {query: (query.split(), tokenize_product_name(query)) for query in unique}
+    matches = {query: [] for query in unique}
+    totals = dict.fromkeys(unique, 0)
+    
+    # Una sola pasada por el catálogo: cada tabla resuelve todas las consultas mientras está en caché
+    lists = published_lists()
+    for supplier, entry in lists.items():
+        table = entry['products']
+        for query, (fragments, tokens) in terms.items():
+            rows = search_table(table, fragments, tokens, typos)
+            if len(rows):
+                matches[query].append((table, rows))
+                totals[query] += len(rows)
+    
+    best = {query: [table.row_json(row) for _, _, row, table in cheapest_matches(matches[query], limit)] for query in unique}
+    
+    results = [json_with_list({
+        'query': original,
+        'normalized': query,
+        'total': totals.get(query, 0)
+    }, 'results', best.get(query, [])) for original, query in zip(queries, normalized)]
+    
+    body = json_with_list({
+        'limit': limit,
+        'typos': typos,
+        'found': sum(1 for query in normalized if totals.get(query)),
+        'suppliers_count': len(lists)
+    }, 'results', results)
+    return app.response_class(body, mimetype='application/json')
+
+@app.route('/search/cache/stats')
+def search_cache_stats():
+    """Estadísticas de la caché de búsquedas"""
+    return jsonify(search_cache.stats())
+
+# /compare sin filtrar, ya agrupado y ordenado: (generación del catálogo, [(claves de búsqueda del grupo, producto)])
+compare_cache = (None, [])
+
+def compared_products():
+    """
+    Productos equivalentes entre al menos dos proveedores, con sus ofertas de menor a mayor precio y
+    primero donde más se ahorra. Se arma una vez por generación del catálogo; las consultas con q filtran esta lista
+    """
+    global compare_cache
+    generation = catalog_generation
+    cached_generation, products = compare_cache
+    if cached_generation == generation:
+        return products
+    
+    products = []
+    lists = published_lists()
+    for group in product_matcher.clusters():
+        tables = [(lists[supplier]['products'], row) for supplier, row in group if supplier in lists]
+        offers = sorted((table.row(row) for table, row in tables), key=lambda offer: offer['price'])
+        if len({offer['supplier'] for offer in offers}) < 2:
+            continue
+        for offer in offers:
+            offer['price_formatted'] = f"${offer['price']:,.2f}"
+        
+        cheapest, most_expensive = offers[0], offers[-1]
+        spread = most_expensive['price'] - cheapest['price']
+        products.append(([table.search_keys[row] for table, row in tables], {
+            'product': cheapest['product'],
+            'cheapest_supplier': cheapest['supplier'],
+            'min_price': cheapest['price'],
+            'max_price': most_expensive['price'],
+            'spread': round(spread, 2),
+            'spread_percent': round(100 * spread / most_expensive['price'], 1),
+            'suppliers': len({offer['supplier'] for offer in offers}),
+            'offers': offers
+        }))
+    
+    # Primero donde más se ahorra eligiendo bien el proveedor
+    products.sort(key=lambda item: item[1]['spread'], reverse=True)
+    # Guardada con la generación leída al empezar: si el catálogo cambió mientras tanto, el próximo pedido la rearma
+    compare_cache = (generation, products)
+    return products
+
+@app.route('/compare')
+def compare_prices():
+    """
+    Productos equivalentes entre proveedores: cada uno con sus ofertas de menor a mayor precio, el proveedor
+    más barato y la diferencia de precios. Con q se filtran los que coinciden con la búsqueda
+    """
+    fragments = normalize_search_text(request.args.get('q', '')).split()
+    limit = min(max(request.args.get('limit', app.config['SEARCH_PAGE_SIZE'], type=int), 1), app.config['SEARCH_MAX_LIMIT'])
+    offset = max(request.args.get('offset', 0, type=int), 0)
     
-    # Agregar información adicional
-    for result in all_results:
-        result['price_formatted'] = f"${result['price']:,.2f}"
+    products = [
+        product for search_keys, product in compared_products()
+        if not fragments or any(all(fragment in key for fragment in fragments) for key in search_keys)
+    ]
     
     return jsonify({
-        'results': all_results,
-        'total': len(all_results),
-        'query': query,
-        'suppliers_count': len(price_lists)
+        'products': products[offset:offset + limit],
+        'total': len(products),
+        'offset': offset,
+        'limit': limit,
+        'has_more': offset + limit < len(products)
     })
 
+class Cart:
+    """
+    Carrito de un usuario indexado por id de producto, con los renglones agrupados por proveedor y los
+    subtotales al día: agregar, cambiar cantidades o quitar es O(1) y leerlo no reagrupa nada
+    """
+    def __init__(self):
+        self.items = {}  # id -> renglón {'id', 'product', 'price', 'supplier', 'quantity'}
+        self.by_supplier = {}  # proveedor -> {id: renglón}
+        self.supplier_totals = {}  # proveedor -> subtotal
+        self.total = 0.0
+    
+    def _adjust(self, item, quantity_delta):
+        amount = item['price'] * quantity_delta
+        self.supplier_totals[item['supplier']] += amount
+        self.total += amount
+    
+    def add(self, product, quantity):
+        """Suma `quantity` unidades de un producto (dict de ProductTable.row). Devuelve el renglón"""
+        item = self.items.get(product['id'])
+        if item is None:
+            item = {
+                'id': product['id'],
+                'product': product['product'],
+                'price': product['price'],
+                'supplier': product['supplier'],
+                'quantity': 0
+            }
+            self.items[item['id']] = item
+            self.by_supplier.setdefault(item['supplier'], {})[item['id']] = item
+            self.supplier_totals.setdefault(item['supplier'], 0.0)
+        item['quantity'] += quantity
+        self._adjust(item, quantity)
+        return item
+    
+    def set_quantity(self, product_id, quantity):
+        """Cambia la cantidad de un renglón (0 o menos lo quita). False si el producto no está"""
+        item = self.items.get(product_id)
+        if item is None:
+            return False
+        if quantity <= 0:
+            return self.remove(product_id)
+        self._adjust(item, quantity - item['quantity'])
+        item['quantity'] = quantity
+        return True
+    
+    def remove(self, product_id):
+        """Quita un renglón. False si el producto no está"""
+        item = self.items.pop(product_id, None)
+        if item is None:
+            return False
+        supplier = item['supplier']
+        self._adjust(item, -item['quantity'])
+        del self.by_supplier[supplier][product_id]
+        if not self.by_supplier[supplier]:
+            # Sin renglones el subtotal es 0 exacto (no arrastra errores de redondeo)
+            del self.by_supplier[supplier]
+            del self.supplier_totals[supplier]
+        if not self.items:
+            self.total = 0.0
+        return True
+    
+    def clear(self):
+        self.__init__()
+    
+    def __len__(self):
+        return len(self.items)
+    
+    def __iter__(self):
+        return iter(self.items.values())
+    
+    def to_dict(self):
+        """Contenido con la forma que espera el frontend (renglones, total y agrupado por proveedor)"""
+        return {
+            'cart': list(self.items.values()),
+            'total': self.total,
+            'suppliers': {supplier: list(items.values()) for supplier, items in self.by_supplier.items()},
+            'supplier_totals': self.supplier_totals,
+            'total_formatted': f"${self.total:,.2f}"
+        }
+
+class StateStore:
+    """
+    Base SQLite local (modo WAL) para el estado por usuario que tiene que verse igual desde todos los
+    workers: carritos y datos del comercio. Una conexión por thread
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cart_items (
+            user TEXT NOT NULL, id TEXT NOT NULL, product TEXT NOT NULL, price REAL NOT NULL,
+            supplier TEXT NOT NULL, quantity INTEGER NOT NULL, PRIMARY KEY (user, id)
+        );
+        CREATE INDEX IF NOT EXISTS cart_items_supplier ON cart_items (user, supplier);
+        CREATE TABLE IF NOT EXISTS cart_suppliers (
+            user TEXT NOT NULL, supplier TEXT NOT NULL, subtotal REAL NOT NULL, PRIMARY KEY (user, supplier)
+        );
+        CREATE TABLE IF NOT EXISTS state (
+            namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (namespace, key)
+        );
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+    
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(self.SCHEMA)
+            self.local.connection = connection
+        return connection
+    
+    @contextmanager
+    def transaction(self, immediate=True):
+        """
+        Transacción explícita. Con immediate toma el lock de escritura desde el principio (BEGIN IMMEDIATE):
+        lo que se lee adentro no puede cambiarlo otro worker antes de escribir. Sin immediate es una
+        lectura: todas las consultas ven la misma foto de la base
+        """
+        connection = self.connection()
+        connection.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+        try:
+            yield connection
+        except BaseException:
+            connection.rollback()
+            raise
+        connection.commit()
+
+class SharedCart:
+    """
+    Cart guardado en StateStore, con la misma interfaz. Cada cambio toca solo el renglón y el subtotal
+    de su proveedor (por clave primaria) dentro de una transacción de escritura (lee y escribe sin que
+    otro worker se meta en el medio)
+    """
+    ITEM_COLUMNS = ('id', 'product', 'price', 'supplier', 'quantity')
+    def __init__(self, store, user):
+        self.store = store
+        self.user = user
+    
+    def _item(self, connection, product_id):
+        return connection.execute(
+            'SELECT price, supplier, quantity FROM cart_items WHERE user = ? AND id = ?', (self.user, product_id)
+        ).fetchone()
+    
+    def _adjust(self, connection, supplier, amount):
+        connection.execute(
+            'INSERT INTO cart_suppliers (user, supplier, subtotal) VALUES (?, ?, ?) '
+            'ON CONFLICT (user, supplier) DO UPDATE SET subtotal = subtotal + excluded.subtotal',
+            (self.user, supplier, amount)
+        )
+    
+    def add(self, product, quantity):
+        with self.store.transaction() as connection:
+            existing = self._item(connection, product['id'])
+            if existing is None:
+                connection.execute(
+                    'INSERT INTO cart_items (user, id, product, price, supplier, quantity) VALUES (?, ?, ?, ?, ?, ?)',
+                    (self.user, product['id'], product['product'], product['price'], product['supplier'], quantity)
+                )
+                self._adjust(connection, product['supplier'], product['price'] * quantity)
+            else:
+                price, supplier, _ = existing
+                connection.execute(
+                    'UPDATE cart_items SET quantity = quantity + ? WHERE user = ? AND id = ?', (quantity, self.user, product['id'])
+                )
+                self._adjust(connection, supplier, price * quantity)
+    
+    def set_quantity(self, product_id, quantity):
+        if quantity <= 0:
+            return self.remove(product_id)
+        with self.store.transaction() as connection:
+            existing = self._item(connection, product_id)
+            if existing is None:
+                return False
+            price, supplier, old_quantity = existing
+            connection.execute('UPDATE cart_items SET quantity = ? WHERE user = ? AND id = ?', (quantity, self.user, product_id))
+            self._adjust(connection, supplier, price * (quantity - old_quantity))
+        return True
+    
+    def remove(self, product_id):
+        with self.store.transaction() as connection:
+            existing = self._item(connection, product_id)
+            if existing is None:
+                return False
+            price, supplier, quantity = existing
+            connection.execute('DELETE FROM cart_items WHERE user = ? AND id = ?', (self.user, product_id))
+            if connection.execute('SELECT 1 FROM cart_items WHERE user = ? AND supplier = ? LIMIT 1', (self.user, supplier)).fetchone():
+                self._adjust(connection, supplier, -price * quantity)
+            else:
+                connection.execute('DELETE FROM cart_suppliers WHERE user = ? AND supplier = ?', (self.user, supplier))
+        return True
+    
+    def clear(self):
+        with self.store.transaction() as connection:
+            connection.execute('DELETE FROM cart_items WHERE user = ?', (self.user,))
+            connection.execute('DELETE FROM cart_suppliers WHERE user = ?', (self.user,))
+    
+    def __len__(self):
+        return self.store.connection().execute('SELECT COUNT(*) FROM cart_items WHERE user = ?', (self.user,)).fetchone()[0]
+    
+    def __iter__(self):
+        rows = self.store.connection().execute(
+            'SELECT id, product, price, supplier, quantity FROM cart_items WHERE user = ? ORDER BY rowid', (self.user,)
+        ).fetchall()
+        return iter([dict(zip(self.ITEM_COLUMNS, row)) for row in rows])
+    
+    def _grouped(self, connection):
+        """Renglones agrupados por proveedor, en una sola consulta ya ordenada por proveedor"""
+        rows = connection.execute(
+            'SELECT id, product, price, supplier, quantity FROM cart_items WHERE user = ? ORDER BY supplier, rowid', (self.user,)
+        ).fetchall()
+        return {
+            supplier: [dict(zip(self.ITEM_COLUMNS, row)) for row in supplier_rows]
+            for supplier, supplier_rows in groupby(rows, key=itemgetter(3))
+        }
+    
+    def _supplier_totals(self, connection):
+        return dict(connection.execute(
+            'SELECT supplier, subtotal FROM cart_suppliers WHERE user = ? ORDER BY supplier', (self.user,)
+        ).fetchall())
+    
+    @property
+    def by_supplier(self):
+        grouped = self._grouped(self.store.connection())
+        return {supplier: {item['id']: item for item in items} for supplier, items in grouped.items()}
+    
+    @property
+    def supplier_totals(self):
+        return self._supplier_totals(self.store.connection())
+    
+    @property
+    def total(self):
+        return sum(self.supplier_totals.values())
+    
+    def to_dict(self):
+        """Igual que Cart.to_dict; los renglones salen ordenados por proveedor y los subtotales de cart_suppliers"""
+        with self.store.transaction(immediate=False) as connection:
+            suppliers = self._grouped(connection)
+            supplier_totals = self._supplier_totals(connection)
+        total = sum(supplier_totals.values())
+        return {
+            'cart': list(chain.from_iterable(suppliers.values())),
+            'total': total,
+            'suppliers': suppliers,
+            'supplier_totals': supplier_totals,
+            'total_formatted': f"${total:,.2f}"
+        }
+
+class StateDict(MutableMapping):
+    """Diccionario usuario -> valor JSON guardado en StateStore (p. ej. los datos del comercio)"""
+    def __init__(self, store, namespace):
+        self.store = store
+        self.namespace = namespace
+    
+    def __getitem__(self, key):
+        row = self.store.connection().execute(
+            'SELECT value FROM state WHERE namespace = ? AND key = ?', (self.namespace, key)
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+    
+    def __setitem__(self, key, value):
+        connection = self.store.connection()
+        with connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO state (namespace, key, value) VALUES (?, ?, ?)',
+                (self.namespace, key, json.dumps(value, ensure_ascii=False))
+            )
+    
+    def __delitem__(self, key):
+        connection = self.store.connection()
+        with connection:
+            if not connection.execute('DELETE FROM state WHERE namespace = ? AND key = ?', (self.namespace, key)).rowcount:
+                raise KeyError(key)
+    
+    def __iter__(self):
+        rows = self.store.connection().execute('SELECT key FROM state WHERE namespace = ?', (self.namespace,)).fetchall()
+        return iter([row[0] for row in rows])
+    
+    def __len__(self):
+        return self.store.connection().execute('SELECT COUNT(*) FROM state WHERE namespace = ?', (self.namespace,)).fetchone()[0]
+
+state_store = StateStore(app.config['STATE_DB']) if app.config['SHARED_STATE'] else None
+# Estado de las cargas en segundo plano para consultarlo desde cualquier worker (ver IngestJob)
+ingest_job_statuses = StateDict(state_store, 'ingest_jobs') if state_store is not None else None
+
+def user_cart(user):
+    """Carrito del usuario (se crea vacío la primera vez). En modo compartido vive en SQLite"""
+    if state_store is not None:
+        return SharedCart(state_store, user)
+    cart = user_carts.get(user)
+    if cart is None:
+        cart = user_carts[user] = Cart()
+    return cart
+
+def locate_product(product_id):
+    """Tabla y fila de un producto por su id ("{proveedor}_{hash}"), o (None, None)"""
+    supplier_data = price_lists.get(str(product_id).rpartition('_')[0])
+    if supplier_data is None:
+        return None, None
+    table = supplier_data['products']
+    row = table.find_id(str(product_id))
+    return (table, row) if row is not None else (None, None)
+
+def optimize_basket(lines, terms, time_limit):
+    """
+    Elige una oferta por renglón minimizando el total del pedido con los costos de envío de cada proveedor,
+    respetando su compra mínima. lines: [(cantidad, [(proveedor, precio), ...]), ...];
+    terms: {proveedor: {'min_order': monto, 'delivery_fee': monto}}.
+    Devuelve (posición de la oferta elegida en cada renglón, estado del solver). Las posiciones son None si
+    no se encontró ningún reparto; el estado es {'optimal', 'solver_status', 'solver_message'} y optimal
+    es False si el solver cortó antes de probar que el reparto es el mejor (p. ej. por el límite de tiempo)
+    """
+    line_of = np.fromiter(chain.from_iterable(repeat(line, len(offers)) for line, (_, offers) in enumerate(lines)), dtype=np.int64)
+    names, supplier_of = np.unique([supplier for _, offers in lines for supplier, _ in offers], return_inverse=True)
+    cost = np.array([price * quantity for quantity, offers in lines for _, price in offers], dtype=np.float64)
+    first = np.concatenate(([0], np.cumsum([len(offers) for _, offers in lines])[:-1]))
+    
+    fees = np.array([float(terms.get(name, {}).get('delivery_fee', 0) or 0) for name in names])
+    minimums = np.array([float(terms.get(name, {}).get('min_order', 0) or 0) for name in names])
+    
+    if not fees.any() and not minimums.any():
+        # Sin envíos ni mínimos cada renglón es independiente: la oferta más barata de cada uno
+        order = np.lexsort((cost, line_of))
+        best = order[np.unique(line_of[order], return_index=True)[1]]
+        return (best - first).tolist(), {'optimal': True, 'solver_status': 0, 'solver_message': 'Sin envíos ni mínimos: la oferta más barata de cada renglón'}
+    
+    # Programa entero: x[k] = se compra la oferta k, y[s] = se le pide al proveedor s
+    offers_count, suppliers_count = len(cost), len(names)
+    offer_columns = np.arange(offers_count)
+    choose_one = sparse.csr_matrix(
+        (np.ones(offers_count), (line_of, offer_columns)), shape=(len(lines), offers_count + suppliers_count)
+    )
+    # x[k] <= y[proveedor de k]
+    needs_supplier = sparse.csr_matrix(
+        (np.concatenate((np.ones(offers_count), -np.ones(offers_count))),
+         (np.concatenate((offer_columns, offer_columns)), np.concatenate((offer_columns, offers_count + supplier_of)))),
+        shape=(offers_count, offers_count + suppliers_count)
+    )
+    # sum(costo de lo que se le compra a s) >= mínimo[s] * y[s]
+    minimum_order = sparse.csr_matrix(
+        (np.concatenate((cost, -minimums)),
+         (np.concatenate((supplier_of, np.arange(suppliers_count))), np.concatenate((offer_columns, offers_count + np.arange(suppliers_count))))),
+        shape=(suppliers_count, offers_count + suppliers_count)
+    )
+    result = milp(
+        np.concatenate((cost, fees)),
+        constraints=[
+            LinearConstraint(choose_one, 1, 1),
+            LinearConstraint(needs_supplier, -np.inf, 0),
+            LinearConstraint(minimum_order, 0, np.inf)
+        ],
+        integrality=np.ones(offers_count + suppliers_count),
+        bounds=Bounds(0, 1),
+        options={'time_limit': time_limit}
+    )
+    # status 0: óptimo probado; 1: límite de tiempo o iteraciones (puede haber un reparto factible); 2: no factible
+    state = {'optimal': result.status == 0, 'solver_status': int(result.status), 'solver_message': result.message}
+    if result.x is None:
+        return None, state
+    chosen = np.flatnonzero(result.x[:offers_count] > 0.5)
+    return (chosen - first[line_of[chosen]]).tolist(), state
+
 # NUEVAS RUTAS PARA EL CARRITO
 
 @app.route('/cart/add', methods=['POST'])
@@ -583,45 +3516,20 @@ def add_to_cart():
     quantity = int(data.get('quantity', 1))
     
     # Buscar el producto en las listas
-    product_found = None
-    for supplier_data in price_lists.values():
-        for product in supplier_data['products']:
-            if product['id'] == product_id:
-                product_found = product
-                break
-        if product_found:
-            break
+    table, row = locate_product(product_id)
+    product_found = table.row(row) if table is not None else None
     
     if not product_found:
         return jsonify({'error': 'Producto no encontrado'})
     
-    # Inicializar carrito del usuario si no existe
-    if user not in user_carts:
-        user_carts[user] = []
-    
-    # Verificar si el producto ya está en el carrito
-    existing_item = None
-    for item in user_carts[user]:
-        if item['id'] == product_id:
-            existing_item = item
-            break
-    
-    if existing_item:
-        existing_item['quantity'] += quantity
-    else:
-        cart_item = {
-            'id': product_id,
-            'product': product_found['product'],
-            'price': product_found['price'],
-            'supplier': product_found['supplier'],
-            'quantity': quantity
-        }
-        user_carts[user].append(cart_item)
+    # Si el producto ya está en el carrito se suma la cantidad
+    cart = user_cart(user)
+    cart.add(product_found, quantity)
     
     return jsonify({
         'success': True,
         'message': f'Producto agregado al carrito',
-        'cart_count': len(user_carts[user])
+        'cart_count': len(cart)
     })
 
 @app.route('/cart/get')
@@ -631,24 +3539,116 @@ def get_cart():
         return jsonify({'error': 'No hay sesión activa'})
     
     user = session['user']
-    cart = user_carts.get(user, [])
+    cart = user_cart(user)
     
-    # Calcular totales
-    total = sum(item['price'] * item['quantity'] for item in cart)
+    # Totales y agrupado por proveedor ya están al día en el carrito
+    return jsonify(cart.to_dict())
+
+@app.route('/cart/optimize', methods=['POST'])
+def optimize_cart():
+    """
+    Reparto más barato del carrito entre todos los proveedores: cada renglón puede cambiarse por un producto
+    equivalente de otro proveedor. Opcionalmente recibe los renglones ('items': [{'id', 'quantity'}]) y por
+    proveedor la compra mínima y el costo de envío ('suppliers': {nombre: {'min_order', 'delivery_fee'}})
+    """
+    if 'user' not in session:
+        return jsonify({'error': 'No hay sesión activa'})
     
-    # Agrupar por proveedor
-    suppliers = {}
-    for item in cart:
-        supplier = item['supplier']
-        if supplier not in suppliers:
-            suppliers[supplier] = []
-        suppliers[supplier].append(item)
+    data = request.get_json(silent=True) or {}
+    items = data.get('items') or list(user_cart(session['user']))
+    terms = data.get('suppliers') or {}
+    if not isinstance(items, list) or not isinstance(terms, dict) or not all(isinstance(value, dict) for value in terms.values()):
+        return jsonify({'error': 'Formato inválido: items debe ser una lista y suppliers un objeto por proveedor'}), 400
+    if not items:
+        return jsonify({'error': 'El carrito está vacío'})
+    
+    start = time.perf_counter()
+    lines = []
+    missing = []
+    for item in items:
+        try:
+            product_id, quantity = item['id'], int(item.get('quantity', 1))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return jsonify({'error': 'Cada renglón necesita id y una cantidad numérica'}), 400
+        if quantity <= 0:
+            return jsonify({'error': 'La cantidad de cada renglón debe ser mayor a 0'}), 400
+        table, row = locate_product(product_id)
+        if table is None or not table.alive[row]:
+            missing.append(product_id)
+            continue
+        offers = []
+        for supplier, equivalent_row in product_matcher.equivalents(table.supplier, row):
+            entry = price_lists.get(supplier)
+            if entry is not None and entry['products'].alive[equivalent_row]:
+                offers.append((entry['products'], equivalent_row))
+        lines.append((quantity, table, row, offers))
+    
+    if not lines:
+        return jsonify({'error': 'Ningún producto del carrito está en las listas cargadas', 'missing': missing})
+    
+    try:
+        choices, solver = optimize_basket(
+            [(quantity, [(offer_table.supplier, float(offer_table.prices[offer_row])) for offer_table, offer_row in offers])
+             for quantity, _, _, offers in lines],
+            terms, app.config['BASKET_TIME_LIMIT']
+        )
+    except (TypeError, ValueError):
+        return jsonify({'error': 'min_order y delivery_fee deben ser números'}), 400
+    if choices is None:
+        if solver['solver_status'] == 2:
+            return jsonify({'error': 'No hay forma de armar el pedido cumpliendo las compras mínimas', 'missing': missing, **solver})
+        return jsonify({'error': f"No se encontró un reparto a tiempo: {solver['solver_message']}", 'missing': missing, **solver})
+    
+    def supplier_totals(purchases):
+        totals = {}
+        for supplier, amount in purchases:
+            summary = totals.setdefault(supplier, {
+                'items': 0, 'subtotal': 0.0,
+                'delivery_fee': float(terms.get(supplier, {}).get('delivery_fee', 0) or 0),
+                'min_order': float(terms.get(supplier, {}).get('min_order', 0) or 0)
+            })
+            summary['items'] += 1
+            summary['subtotal'] += amount
+        for summary in totals.values():
+            summary['total'] = round(summary['subtotal'] + summary['delivery_fee'], 2)
+            summary['subtotal'] = round(summary['subtotal'], 2)
+        return totals
+    
+    result_items = []
+    current, optimized = [], []
+    for (quantity, table, row, offers), choice in zip(lines, choices):
+        best_table, best_row = offers[choice]
+        best = best_table.row(best_row)
+        best['price_formatted'] = f"${best['price']:,.2f}"
+        current_price = float(table.prices[row])
+        current.append((table.supplier, current_price * quantity))
+        optimized.append((best_table.supplier, best['price'] * quantity))
+        result_items.append({
+            'id': table.product_id(row),
+            'product': table.names[row],
+            'quantity': quantity,
+            'current_supplier': table.supplier,
+            'current_price': current_price,
+            'best': best,
+            'alternatives': len(offers) - 1,
+            'savings': round((current_price - best['price']) * quantity, 2)
+        })
+    
+    current_suppliers, optimized_suppliers = supplier_totals(current), supplier_totals(optimized)
+    current_total = sum(summary['total'] for summary in current_suppliers.values())
+    optimized_total = sum(summary['total'] for summary in optimized_suppliers.values())
     
     return jsonify({
-        'cart': cart,
-        'total': total,
-        'suppliers': suppliers,
-        'total_formatted': f"${total:,.2f}"
+        'items': result_items,
+        'suppliers': optimized_suppliers,
+        'current_suppliers': current_suppliers,
+        'current_total': round(current_total, 2),
+        'optimized_total': round(optimized_total, 2),
+        'savings': round(current_total - optimized_total, 2),
+        'savings_formatted': f"${current_total - optimized_total:,.2f}",
+        'missing': missing,
+        **solver,  # optimal en False: el mejor reparto que se encontró antes del límite de tiempo, sin garantía
+        'seconds': round(time.perf_counter() - start, 4)
     })
 
 @app.route('/cart/update', methods=['POST'])
@@ -663,17 +3663,13 @@ def update_cart():
     product_id = data.get('product_id')
     quantity = int(data.get('quantity', 1))
     
-    if user not in user_carts:
+    cart = user_cart(user)
+    if not cart:
         return jsonify({'error': 'Carrito vacío'})
     
-    # Buscar y actualizar el producto
-    for item in user_carts[user]:
-        if item['id'] == product_id:
-            if quantity <= 0:
-                user_carts[user].remove(item)
-            else:
-                item['quantity'] = quantity
-            return jsonify({'success': True})
+    # Actualizar el producto (cantidad 0 o menos lo quita)
+    if cart.set_quantity(product_id, quantity):
+        return jsonify({'success': True})
     
     return jsonify({'error': 'Producto no encontrado en el carrito'})
 
@@ -688,14 +3684,13 @@ def remove_from_cart():
     
     product_id = data.get('product_id')
     
-    if user not in user_carts:
+    cart = user_cart(user)
+    if not cart:
         return jsonify({'error': 'Carrito vacío'})
     
-    # Buscar y remover el producto
-    for item in user_carts[user]:
-        if item['id'] == product_id:
-            user_carts[user].remove(item)
-            return jsonify({'success': True})
+    # Remover el producto
+    if cart.remove(product_id):
+        return jsonify({'success': True})
     
     return jsonify({'error': 'Producto no encontrado en el carrito'})
 
@@ -706,12 +3701,12 @@ def clear_cart():
         return jsonify({'error': 'No hay sesión activa'})
     
     user = session['user']
-    user_carts[user] = []
+    user_cart(user).clear()
     
     return jsonify({'success': True, 'message': 'Carrito limpiado'})
 
-# Variable global para la información del negocio
-business_data = {}
+# Variable global para la información del negocio (en SQLite si hay varios workers)
+business_data = StateDict(state_store, 'business') if state_store is not None else {}
 
 @app.route('/business/info', methods=['GET', 'POST'])
 def business_info():
@@ -752,33 +3747,52 @@ def generate_pdfs():
         return jsonify({'error': 'Primero complete la información del comercio'}), 400
 
     # Validar carrito
-    if user not in user_carts or not user_carts[user]:
+    cart = user_cart(user)
+    if not cart:
         return jsonify({'error': 'Carrito vacío'}), 400
 
-    cart = user_carts[user]
     business_info = business_data[user]
 
-    # Agrupar productos por proveedor
-    suppliers = {}
-    for item in cart:
-        supplier = item.get('supplier', 'Desconocido')
-        if supplier not in suppliers:
-            suppliers[supplier] = []
-        suppliers[supplier].append(item)
+    # Productos ya agrupados por proveedor en el carrito
+    suppliers = {supplier: list(items.values()) for supplier, items in cart.by_supplier.items()}
+    supplier_totals = cart.supplier_totals
 
     # Generar PDFs y enlaces de WhatsApp
     pdfs_generated = []
     whatsapp_links = []
 
+    failed = []
+
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    start = time.perf_counter()
+
+    # Un PDF por proveedor, en paralelo en el pool de PDFs (con uno solo no vale la pena el pool)
+    pdf_filenames = {
+        supplier_name: f"pedido_{supplier_name.replace(' ', '_')}_{user}_{timestamp}.pdf" for supplier_name in suppliers
+    }
+    futures = {}
+    if len(suppliers) > 1:
+        try:
+            for supplier_name, items in suppliers.items():
+                futures[supplier_name] = submit_to_pool('pdf', pdf_task, supplier_name, items, business_info)
+        except BrokenProcessPool:
+            pass  # Tampoco anda el pool nuevo: los que faltan se arman acá
 
     for supplier_name, items in suppliers.items():
-        # Generar nombre y ruta del PDF
-        pdf_filename = f"pedido_{supplier_name.replace(' ', '_')}_{user}_{timestamp}.pdf"
-        pdf_path = generate_pdf_for_supplier(supplier_name, items, business_info, pdf_filename)
+        pdf_filename = pdf_filenames[supplier_name]
+        result = None
+        if supplier_name in futures:
+            try:
+                result = futures[supplier_name].result()
+            except BrokenProcessPool:
+                pass  # Se murió un proceso del pool: el PDF se arma en este proceso
+            except Exception as e:
+                result = None, str(e), 0.0
+        pdf_bytes, error, seconds = result if result is not None else pdf_task(supplier_name, items, business_info)
+        pdf_path = pdf_store.put(pdf_filename, user, pdf_bytes) if error is None else None
 
-        # Calcular total para este proveedor
-        supplier_total = sum(item['quantity'] * item['price'] for item in items)
+        # Total para este proveedor
+        supplier_total = supplier_totals[supplier_name]
 
         # Crear mensaje de WhatsApp
         whatsapp_message = create_whatsapp_message(supplier_name, items, business_info, supplier_total)
@@ -788,14 +3802,18 @@ def generate_pdfs():
         whatsapp_url = f"https://wa.me/{phone.replace('+', '')}?text={urllib.parse.quote(whatsapp_message)}"
 
         # Agregar resultados
-        pdfs_generated.append({
-            'supplier': supplier_name,
-            'filename': pdf_filename,
-            'total': supplier_total,
-            'total_formatted': f"${supplier_total:,.2f}",
-            'items_count': len(items),
-            'pdf_path': pdf_path  # Por si necesitas la ruta completa
-        })
+        if error is None:
+            pdfs_generated.append({
+                'supplier': supplier_name,
+                'filename': pdf_filename,
+                'total': supplier_total,
+                'total_formatted': f"${supplier_total:,.2f}",
+                'items_count': len(items),
+                'pdf_path': pdf_path,  # Por si necesitas la ruta completa
+                'seconds': round(seconds, 3)
+            })
+        else:
+            failed.append({'supplier': supplier_name, 'error': error, 'seconds': round(seconds, 3)})
 
         whatsapp_links.append({
             'supplier': supplier_name,
@@ -805,13 +3823,22 @@ def generate_pdfs():
             'total_formatted': f"${supplier_total:,.2f}"
         })
 
-    return jsonify({
-        'success': True,
+    message = f'Se generaron {len(pdfs_generated)} PDFs para {len(suppliers)} proveedores'
+    if failed:
+        message += f" ({len(failed)} con error: {', '.join(failure['supplier'] for failure in failed)})"
+
+    response = {
+        'success': bool(pdfs_generated),
         'pdfs': pdfs_generated,
+        'failed': failed,
         'whatsapp_links': whatsapp_links,
         'total_suppliers': len(suppliers),
-        'message': f'Se generaron {len(pdfs_generated)} PDFs para {len(suppliers)} proveedores'
-    }), 200
+        'seconds': round(time.perf_counter() - start, 3),
+        'message': message
+    }
+    if not pdfs_generated:
+        response['error'] = f"No se pudo generar ningún PDF: {failed[0]['error']}"
+    return jsonify(response), 200
 
 @app.route('/download_pdf/<filename>')
 def download_pdf(filename):
@@ -819,6 +3846,11 @@ def download_pdf(filename):
     if 'user' not in session:
         return jsonify({'error': 'No hay sesión activa'})
     
+    # Recién generado: sale directo de memoria
+    pdf_bytes = pdf_store.get(filename, session['user'])
+    if pdf_bytes is not None:
+        return send_file(io.BytesIO(pdf_bytes), mimetype='application/pdf', as_attachment=True, download_name=filename)
+    
     try:
         return send_file(
             os.path.join(app.config['PDFS_FOLDER'], filename),
@@ -833,7 +3865,7 @@ def download_pdf(filename):
 def get_loaded_lists():
     """Obtener información de las listas cargadas"""
     lists_info = []
-    for supplier, data in price_lists.items():
+    for supplier, data in published_lists().items():
         lists_info.append({
             'supplier': supplier,
             'filename': data['filename'],
@@ -849,15 +3881,25 @@ def get_loaded_lists():
 @app.route('/clear')
 def clear_lists():
     """Limpiar todas las listas cargadas"""
-    global price_lists
-    price_lists = {}
+    with catalog_lock, catalog_store.writing():
+        price_lists.clear()
+        catalog_store.clear()
+        product_matcher.rebuild({})
+        catalog_changed()
+    refresh_suggestions()
     return jsonify({'success': True, 'message': 'Todas las listas han sido eliminadas'})
 
 @app.route('/remove_list/<supplier>')
 def remove_list(supplier):
     """Remover una lista específica"""
-    if supplier in price_lists:
-        del price_lists[supplier]
+    with catalog_lock, catalog_store.writing():
+        removed = price_lists.pop(supplier, None)
+        catalog_store.delete(supplier)
+        if removed is not None:
+            product_matcher.remove_supplier(supplier)
+            catalog_changed()
+    if removed is not None:
+        refresh_suggestions()
         return jsonify({'success': True, 'message': f'Lista de {supplier} eliminada'})
     else:
         return jsonify({'success': False, 'message': 'Lista no encontrada'})
@@ -867,18 +3909,11 @@ def ai_suggest():
     """Endpoint preparado para sugerencias de IA"""
     query = request.args.get('q', '')
     
-    # Por ahora retorna sugerencias básicas
+    # Por ahora retorna completaciones del nombre (las más frecuentes y baratas primero)
     suggestions = []
     
     if price_lists and query:
-        # Buscar productos similares para sugerir
-        all_products = []
-        for data in price_lists.values():
-            for product in data['products']:
-                all_products.append(product['product'].lower())
-        
-        # Sugerencias simples por ahora
-        suggestions = [p for p in set(all_products) if query.lower() in p][:5]
+        suggestions = suggest_index.lookup(query, request.args.get('limit', 5, type=int))
     
     return jsonify({
         'suggestions': suggestions,
@@ -889,11 +3924,12 @@ def ai_suggest():
 @app.route('/debug_file/<supplier>')
 def debug_file_info(supplier):
     """Obtener información de debug detallada de un archivo específico"""
-    if supplier in price_lists:
+    data = price_lists.get(supplier)
+    if data is not None:
         return jsonify({
             'supplier': supplier,
-            'data': price_lists[supplier],
-            'sample_products': price_lists[supplier]['products'][:5]  # Primeros 5 productos como muestra
+            'data': {**data, 'products': list(data['products'])},
+            'sample_products': data['products'].head(5)  # Primeros 5 productos como muestra
         })
     else:
         return jsonify({
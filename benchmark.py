@@ -0,0 +1,112 @@
+import sys
+import time
+import tracemalloc
+
+from app import ProductTable, TokenIndex, TrigramIndex, SuggestIndex, DEFAULT_LOCATIONS, normalize_search_text, tokenize_product_name
+
+def fake_products(supplier, total):
+    """Productos con la misma forma que devuelve process_excel_file"""
+    location = DEFAULT_LOCATIONS.get(supplier, 'Buenos Aires, Argentina')
+    products = []
+    for n in range(total):
+        sheet = f"Hoja{n % 4 + 1}"
+        name = f"PRODUCTO {n % 50000} MEDIDA {n % 37}X{n % 11}"
+        products.append({
+            'product': name,
+            'price': round(100 + (n * 7.31) % 90000, 2),
+            'supplier': supplier,
+            'sheet': sheet,
+            'location': location,
+            'id': f"{supplier}_{sheet}_{n // 4}_{n}",
+            'search_key': normalize_search_text(name)
+        })
+    return products
+
+def measure(build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    seconds = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size, seconds
+
+def benchmark_catalog(total, supplier='bremen'):
+    # Las filas se generan dentro de cada medición: con tracemalloc solo cuenta lo que queda vivo
+    as_dicts, dict_bytes, dict_seconds = measure(lambda: fake_products(supplier, total))
+
+    def build_table():
+        table = ProductTable(supplier)
+        table.append_records(fake_products(supplier, total))
+        return table
+
+    table, table_bytes, table_seconds = measure(build_table)
+
+    print(f"📦 {total:,} productos")
+    print(f"   Lista de dicts: {dict_bytes / 1024 / 1024:8.1f} MB ({dict_seconds:.2f}s)")
+    print(f"   ProductTable:   {table_bytes / 1024 / 1024:8.1f} MB ({table_seconds:.2f}s)")
+    print(f"   Ahorro: {100 * (1 - table_bytes / dict_bytes):.0f}%")
+
+    # La vista por filas tiene que coincidir con los dicts originales (la clave de búsqueda queda en su columna
+    # y el id de la tabla sale del contenido, no de la posición que le da el parser)
+    assert [{key: value for key, value in row.items() if key != 'id'} for row in table] == [
+        {key: value for key, value in product.items() if key not in ('search_key', 'id')} for product in as_dicts
+    ]
+    print("✅ Las filas de la tabla coinciden con la lista de dicts")
+
+def benchmark_search(total, supplier='bremen', repeat=200):
+    table = ProductTable(supplier)
+    table.append_records(fake_products(supplier, total))
+
+    start = time.perf_counter()
+    table.token_index = TokenIndex.build(table, table.live_rows())
+    print(f"🔎 Índice de {total:,} productos armado en {time.perf_counter() - start:.2f}s ({len(table.token_index.vocabulary):,} palabras)")
+
+    for query in ["producto 4821", "producto 4821 medida 12x", "medida 3x", "12 3x4", "inexistente"]:
+        tokens = tokenize_product_name(query)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            rows = table.token_index.lookup(tokens)
+        elapsed = (time.perf_counter() - start) / repeat
+        print(f"   {query!r:28} {len(rows):>8,} filas  {elapsed * 1000:.3f} ms")
+
+    start = time.perf_counter()
+    table.trigram_index = TrigramIndex.build(table, table.live_rows())
+    print(f"🔤 Índice de trigramas armado en {time.perf_counter() - start:.2f}s ({len(table.trigram_index.codes):,} trigramas)")
+
+    for query, typos in [("ducto 4821", 0), ("4821 edida 12x", 0), ("prodcto 48211", 1), ("medda 36x1", 1)]:
+        fragments = normalize_search_text(query).split()
+        # Con errores se verifica casi toda la tabla: menos repeticiones para que la corrida termine
+        repetitions = max(1, repeat // 200 if typos else repeat // 20)
+        start = time.perf_counter()
+        for _ in range(repetitions):
+            rows = table.trigram_index.lookup(fragments, typos)
+        elapsed = (time.perf_counter() - start) / repetitions
+        print(f"   {query!r:28} {len(rows):>8,} filas  {elapsed * 1000:.3f} ms (errores: {typos})")
+
+def benchmark_suggest(total, supplier='bremen', repeat=2000):
+    table = ProductTable(supplier)
+    table.append_records(fake_products(supplier, total))
+
+    start = time.perf_counter()
+    index = SuggestIndex.build([table])
+    print(f"💡 Autocompletado de {total:,} productos armado en {time.perf_counter() - start:.2f}s ({len(index.dense_top):,} prefijos densos)")
+
+    for prefix in ["p", "producto 1", "producto 4821 medida 1", "zz"]:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            suggestions = index.lookup(prefix)
+        elapsed = (time.perf_counter() - start) / repeat
+        print(f"   {prefix!r:28} {len(suggestions):>3} sugerencias  {elapsed * 1e6:.1f} µs")
+
+if __name__ == "__main__":
+    # python benchmark.py [memoria|busqueda|autocompletado] [cantidad]; python benchmark.py N sigue siendo memoria con N
+    args = sys.argv[1:]
+    mode = 'memoria' if not args or args[0].isdigit() else args.pop(0)
+    total = int(args[0]) if args else None
+    if mode == 'busqueda':
+        benchmark_search(total or 1000000)
+    elif mode == 'autocompletado':
+        benchmark_suggest(total or 1000000)
+    else:
+        benchmark_catalog(total or 300000)
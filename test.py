@@ -1,25 +1,936 @@
-import mysql.connector
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+from unittest import mock
 
-conexion = mysql.connector.connect(
-    host="localhost",
-    user="root",       # o tu usuario
-    password="12345678",       # tu password
-    database="login_db"
-)
+import numpy as np
+import pandas as pd
 
-cursor = conexion.cursor()
+# La app crea sus carpetas (uploads, pdfs, cache, catalog) en el directorio actual: las pruebas corren en uno temporal
+REPO = os.path.dirname(os.path.abspath(__file__))
+LISTAS = os.path.join(REPO, 'listas')
+os.chdir(tempfile.mkdtemp(prefix='precios_test_'))
+sys.path.insert(0, REPO)
 
-username = "admin"
-password = "admin"
+import app as precios
 
-print("Probando con:", username, password)
 
-cursor.execute("SELECT * FROM usuarios WHERE username=%s AND password=%s", (username, password))
-user = cursor.fetchone()
+def upload(client, path, supplier_name, **form):
+    """Sube una lista como lo hace el frontend (sin la salida de consola del parseo)"""
+    with open(path, 'rb') as f, redirect_stdout(io.StringIO()):
+        response = client.post('/upload', data={'file': (f, os.path.basename(path)), 'supplier_name': supplier_name, **form},
+                               content_type='multipart/form-data')
+    return response.get_json()
 
-print("Resultado SQL:", user)
 
-if user:
-    print("✅ Login correcto")
-else:
-    print("❌ Login incorrecto")
+def wait_for_job(job_id, timeout=60):
+    """Espera a que termine una carga en segundo plano"""
+    job = precios.ingest_jobs[job_id]
+    deadline = time.monotonic() + timeout
+    with redirect_stdout(io.StringIO()):
+        while job.finished_at is None and time.monotonic() < deadline:
+            time.sleep(0.02)
+    return job
+
+
+class CatalogTestCase(unittest.TestCase):
+    """Catálogo vacío al empezar cada prueba"""
+    def setUp(self):
+        self.client = precios.app.test_client()
+        with redirect_stdout(io.StringIO()):
+            self.client.get('/clear')
+
+
+class LoginTest(unittest.TestCase):
+    def test_login_admin(self):
+        try:
+            import mysql.connector
+            conexion = mysql.connector.connect(
+                host="localhost",
+                user="root",       # o tu usuario
+                password="12345678",       # tu password
+                database="login_db"
+            )
+        except Exception as e:
+            self.skipTest(f"MySQL no disponible: {e}")
+
+        cursor = conexion.cursor()
+        cursor.execute("SELECT * FROM usuarios WHERE username=%s AND password=%s", ("admin", "admin"))
+        user = cursor.fetchone()
+        conexion.close()
+
+        self.assertIsNotNone(user, "Login incorrecto")
+
+
+def extract_products_rowwise(processor, df, product_col, price_col, supplier_name, sheet_name, first_number=0):
+    """La extracción fila por fila con clean_price de antes de vectorizar extract_products (referencia para la paridad)"""
+    products = []
+    skipped_invalid_prices = 0
+    for idx, row in df.iterrows():
+        product = row[product_col]
+        price_raw = row[price_col]
+        if pd.notna(product) and str(product).strip():
+            price = processor.clean_price(price_raw)
+            if price is not None and price > 0:
+                name = str(product).strip()
+                products.append({
+                    'product': name,
+                    'price': price,
+                    'supplier': supplier_name,
+                    'sheet': sheet_name,
+                    'location': precios.DEFAULT_LOCATIONS.get(supplier_name, 'Buenos Aires, Argentina'),
+                    'id': f"{supplier_name}_{sheet_name}_{idx}_{first_number + len(products)}",
+                    'search_key': precios.normalize_search_text(name)
+                })
+            elif pd.notna(price_raw):
+                skipped_invalid_prices += 1
+    return products, skipped_invalid_prices
+
+
+class ParserParityTest(unittest.TestCase):
+    def test_vectorized_extraction_matches_rowwise(self):
+        processor = precios.PriceListProcessor()
+        extract = processor.extract_products
+        sheets = []
+
+        def compare(df, product_col, price_col, supplier_name, sheet_name, first_number=0, show_debug=True):
+            result = extract(df, product_col, price_col, supplier_name, sheet_name, first_number, show_debug)
+            expected = extract_products_rowwise(processor, df, product_col, price_col, supplier_name, sheet_name, first_number)
+            # Igualdad exacta, precios incluidos (float contra float, sin tolerancia)
+            self.assertEqual(result, expected, f"{supplier_name} / {sheet_name}")
+            sheets.append(sheet_name)
+            return result
+
+        for filename in sorted(os.listdir(LISTAS)):
+            with self.subTest(filename=filename), mock.patch.object(processor, 'extract_products', side_effect=compare), \
+                    redirect_stdout(io.StringIO()):
+                products, _ = processor.process_excel_file(os.path.join(LISTAS, filename), filename.split('.')[0])
+                self.assertTrue(products)
+        self.assertGreaterEqual(len(sheets), len(os.listdir(LISTAS)))
+
+    def test_streaming_engine_matches_full_parse(self):
+        processor = precios.PriceListProcessor()
+        folder = tempfile.mkdtemp(prefix='listas_')
+        # Códigos numéricos con celdas vacías: en lotes chicos alguno queda con las dos columnas numéricas.
+        # Cada precio vale por su celda (PARSER_VERSION 4): el número 12 es precio, el texto "12" no
+        codes = os.path.join(folder, 'codigos.xlsx')
+        pd.DataFrame({
+            'Producto': [1001, 1002, None, 1004, 'Alfajor x 12', 1006, 1007, 1008, 1009],
+            'Precio': [150, 230.5, 99, '$ 1.200,50', 310, None, 12, 415.25, '12'],
+            'Rubro': ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i']
+        }).to_excel(codes, index=False)
+
+        paths = [os.path.join(LISTAS, filename) for filename in sorted(os.listdir(LISTAS))] + [codes]
+        for path in paths:
+            with self.subTest(filename=os.path.basename(path)), redirect_stdout(io.StringIO()):
+                full, _ = processor.process_excel_file(path, 'proveedor')
+                batch_size = 3 if path == codes else 100
+                streamed = [product for batch in processor.iter_excel_file(path, 'proveedor', [], batch_size=batch_size)
+                            for product in batch]
+                self.assertTrue(full)
+                self.assertEqual(streamed, full)
+        self.assertEqual([product['product'] for product in full], ['1001', '1002', '1004', 'Alfajor x 12', '1007', '1008'])
+
+
+class TrigramTyposTest(unittest.TestCase):
+    def test_typo_lookup_matches_brute_force(self):
+        with redirect_stdout(io.StringIO()):
+            products, _ = precios.processor.process_excel_file(os.path.join(LISTAS, 'arcor.xlsx'), 'arcor')
+        table = precios.ProductTable('arcor')
+        table.append_records(products)
+        index = precios.TrigramIndex.build(table, table.live_rows())
+
+        def brute_force(fragments, typos):
+            return [int(row) for row in index.rows
+                    if all(fragment in index.name_of(row)
+                           or (len(fragment) >= 3 and precios.substring_edit_distance(fragment, index.name_of(row)) <= typos)
+                           for fragment in fragments)]
+
+        # Fragmentos cortos con errores (el lema no deja filtrar por trigramas) y largos, solos y combinados
+        queries = [['bom'], ['bonm'], ['alfjr'], ['chocolte'], ['galletitas'], ['bon', 'blanco'], ['al', 'mnit']]
+        for fragments in queries:
+            for typos in (1, 2):
+                with self.subTest(fragments=fragments, typos=typos):
+                    self.assertEqual(sorted(int(row) for row in index.lookup(fragments, typos)), brute_force(fragments, typos))
+        self.assertIsNone(index.lookup(['xq'], 1))
+
+    def test_vectorized_distances_match_scalar(self):
+        table = precios.ProductTable('prueba')
+        names = ['alfajor triple', 'alfajr', '', 'bon o bon blanco', 'straße 500 g', 'té 日本 x 20', 'a' * 70]
+        table.append_records([{'product': name, 'price': 1.0, 'sheet': 'Hoja1'} for name in names])
+        index = precios.TrigramIndex.build(table, table.live_rows())
+        chars = index._names_matrix(index.rows)
+        for pattern in ['alfajor', 'blnco', 'strasse', '日本', 'te', 'x', 'a' * 64]:
+            with self.subTest(pattern=pattern):
+                self.assertEqual(precios.substring_edit_distances(pattern, chars).tolist(),
+                                 [precios.substring_edit_distance(pattern, index.name_of(row)) for row in index.rows])
+
+
+class BasketOptimizerTest(CatalogTestCase):
+    LINES = [(2, [('arcor', 10.0), ('labomba', 9.0)]), (1, [('arcor', 5.0), ('labomba', 6.0)])]
+    TERMS = {'labomba': {'delivery_fee': 4.0}}
+
+    def test_solver_status_is_reported(self):
+        choices, solver = precios.optimize_basket(self.LINES, self.TERMS, 5)
+        self.assertEqual(choices, [0, 0])
+        self.assertEqual((solver['optimal'], solver['solver_status']), (True, 0))
+
+        # Límite de tiempo con un reparto factible: se devuelve, pero sin prometer que sea el mejor
+        timed_out = SimpleNamespace(status=1, message='Time limit reached.', x=np.array([0, 1, 1, 0, 1, 1], dtype=float))
+        with mock.patch.object(precios, 'milp', return_value=timed_out):
+            choices, solver = precios.optimize_basket(self.LINES, self.TERMS, 5)
+        self.assertEqual(choices, [1, 0])
+        self.assertEqual(solver, {'optimal': False, 'solver_status': 1, 'solver_message': 'Time limit reached.'})
+
+    def test_rejects_non_positive_quantities(self):
+        upload(self.client, os.path.join(LISTAS, 'arcor.xlsx'), 'arcor')
+        product_id = precios.price_lists['arcor']['products'].product_id(0)
+        with self.client.session_transaction() as session:
+            session['user'] = 'admin'
+        for quantity in (0, -3):
+            response = self.client.post('/cart/optimize', json={'items': [{'id': product_id, 'quantity': quantity}]})
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post('/cart/optimize', json={'items': [{'id': product_id, 'quantity': 2}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.get_json()['optimal'])
+
+
+class StreamingUploadTest(CatalogTestCase):
+    def test_upload_streams_batches_into_the_catalog(self):
+        path = os.path.join(LISTAS, 'labomba.xlsx')
+        with redirect_stdout(io.StringIO()):
+            expected, _ = precios.processor.process_excel_file(path, 'labomba')
+        with mock.patch.dict(precios.app.config, STREAMING_THRESHOLD=0), \
+                mock.patch.object(precios.parsed_cache, 'get', return_value=None):
+            response = upload(self.client, path, 'labomba')
+        self.assertTrue(response['success'])
+        self.assertEqual(response['total_products'], len(expected))
+        self.assertIn('Motor: streaming', response['debug_info'])
+        self.assertEqual([row['product'] for row in precios.price_lists['labomba']['products']],
+                         [product['product'] for product in expected])
+
+    def test_store_takes_products_in_batches(self):
+        with redirect_stdout(io.StringIO()):
+            expected, debug_info = precios.processor.process_excel_file(os.path.join(LISTAS, 'labomba.xlsx'), 'labomba')
+        produced = []
+
+        def products():
+            for product in expected:
+                produced.append(product)
+                yield product
+
+        # Cada lote llega a la tabla apenas se parseó: nunca hay más de STORE_BATCH_SIZE productos esperando
+        batches = []
+        append_records = precios.ProductTable.append_records
+        def record_batch(table, records, keys=None):
+            batches.append((len(records), len(produced)))
+            return append_records(table, records, keys)
+
+        with mock.patch.dict(precios.app.config, STORE_BATCH_SIZE=50), \
+                mock.patch.object(precios.ProductTable, 'append_records', record_batch), redirect_stdout(io.StringIO()):
+            changes = precios.store_price_list('labomba', 'labomba.xlsx', products(), debug_info)
+        self.assertEqual(changes['added'], len(expected))
+        self.assertEqual(len(batches), -(-len(expected) // 50))
+        self.assertEqual([produced for _, produced in batches], list(np.cumsum([size for size, _ in batches])))
+
+
+class ParsedListCacheTest(CatalogTestCase):
+    def make_cache(self, max_bytes=10 ** 9):
+        return precios.ParsedListCache(tempfile.mkdtemp(prefix='cache_'), max_bytes)
+
+    def test_repeat_upload_skips_the_parser(self):
+        cache = self.make_cache()
+        path = os.path.join(LISTAS, 'arcor.xlsx')
+        with mock.patch.object(precios, 'parsed_cache', cache):
+            first = upload(self.client, path, 'arcor')
+            self.assertEqual((cache.hits, cache.misses), (0, 1))
+            products = [row['product'] for row in precios.price_lists['arcor']['products']]
+
+            # Mismo archivo después de /clear: sale de la caché sin volver a leer el Excel
+            self.client.get('/clear')
+            with mock.patch.object(precios.processor, 'process_excel_file', side_effect=AssertionError), \
+                    mock.patch.object(precios.processor, 'iter_excel_file', side_effect=AssertionError):
+                second = upload(self.client, path, 'arcor')
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            self.assertEqual(second['total_products'], first['total_products'])
+            self.assertEqual([row['product'] for row in precios.price_lists['arcor']['products']], products)
+
+            # El mismo archivo para otro proveedor es otra entrada
+            upload(self.client, path, 'otro')
+            self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = self.make_cache()
+        entries = {name: ([{'product': f'{name} {number}', 'price': float(number)} for number in range(200)], [name])
+                   for name in ('a', 'b', 'c')}
+        cache.put('a', *entries['a'])
+        cache.put('b', *entries['b'])
+        os.utime(cache._path('a'), (100, 100))
+        os.utime(cache._path('b'), (200, 200))
+        self.assertEqual(cache.get('a'), entries['a'])  # a pasa a ser la más reciente
+        cache.put('c', *entries['c'])
+
+        sizes = {name: os.path.getsize(cache._path(name)) for name in entries}
+        cache.max_bytes = sizes['a'] + sizes['c']
+        cache.evict()
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), entries['a'])
+        self.assertEqual(cache.get('c'), entries['c'])
+
+        # Un resultado más grande que toda la caché no se guarda
+        cache.put('d', [{'product': os.urandom(64).hex(), 'price': 1.0} for _ in range(200)], [])
+        self.assertIsNone(cache.get('d'))
+
+    def test_other_parser_version_is_discarded(self):
+        cache = self.make_cache()
+        cache.put('lista', [{'product': 'Alfajor', 'price': 10.0}], [])
+        self.assertIsNotNone(cache.get('lista'))
+
+        # Con reglas nuevas del parser lo guardado no vale: se borra al arrancar y no se encuentra
+        with mock.patch.object(precios, 'PARSER_VERSION', precios.PARSER_VERSION + 1):
+            newer = precios.ParsedListCache(cache.folder, cache.max_bytes)
+        self.assertEqual(os.listdir(cache.folder), [])
+        self.assertIsNone(newer.get('lista'))
+
+
+class BackgroundUploadTest(CatalogTestCase):
+    def test_status_reports_progress(self):
+        path = os.path.join(LISTAS, 'arcor.xlsx')
+        with redirect_stdout(io.StringIO()):
+            expected, _ = precios.processor.process_excel_file(path, 'arcor')
+        with pd.ExcelFile(path) as excel_file:
+            sheets = len(excel_file.sheet_names)
+
+        # La publicación espera a que la prueba mire el avance con el parseo ya terminado
+        parsed, release = threading.Event(), threading.Event()
+        store_price_list = precios.store_price_list
+        def store_when_released(*args):
+            parsed.set()
+            release.wait(30)
+            return store_price_list(*args)
+
+        with mock.patch.object(precios, 'store_price_list', store_when_released), \
+                mock.patch.object(precios.parsed_cache, 'get', return_value=None):
+            response = upload(self.client, path, 'arcor', background='1')
+            self.assertTrue(parsed.wait(60))
+            running = self.client.get(f"/upload/status/{response['job_id']}").get_json()
+            self.assertNotIn('arcor', precios.price_lists)
+            release.set()
+            job = wait_for_job(response['job_id'])
+        self.assertEqual((running['state'], running['supplier'], running['changes']), ('running', 'arcor', None))
+        self.assertEqual((running['total_sheets'], running['sheets_done']), (sheets, sheets))
+        self.assertEqual(running['products_accepted'], len(expected))
+        self.assertGreaterEqual(running['rows_parsed'], running['products_accepted'] + running['products_rejected'])
+
+        done = self.client.get(f"/upload/status/{response['job_id']}").get_json()
+        self.assertEqual(done, job.to_dict())
+        self.assertEqual((done['state'], done['cached'], done['products_accepted']), ('done', False, len(expected)))
+        self.assertEqual(done['changes']['added'], len(expected))
+        self.assertIsNotNone(done['finished_at'])
+        self.assertEqual(len(precios.price_lists['arcor']['products']), len(expected))
+
+    def test_status_reports_errors(self):
+        path = os.path.join(tempfile.mkdtemp(prefix='listas_'), 'vacia.xlsx')
+        pd.DataFrame({'Nota': ['sin productos ni precios']}).to_excel(path, index=False)
+        job = wait_for_job(upload(self.client, path, 'vacia', background='1')['job_id'])
+        status = self.client.get(f'/upload/status/{job.id}').get_json()
+        self.assertEqual(status['state'], 'error')
+        self.assertTrue(status['message'])
+        self.assertNotIn('vacia', precios.price_lists)
+
+    def test_status_is_shared_between_workers(self):
+        store = precios.StateStore(os.path.join(tempfile.mkdtemp(prefix='estado_'), 'state.db'))
+        with mock.patch.object(precios, 'ingest_job_statuses', precios.StateDict(store, 'ingest_jobs')):
+            job_id = upload(self.client, os.path.join(LISTAS, 'arcor.xlsx'), 'arcor', background='1')['job_id']
+            job = wait_for_job(job_id)
+            self.assertEqual(job.state, 'done')
+
+            # Otro worker no tiene la carga en memoria: la consulta sale de StateStore
+            with mock.patch.dict(precios.ingest_jobs, clear=True):
+                response = self.client.get(f'/upload/status/{job_id}')
+                missing = self.client.get('/upload/status/no-existe')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), job.to_dict())
+        self.assertEqual(missing.status_code, 404)
+
+
+class BulkUploadTest(CatalogTestCase):
+    def test_same_filename_for_two_suppliers(self):
+        expected = {}
+        for name in ('arcor', 'labomba'):
+            with redirect_stdout(io.StringIO()):
+                expected[name], _ = precios.processor.process_excel_file(os.path.join(LISTAS, f'{name}.xlsx'), name)
+
+        # Los dos archivos se llaman igual: cada uno tiene que parsearse desde su propio archivo temporal
+        data = {
+            'files': [(open(os.path.join(LISTAS, f'{name}.xlsx'), 'rb'), 'lista.xlsx') for name in expected],
+            'supplier_names': list(expected)
+        }
+        with mock.patch.object(precios.parsed_cache, 'get', return_value=None), redirect_stdout(io.StringIO()):
+            response = self.client.post('/upload/bulk', data=data, content_type='multipart/form-data').get_json()
+        for file, _ in data['files']:
+            file.close()
+
+        self.assertTrue(response['success'])
+        for result in response['results']:
+            products = expected[result['supplier']]
+            self.assertEqual(result['total_products'], len(products))
+            with pd.ExcelFile(os.path.join(LISTAS, f"{result['supplier']}.xlsx")) as excel_file:
+                self.assertEqual([sheet['sheet'] for sheet in result['sheets']], excel_file.sheet_names)
+            self.assertEqual([row['product'] for row in precios.price_lists[result['supplier']]['products']],
+                             [product['product'] for product in products])
+        self.assertEqual(os.listdir(precios.app.config['UPLOAD_FOLDER']), [])
+
+
+class SearchFreshnessTest(CatalogTestCase):
+    def test_search_cache_sees_reupload(self):
+        path = os.path.join(LISTAS, 'arcor.xlsx')
+        upload(self.client, path, 'arcor')
+        first = self.client.get('/search?q=bon o bon').get_json()
+        self.assertTrue(first['results'])
+
+        # Misma lista con todos los precios al doble: la búsqueda repetida no puede salir de la caché vieja
+        products, debug_info = precios.processor.process_excel_file(path, 'arcor')
+        doubled = [dict(product, price=product['price'] * 2) for product in products]
+        with redirect_stdout(io.StringIO()):
+            changes = precios.store_price_list('arcor', 'arcor.xlsx', doubled, debug_info)
+        self.assertEqual(changes['price_changed'], len(products))
+
+        second = self.client.get('/search?q=bon o bon').get_json()
+        self.assertEqual([result['price'] for result in second['results']],
+                         [result['price'] * 2 for result in first['results']])
+
+
+    def test_suggest_sees_upload_and_reupload(self):
+        path = os.path.join(LISTAS, 'arcor.xlsx')
+        upload(self.client, path, 'arcor')
+        products, debug_info = precios.processor.process_excel_file(path, 'arcor')
+        first = self.client.get('/ai/suggest?q=' + products[0]['product'][:4]).get_json()
+        self.assertTrue(first['suggestions'])
+
+        # Un producto nuevo aparece en el autocompletado apenas termina la recarga
+        with redirect_stdout(io.StringIO()):
+            precios.store_price_list('arcor', 'arcor.xlsx', products + [dict(products[0], product='Zzyzx de prueba', search_key=None)], debug_info)
+        self.assertEqual(self.client.get('/ai/suggest?q=zzyz').get_json()['suggestions'], ['zzyzx de prueba'])
+
+        # Y se va cuando se borra la lista
+        self.client.get('/remove_list/arcor')
+        self.assertEqual(self.client.get('/ai/suggest?q=zzyz').get_json()['suggestions'], [])
+
+    def test_suggest_summaries_match_full_build(self):
+        for name in ('arcor', 'chiches'):
+            upload(self.client, os.path.join(LISTAS, f'{name}.xlsx'), name)
+        tables = [data['products'] for data in precios.price_lists.values()]
+        full = precios.SuggestIndex.build(tables)
+        self.assertEqual(precios.suggest_index.keys, full.keys)
+        self.assertEqual(precios.suggest_index.labels, full.labels)
+        self.assertEqual(precios.suggest_index.ranks.tolist(), full.ranks.tolist())
+
+    def test_compare_sees_price_change(self):
+        for name in ('arcor', 'dulcemente', 'labomba'):
+            upload(self.client, os.path.join(LISTAS, f'{name}.xlsx'), name)
+        first = self.client.get('/compare?limit=1').get_json()
+        self.assertGreater(first['total'], 0)
+        # Con q se filtra la misma lista ya agrupada, en el mismo orden
+        filtered = self.client.get('/compare?q=bon o bon&limit=100').get_json()
+        self.assertLessEqual(filtered['total'], first['total'])
+        self.assertTrue(filtered['products'])
+        for product in filtered['products']:
+            keys = [precios.normalize_search_text(offer['product']) for offer in product['offers']]
+            self.assertTrue(any(all(fragment in key for fragment in ('bon', 'o')) for key in keys))
+
+        # El producto con más diferencia pasa a costar lo mismo en todos lados: deja de ser el primero
+        top = first['products'][0]
+        supplier = top['offers'][-1]['supplier']
+        path = os.path.join(LISTAS, f'{supplier}.xlsx')
+        products, debug_info = precios.processor.process_excel_file(path, supplier)
+        changed = [dict(product, price=top['min_price']) if product['product'] == top['offers'][-1]['product'] else product
+                   for product in products]
+        with redirect_stdout(io.StringIO()):
+            precios.store_price_list(supplier, f'{supplier}.xlsx', changed, debug_info)
+        second = self.client.get('/compare?limit=1').get_json()
+        self.assertNotEqual(second['products'][0]['offers'], top['offers'])
+
+
+class SearchNormalizationTest(CatalogTestCase):
+    def test_normalize_search_text(self):
+        examples = {
+            'Azúcar x1Kgs.': 'azucar x 1 kg',
+            'Aceite 1,5 Litros': 'aceite 1.5 lt',
+            'AZÚCAR': 'azucar',
+            'Café  Molido 500Grs': 'cafe molido 500 gr',
+            'Galletitas x12u.': 'galletitas x 12 un',
+            'ÑOQUIS': 'noquis',
+            'Leche 1.000 cc': 'leche 1.000 ml',
+            '  ': '',
+        }
+        for text, expected in examples.items():
+            with self.subTest(text=text):
+                self.assertEqual(precios.normalize_search_text(text), expected)
+
+    def test_keys_are_stored_at_ingestion_and_used_by_queries(self):
+        path = os.path.join(tempfile.mkdtemp(prefix='listas_'), 'almacen.xlsx')
+        pd.DataFrame({
+            'Producto': ['Azúcar x1Kgs.', 'AZUCAR LEDESMA 1 KG', 'Aceite 1,5 Litros', 'Café Molido 500Grs'],
+            'Precio': [1200, 1150, 2300, 4100]
+        }).to_excel(path, index=False)
+        with redirect_stdout(io.StringIO()):
+            products, _ = precios.processor.process_excel_file(path, 'almacen')
+        self.assertEqual([product['search_key'] for product in products],
+                         ['azucar x 1 kg', 'azucar ledesma 1 kg', 'aceite 1.5 lt', 'cafe molido 500 gr'])
+
+        upload(self.client, path, 'almacen')
+        self.assertEqual(list(precios.price_lists['almacen']['products'].search_keys), [product['search_key'] for product in products])
+        # La consulta pasa por la misma normalización: acentos, mayúsculas y unidades escritas de otra forma
+        for query, expected in (('azúcar 1kg', ['AZUCAR LEDESMA 1 KG', 'Azúcar x1Kgs.']), ('ACEITE 1.5 l', ['Aceite 1,5 Litros']),
+                                ('cafe 500 gramos', ['Café Molido 500Grs'])):
+            with self.subTest(query=query):
+                response = self.client.get('/search', query_string={'q': query}).get_json()
+                self.assertEqual([result['product'] for result in response['results']], expected)
+
+
+class SearchPagingTest(CatalogTestCase):
+    def test_pages_cover_all_matches_by_price(self):
+        for name in ('arcor', 'labomba', 'chiches'):
+            upload(self.client, os.path.join(LISTAS, f'{name}.xlsx'), name)
+        expected = sorted((row['price'], row['id']) for entry in precios.price_lists.values() for row in entry['products']
+                          if 'alf' in precios.normalize_search_text(row['product']))
+        self.assertGreater(len(expected), 20)
+
+        pages = []
+        offset = 0
+        while True:
+            page = self.client.get('/search', query_string={'q': 'Alf', 'limit': 7, 'offset': offset}).get_json()
+            self.assertEqual((page['total'], page['offset'], page['limit']), (len(expected), offset, 7))
+            self.assertEqual(len(page['results']), min(7, len(expected) - offset))
+            self.assertEqual(page['has_more'], offset + 7 < len(expected))
+            pages.extend(page['results'])
+            if not page['has_more']:
+                break
+            offset += 7
+        # Las páginas seguidas son la lista entera, de la más barata a la más cara
+        self.assertEqual(sorted((result['price'], result['id']) for result in pages), expected)
+        self.assertEqual([result['price'] for result in pages], [price for price, _ in expected])
+        single = self.client.get('/search', query_string={'q': 'alf', 'limit': 500}).get_json()
+        self.assertEqual(single['results'], pages)
+        self.assertFalse(single['has_more'])
+
+        # Más allá del final no hay resultados; limit fuera de rango se ajusta
+        beyond = self.client.get('/search', query_string={'q': 'alf', 'offset': len(expected)}).get_json()
+        self.assertEqual((beyond['results'], beyond['has_more'], beyond['total']), ([], False, len(expected)))
+        self.assertEqual(self.client.get('/search?q=alf&limit=0').get_json()['limit'], 1)
+        self.assertEqual(self.client.get('/search?q=alf&limit=100000').get_json()['limit'], precios.app.config['SEARCH_MAX_LIMIT'])
+        self.assertEqual(self.client.get('/search?q=alf').get_json()['limit'], precios.app.config['SEARCH_PAGE_SIZE'])
+
+
+class SearchBatchTest(CatalogTestCase):
+    def test_batch_matches_single_searches(self):
+        for name in ('arcor', 'labomba'):
+            upload(self.client, os.path.join(LISTAS, f'{name}.xlsx'), name)
+        queries = ['bon o bon', 'Bon O Bon', 'alfajr triple', 'x 12', '', 'inexistente']
+        response = self.client.post('/search/batch', json={'queries': queries, 'limit': 4, 'typos': 1})
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual((data['limit'], data['typos'], data['suppliers_count']), (4, 1, 2))
+
+        # Un renglón por consulta, en el mismo orden, con lo mismo que /search (las 4 más baratas)
+        self.assertEqual([result['query'] for result in data['results']], queries)
+        for query, result in zip(queries, data['results']):
+            with self.subTest(query=query):
+                single = self.client.get('/search', query_string={'q': query, 'limit': 4, 'typos': 1}).get_json()
+                self.assertEqual(result['normalized'], precios.normalize_search_text(query))
+                self.assertEqual((result['total'], result['results']), (single['total'], single['results']))
+        self.assertEqual(data['found'], sum(1 for result in data['results'] if result['total']))
+        self.assertEqual(data['results'][0]['results'], data['results'][1]['results'])
+        self.assertEqual(len(self.client.post('/search/batch', json={'queries': ['bon o bon']}).get_json()['results'][0]['results']),
+                         precios.app.config['SEARCH_BATCH_PAGE_SIZE'])
+
+    def test_rejects_bad_requests(self):
+        too_many = ['alfajor'] * (precios.app.config['SEARCH_BATCH_MAX_QUERIES'] + 1)
+        for body in ({}, {'queries': 'alfajor'}, {'queries': ['alfajor', 3]}, {'queries': too_many}, {'queries': ['alfajor'], 'limit': 'diez'}):
+            with self.subTest(body=str(body)[:60]):
+                response = self.client.post('/search/batch', json=body)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.get_json())
+
+
+class TokenIndexTest(CatalogTestCase):
+    QUERIES = ['alf', 'bon o', 'x 12', 'chocolate blanco', 'inexistente']
+
+    def assert_index_matches_names(self):
+        """Cada lista publicada responde con su índice lo mismo que recorriendo los nombres (la última palabra como prefijo)"""
+        for supplier, entry in precios.price_lists.items():
+            table = entry['products']
+            for query in self.QUERIES:
+                tokens = precios.tokenize_product_name(query)
+                expected = [row for row in table.live_rows().tolist()
+                            if all(token in table.search_keys[row].split() for token in tokens[:-1])
+                            and any(word.startswith(tokens[-1]) for word in table.search_keys[row].split())]
+                with self.subTest(supplier=supplier, query=query):
+                    self.assertEqual(precios.search_table(table, [], tokens, 0).tolist(), expected)
+
+    def test_index_follows_upload_remove_and_clear(self):
+        for name in ('arcor', 'labomba'):
+            upload(self.client, os.path.join(LISTAS, f'{name}.xlsx'), name)
+        self.assert_index_matches_names()
+        both = self.client.get('/search?q=bon o bon&limit=100').get_json()
+        self.assertEqual({result['supplier'] for result in both['results']}, {'arcor', 'labomba'})
+
+        self.client.get('/remove_list/arcor')
+        self.assertEqual(list(precios.price_lists), ['labomba'])
+        self.assert_index_matches_names()
+        remaining = self.client.get('/search?q=bon o bon&limit=100').get_json()
+        self.assertEqual(remaining['results'], [result for result in both['results'] if result['supplier'] == 'labomba'])
+        self.assertEqual(remaining['total'], len(remaining['results']))
+
+        with redirect_stdout(io.StringIO()):
+            self.client.get('/clear')
+        self.assertEqual(self.client.get('/search?q=bon o bon').get_json()['results'], [])
+
+        # Después de vaciar el catálogo una lista nueva vuelve a quedar indexada
+        upload(self.client, os.path.join(LISTAS, 'labomba.xlsx'), 'labomba')
+        self.assert_index_matches_names()
+        self.assertEqual(self.client.get('/search?q=bon o bon&limit=100').get_json()['results'], remaining['results'])
+
+
+class CatalogMappingTest(unittest.TestCase):
+    def test_saved_indexes_are_mapped(self):
+        store = precios.CatalogStore(tempfile.mkdtemp(prefix='catalogo_'))
+        # Con nombres normalizados ASCII el texto de trigramas se mapea; si no, se lee entero
+        for names, text_type in ((['Alfajor Triple', 'Bon o Bon x 30', 'Straße 500 g'], precios.MappedText),
+                                 (['Té verde 日本 x 20', 'Alfajor Triple'], str)):
+            with self.subTest(names=names):
+                table = precios.ProductTable('prueba')
+                table.append_records([{'product': name, 'price': 10.0, 'sheet': 'Hoja1'} for name in names])
+                table.update_search_indexes()
+                entry = {'filename': 'prueba.xlsx', 'upload_date': '', 'products': table, 'total_products': len(table), 'debug_info': []}
+                with redirect_stdout(io.StringIO()):
+                    store.save('prueba', entry)
+                _, loaded = store.load(store._supplier_folder('prueba'))
+                loaded = loaded['products']
+
+                self.assertIsInstance(loaded.token_index.vocabulary, precios.MappedStrings)
+                self.assertIsInstance(loaded.trigram_index.text, text_type)
+                self.assertEqual(list(loaded.token_index.vocabulary), list(table.token_index.vocabulary))
+                for query in ('alfajor', 'bon x', 'verde', 'strasse 500'):
+                    tokens = precios.tokenize_product_name(query)
+                    self.assertEqual(loaded.token_index.lookup(tokens).tolist(), table.token_index.lookup(tokens).tolist())
+                    for typos in (0, 1):
+                        self.assertEqual(loaded.trigram_index.lookup(query.split(), typos).tolist(),
+                                         table.trigram_index.lookup(query.split(), typos).tolist())
+
+
+class WarmStartTest(CatalogTestCase):
+    def test_catalog_is_recovered_after_restart(self):
+        path = os.path.join(LISTAS, 'arcor.xlsx')
+        upload(self.client, path, 'arcor')
+        upload(self.client, os.path.join(LISTAS, 'labomba.xlsx'), 'labomba')
+        # Una recarga con un producto nuevo: queda en el índice aparte y se guarda así
+        with redirect_stdout(io.StringIO()):
+            products, debug_info = precios.processor.process_excel_file(path, 'arcor')
+            precios.store_price_list('arcor', 'arcor.xlsx', products + [dict(products[0], product='Zzyzx de prueba', search_key=None)], debug_info)
+        queries = ['bon o bon', 'alfajor', 'zzyzx', 'chocolte']
+        before = [self.client.get('/search', query_string={'q': query, 'typos': 1, 'limit': 100}).get_json() for query in queries]
+        lists = sorted(self.client.get('/lists').get_json()['lists'], key=lambda entry: entry['supplier'])
+
+        # Reinicio: el proceso arranca con el catálogo vacío y lo lee de catalog/ (lo derivado se arma al toque)
+        with precios.catalog_lock:
+            precios.price_lists.clear()
+            precios.catalog_changed()
+        with mock.patch.object(precios.threading, 'Thread', lambda target, daemon: SimpleNamespace(start=target)), \
+                redirect_stdout(io.StringIO()):
+            precios.load_saved_catalog()
+
+        table = precios.price_lists['arcor']['products']
+        self.assertIsInstance(table.names, precios.MappedStrings)
+        self.assertIsNotNone(table.delta_indexes)
+        self.assertEqual(sorted(self.client.get('/lists').get_json()['lists'], key=lambda entry: entry['supplier']), lists)
+        after = [self.client.get('/search', query_string={'q': query, 'typos': 1, 'limit': 100}).get_json() for query in queries]
+        self.assertEqual(after, before)
+        self.assertEqual(after[2]['total'], 1)
+        self.assertEqual(self.client.get('/ai/suggest?q=zzyz').get_json()['suggestions'], ['zzyzx de prueba'])
+
+
+class ConcurrentPublishTest(CatalogTestCase):
+    def test_reads_while_lists_are_published(self):
+        path = os.path.join(LISTAS, 'arcor.xlsx')
+        products, debug_info = precios.processor.process_excel_file(path, 'arcor')
+        products = products[:100]
+        upload(self.client, os.path.join(LISTAS, 'chiches.xlsx'), 'chiches')
+
+        # Se publican y se borran listas mientras se busca: ninguna lectura puede fallar por el cambio de price_lists
+        def publish():
+            with redirect_stdout(io.StringIO()):
+                for number in range(15):
+                    precios.store_price_list(f'arcor{number}', 'arcor.xlsx', products, debug_info)
+                    if number % 3 == 0:
+                        precios.app.test_client().get(f'/remove_list/arcor{number}')
+
+        publisher = threading.Thread(target=publish)
+        publisher.start()
+        statuses = []
+        while publisher.is_alive():
+            statuses.append(self.client.get(f'/search?q=bon&offset={len(statuses)}').status_code)
+            statuses.append(self.client.post('/search/batch', json={'queries': ['bon o bon', 'alfajor']}).status_code)
+            statuses.append(self.client.get('/lists').status_code)
+            statuses.append(self.client.get('/compare?limit=5').status_code)
+        publisher.join()
+
+        self.assertEqual(set(statuses), {200})
+        self.assertEqual(len(self.client.get('/lists').get_json()['lists']), 1 + 10)
+
+
+class ReuploadDiffTest(CatalogTestCase):
+    def test_reupload_applies_only_the_diff(self):
+        path = os.path.join(LISTAS, 'dulcemente.xlsx')
+        products, debug_info = precios.processor.process_excel_file(path, 'dulcemente')
+        with redirect_stdout(io.StringIO()):
+            precios.store_price_list('dulcemente', 'dulcemente.xlsx', products, debug_info)
+        published = precios.price_lists['dulcemente']['products']
+        ids = {row['product']: row['id'] for row in published}
+        live_before = len(published)
+
+        # Se van los 10 primeros, el siguiente cambia de precio y aparece uno nuevo
+        new_products = [dict(product) for product in products[10:]]
+        new_products[0]['price'] += 1
+        new_products.append(dict(products[-1], product='Producto nuevo de prueba', price=99.0, search_key=None))
+        with redirect_stdout(io.StringIO()):
+            changes = precios.store_price_list('dulcemente', 'dulcemente.xlsx', new_products, debug_info)
+
+        removed_names = {product['product'] for product in products[:10]} - {product['product'] for product in new_products}
+        self.assertEqual(changes['removed'], 10)
+        self.assertEqual(changes['added'], 1)
+        self.assertEqual(changes['price_changed'], 1)
+
+        # La tabla que estaba publicada no cambió: el diff se aplicó sobre una copia
+        self.assertEqual(len(published), live_before)
+        self.assertEqual(published.row(published.find_id(ids[new_products[0]['product']]))['price'], products[10]['price'])
+
+        table = precios.price_lists['dulcemente']['products']
+        self.assertIsNot(table, published)
+        self.assertEqual(len(table), len(new_products))
+        # Los productos que siguen conservan su id y los que se fueron ya no se encuentran
+        for product in new_products[:-1]:
+            row = table.find_id(ids[product['product']])
+            self.assertIsNotNone(row)
+            self.assertEqual(table.row(row)['price'], product['price'])
+        for name in removed_names:
+            self.assertIsNone(table.find_id(ids[name]))
+
+    def test_repeated_names_keep_their_ids(self):
+        def products(*names):
+            return [{'product': name, 'price': 100.0 + number, 'sheet': 'Hoja1'} for number, name in enumerate(names)]
+
+        with redirect_stdout(io.StringIO()):
+            precios.store_price_list('prueba', 'prueba.xlsx', products('Alfajor', 'Alfajor', 'Bombón'), [])
+            first = [row['id'] for row in precios.price_lists['prueba']['products']]
+            # Se va la segunda aparición de "Alfajor": la primera conserva su id y Bombón solo cambia de precio
+            changes = precios.store_price_list('prueba', 'prueba.xlsx', products('Alfajor', 'Bombón'), [])
+        self.assertEqual((changes['added'], changes['removed'], changes['price_changed'], changes['unchanged']), (0, 1, 1, 1))
+        self.assertEqual([row['id'] for row in precios.price_lists['prueba']['products']], [first[0], first[2]])
+
+    def test_small_reupload_indexes_only_the_new_rows(self):
+        products, debug_info = precios.processor.process_excel_file(os.path.join(LISTAS, 'dulcemente.xlsx'), 'dulcemente')
+        with redirect_stdout(io.StringIO()):
+            precios.store_price_list('dulcemente', 'dulcemente.xlsx', products, debug_info)
+        published = precios.price_lists['dulcemente']['products']
+
+        new_products = [dict(product) for product in products[1:]]
+        new_products[0]['price'] += 1
+        new_products.append(dict(products[-1], product='Alfajor Zuzu Triple', price=1.0, search_key=None))
+        with redirect_stdout(io.StringIO()):
+            precios.store_price_list('dulcemente', 'dulcemente.xlsx', new_products, debug_info)
+        table = precios.price_lists['dulcemente']['products']
+
+        # El índice principal es el mismo; la fila nueva se buscó en el índice aparte
+        self.assertIs(table.token_index, published.token_index)
+        self.assertEqual(table.delta_indexes[0], len(table.alive))
+        rows = table.live_rows()
+        token_index, trigram_index = precios.TokenIndex.build(table, rows), precios.TrigramIndex.build(table, rows)
+        for fragments, typos in ((['zuzu'], 0), (['alfajr', 'trple'], 1), (['al'], 0), (products[5]['search_key'].split()[:2], 0)):
+            with self.subTest(fragments=fragments):
+                expected = trigram_index.lookup(fragments, typos)
+                if expected is None:
+                    expected = token_index.lookup(fragments)
+                self.assertEqual(precios.search_table(table, fragments, fragments, typos).tolist(), expected[table.alive[expected]].tolist())
+
+        # Las coincidencias entre proveedores partieron del perfil anterior y quedó igual que armándolo de cero
+        profile, full = precios.product_matcher.profiles['dulcemente'], precios.product_matcher._profile(table)
+        self.assertEqual(profile['rows'].tolist(), full['rows'].tolist())
+        self.assertEqual((profile['counts'] != full['counts']).nnz, 0)
+        self.assertEqual((profile['words'], profile['numbers'].tolist()), (full['words'], full['numbers'].tolist()))
+
+        # El autocompletado solo resumió los nombres que cambiaron y quedó igual que resumiendo toda la tabla
+        pd.testing.assert_frame_equal(precios.suggest_summaries[table.uid], precios.SuggestIndex.summarize(table))
+        self.assertEqual(precios.suggest_index.lookup('alfajor zu'), ['alfajor zuzu triple'])
+
+
+
+def cart_product(number, supplier, price):
+    return {'id': f'{supplier}_{number:016x}', 'product': f'Producto {number}', 'price': price, 'supplier': supplier}
+
+
+class CartSubtotalsMixin:
+    """Pruebas comunes a Cart y SharedCart (make_cart arma un carrito vacío)"""
+    def test_subtotals_follow_changes(self):
+        cart = self.make_cart()
+        cart.add(cart_product(1, 'arcor', 10.5), 2)
+        cart.add(cart_product(2, 'arcor', 3.0), 1)
+        cart.add(cart_product(3, 'labomba', 7.25), 4)
+        cart.add(cart_product(1, 'arcor', 10.5), 1)
+        self.assertEqual(cart.supplier_totals, {'arcor': 34.5, 'labomba': 29.0})
+        self.assertEqual(cart.total, 63.5)
+
+        self.assertTrue(cart.set_quantity(cart_product(3, 'labomba', 7.25)['id'], 2))
+        self.assertTrue(cart.remove(cart_product(2, 'arcor', 3.0)['id']))
+        self.assertFalse(cart.remove('arcor_no_existe'))
+        self.assertEqual(cart.supplier_totals, {'arcor': 31.5, 'labomba': 14.5})
+
+        data = cart.to_dict()
+        self.assertEqual(data['total'], 46.0)
+        self.assertEqual(data['total_formatted'], '$46.00')
+        self.assertEqual({supplier: [item['quantity'] for item in items] for supplier, items in data['suppliers'].items()},
+                         {'arcor': [3], 'labomba': [2]})
+        self.assertEqual(sorted(item['id'] for item in data['cart']), sorted(item['id'] for item in cart))
+
+        # Sin renglones de un proveedor su subtotal desaparece (no queda en 0.000001)
+        self.assertTrue(cart.set_quantity(cart_product(3, 'labomba', 7.25)['id'], 0))
+        self.assertEqual(cart.supplier_totals, {'arcor': 31.5})
+        self.assertEqual(list(cart.by_supplier), ['arcor'])
+        cart.clear()
+        self.assertEqual((len(cart), cart.total), (0, 0))
+
+
+class CartTest(CartSubtotalsMixin, unittest.TestCase):
+    def make_cart(self):
+        return precios.Cart()
+
+
+class SharedCartTest(CartSubtotalsMixin, unittest.TestCase):
+    def setUp(self):
+        self.store = precios.StateStore(os.path.join(tempfile.mkdtemp(prefix='state_'), 'state.db'))
+
+    def make_cart(self):
+        return precios.SharedCart(self.store, 'usuario')
+
+    def test_concurrent_adds_keep_subtotals(self):
+        # Cada thread usa su propia conexión, como dos workers sobre la misma base
+        def add_many():
+            cart = self.make_cart()
+            for _ in range(50):
+                cart.add(cart_product(1, 'arcor', 1.5), 1)
+                cart.add(cart_product(2, 'labomba', 2.0), 1)
+
+        threads = [threading.Thread(target=add_many) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        cart = self.make_cart()
+        self.assertEqual([item['quantity'] for item in cart], [200, 200])
+        self.assertEqual(cart.supplier_totals, {'arcor': 300.0, 'labomba': 400.0})
+
+
+
+class OrderPdfTest(unittest.TestCase):
+    def setUp(self):
+        self.client = precios.app.test_client()
+        with self.client.session_transaction() as session:
+            session['user'] = 'pdfs'
+        precios.business_data['pdfs'] = {'business_name': 'Kiosco', 'address': 'Calle 1', 'phone': '1', 'email': 'e'}
+        cart = precios.user_cart('pdfs')
+        cart.clear()
+        for number, supplier in enumerate(('arcor', 'labomba', 'chiches')):
+            cart.add(cart_product(number, supplier, 100.0 + number), 2)
+
+    def generate(self, render, pool=None):
+        # El pool en threads para que el PDF simulado valga también dentro de las tareas
+        with ThreadPoolExecutor(max_workers=3) as threads, \
+                mock.patch.object(precios, 'get_process_pool', return_value=pool or threads), \
+                mock.patch.object(precios, 'render_order_pdf', side_effect=render), redirect_stdout(io.StringIO()):
+            return self.client.post('/cart/generate_pdfs').get_json()
+
+    def test_one_failing_supplier_does_not_stop_the_others(self):
+        def render(supplier_name, items, business_data):
+            if supplier_name == 'labomba':
+                raise ValueError('fuente rota')
+            return b'%PDF-' + supplier_name.encode()
+
+        response = self.generate(render)
+        self.assertTrue(response['success'])
+        self.assertEqual([pdf['supplier'] for pdf in response['pdfs']], ['arcor', 'chiches'])
+        self.assertEqual(response['failed'], [{'supplier': 'labomba', 'error': 'fuente rota', 'seconds': response['failed'][0]['seconds']}])
+        # Los enlaces de WhatsApp salen para todos, también para el que falló
+        self.assertEqual(len(response['whatsapp_links']), 3)
+        for pdf in response['pdfs']:
+            download = self.client.get(f"/download_pdf/{pdf['filename']}")
+            self.assertEqual(download.data, b'%PDF-' + pdf['supplier'].encode())
+
+    def test_all_failing_reports_error(self):
+        def render(supplier_name, items, business_data):
+            raise RuntimeError('sin papel')
+
+        response = self.generate(render)
+        self.assertFalse(response['success'])
+        self.assertEqual(len(response['failed']), 3)
+        self.assertIn('sin papel', response['error'])
+
+    def test_broken_pool_falls_back_to_this_process(self):
+        def render(supplier_name, items, business_data):
+            return b'%PDF-' + supplier_name.encode()
+
+        class DeadWorkerPool:
+            """Acepta las tareas pero el proceso se muere antes de terminarlas"""
+            def submit(self, *args):
+                future = Future()
+                future.set_exception(BrokenProcessPool('proceso muerto'))
+                return future
+
+        class BrokenPool:
+            """Ya roto: no acepta tareas (tampoco el que lo reemplaza)"""
+            def submit(self, *args):
+                raise BrokenProcessPool('pool roto')
+
+            def shutdown(self, **kwargs):
+                pass
+
+        for pool in (DeadWorkerPool(), BrokenPool()):
+            with self.subTest(pool=type(pool).__name__):
+                response = self.generate(render, pool)
+                self.assertTrue(response['success'])
+                self.assertEqual(response['failed'], [])
+                self.assertEqual([pdf['supplier'] for pdf in response['pdfs']], ['arcor', 'labomba', 'chiches'])
+
+
+class ProcessPoolRecoveryTest(unittest.TestCase):
+    def test_broken_pool_is_replaced(self):
+        with mock.patch.dict(precios.app.config, PDF_POOL_WORKERS=1), mock.patch.dict(precios.process_pools, clear=True):
+            broken = precios.get_process_pool('pdf')
+            with self.assertRaises(BrokenProcessPool):
+                broken.submit(os._exit, 1).result()
+            # El próximo pedido no falla: el pool roto se reemplaza
+            self.assertEqual(precios.submit_to_pool('pdf', abs, -3).result(), 3)
+            self.assertIsNot(precios.get_process_pool('pdf'), broken)
+            precios.get_process_pool('pdf').shutdown()
+
+    def test_sheets_of_a_dead_worker_are_retried(self):
+        failed = Future()
+        failed.set_exception(BrokenProcessPool('proceso muerto'))
+        retried = Future()
+        retried.set_result([([{'product': 'Alfajor'}], ['Hoja1: 1 producto'], 0.1, {'rejected': 0})])
+        products, debug_info, sheets = precios.collect_sheet_results(['Hoja1'], [(['Hoja1'], failed, lambda group: retried)])
+        self.assertEqual(products, [{'product': 'Alfajor'}])
+        self.assertEqual(sheets[0]['products'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()